@@ -14,7 +14,18 @@ from src.module import neo4j_conn
 from src.module import llm_agents
 from src.module import utils
 from src.module import llm_agents_static
+from src.module import pipeline
+from src.module import agent_factory
+from src.module import rule_engine as rule_engine_module
+from src.module import prompt_preparation
+from src.module.registry import registry
+from src.module.progress import progress
+from src.module.candidate_filter import load_candidate_filter
+from src.module.gazetteer import load_gazetteer
+from src.module.identifier_memory import IdentifierMemory
 from src.evaluate import prepare_evaluation
+from src.evaluate import reevaluate
+from src.evaluate.span_cache import SpanCache
 from src.module.utils import extract_pii_dynamic as _sync_extract_pii_dynamic
 
 load_dotenv()
@@ -51,6 +62,22 @@ def set_up_argparse():
         help="Whether to refine the prompts or not."
     )
 
+    parser.add_argument(
+        "--refine_candidates",
+        type=int,
+        default=1,
+        required=False,
+        help="Number of prompt revisions refined in parallel per round."
+    )
+
+    parser.add_argument(
+        "--refine_budget",
+        type=float,
+        default=None,
+        required=False,
+        help="Wall-clock budget in seconds of the parallel refinement."
+    )
+
     parser.add_argument(
         "--generate_new_prompt",
         type=int,
@@ -70,6 +97,100 @@ def set_up_argparse():
     return parser
 
 
+def set_up_prepare_argparse():
+    """Set up the argument parser of the prepare-prompts subcommand."""
+    parser = argparse.ArgumentParser(
+        prog="main.py prepare-prompts",
+        description="Generate the prompts of all PIIs ahead of time."
+    )
+    parser.add_argument(
+        "--version",
+        type=str,
+        required=False,
+        help="Name of the prompt version, defaults to the current time."
+    )
+
+    parser.add_argument(
+        "--refine",
+        type=int,
+        default=0,
+        required=False,
+        help="Whether to refine the prompts or not."
+    )
+
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=8,
+        required=False,
+        help="Number of PIIs prepared concurrently."
+    )
+
+    return parser
+
+
+def create_prompt_versions_path() -> str:
+    """
+    Returns the folder holding the prompt versions prepared ahead of the
+    document processing.
+
+    Returns:
+        str: The folder of the prompt versions.
+    """
+    return os.path.abspath(os.path.join(
+        os.path.dirname(__file__),
+        "../../generated_prompts/versions"
+    ))
+
+
+async def prepare_prompts(
+    version: str,
+    base_url: str,
+    model_name_prompt_creater: str,
+    model_name_meta_expert: str,
+    api_key: str,
+    temperature: float,
+    refine_prompts: bool = False,
+    max_workers: int = 8
+) -> str:
+    """
+    Generates the extracting, verifying and issue prompts of all PIIs
+    in parallel and stores them as a new prompt version, see
+    prompt_preparation.prepare_prompts. Returns the folder of the version.
+    """
+    (
+        prompt_handcrafted_folder,
+        _,
+        property_yml_file_path,
+        prompt_config_yml_path,
+        guidelines_path_extracting,
+        guidelines_path_issue,
+        guidelines_path_verify
+    ) = create_paths(doc_id=version)
+    progress.message(f"Preparing prompt version: {version}")
+    return await asyncio.to_thread(
+        prompt_preparation.prepare_prompts,
+        versions_folder=create_prompt_versions_path(),
+        version=version,
+        pii_names=list(registry.read_yaml(property_yml_file_path).keys()),
+        prompt_handcrafted_folder=prompt_handcrafted_folder,
+        property_yml_file_path=property_yml_file_path,
+        prompt_config_yml_path=prompt_config_yml_path,
+        guidelines_paths={
+            "extracting": guidelines_path_extracting,
+            "verifying": guidelines_path_verify,
+            "issue": guidelines_path_issue
+        },
+        base_url=base_url,
+        model_name_prompt_creater=model_name_prompt_creater,
+        model_name_meta_expert=model_name_meta_expert,
+        api_key=api_key,
+        temperature=temperature,
+        refine_prompts=refine_prompts,
+        max_workers=max_workers
+    )
+
+
 def create_paths(doc_id: str) -> tuple[str, str, str, str, str, str, str]:
     """
     Create paths for various files and folders used in the project.
@@ -99,7 +220,7 @@ def create_paths(doc_id: str) -> tuple[str, str, str, str, str, str, str]:
         file_path,
         f"../../generated_prompts/{doc_id}"
     ))
-    print(f"prompt_folder_to_save: {prompt_folder_to_save}")
+    logger.info(f"prompt_folder_to_save: {prompt_folder_to_save}")
     property_yml_file_path = os.path.abspath(os.path.join(
         file_path,
         "../../entity_description/properties.yml"
@@ -192,14 +313,14 @@ def read_text_file(file_path) -> str:
         The content of the text file.
     """
     if not os.path.isfile(file_path):
-        print(f"Error: {file_path} is not a valid file.")
+        progress.message(f"Error: {file_path} is not a valid file.")
         return None
 
     try:
         with open(file_path, 'r', encoding='utf-8') as file:
             return file.read()
     except Exception as e:
-        print(f"An error occurred while reading the file: {e}")
+        progress.message(f"An error occurred while reading the file: {e}")
         return None
 
 
@@ -211,6 +332,8 @@ def extract_pii_static(
     model_name: str,
     temperature: float,
     conn: neo4j_conn.Neo4jConnection,
+    structured_output: bool = False,
+    parallel_chunks: bool = False,
 ) -> None:
     """
     Extract PII using static methods.
@@ -231,6 +354,10 @@ def extract_pii_static(
         The temperature for the LLM API.
     conn : neo4j_conn.Neo4jConnection
         The Neo4j connection object.
+    structured_output : bool
+        If True, JSON schema constrained output is requested.
+    parallel_chunks : bool
+        If True, the chunks are extracted concurrently.
 
     Returns:
     -------
@@ -249,7 +376,9 @@ def extract_pii_static(
         temperature=temperature,
         api_key=api_key,
         base_url=base_url,
-        conn=conn
+        conn=conn,
+        structured_output=structured_output,
+        parallel_chunks=parallel_chunks
     )
 
 
@@ -264,11 +393,40 @@ async def extract_pii_dynamic(
     conn: neo4j_conn.Neo4jConnection,
     temperature: float,
     refine_prompts: bool,
-    generate_new_prompt: bool
-) -> None:
+    generate_new_prompt: bool,
+    structured_output: bool = False,
+    refine_candidates: int = 1,
+    refine_budget: float = None,
+    candidate_filter: bool = False,
+    rule_engine: bool = False,
+    gazetteer: bool = False,
+    identifier_memory: IdentifierMemory = None,
+    speculative: bool = False,
+    prepared_prompt_folder: str = None,
+    masked_identifiers: dict[str, list[str]] = None
+) -> dict[str, list[str]]:
     """
     Extract PII using dynamic methods with a concurrency limit of 4.
+    With refine_candidates > 1, prompts are refined by the parallel
+    feedback loop within refine_budget seconds.
+    With candidate_filter, chunks without local evidence for a PII are
+    skipped or extracted with a single call (see candidate_filter.yml).
+    With rule_engine, the structured PIIs (code, date, duration, quantity,
+    age_number) are extracted by the rule engine instead of the
+    meta-prompting loop, the LLM only confirms borderline matches.
+    With gazetteer, the names of entity_description/gazetteers found in a
+    chunk are passed to the extraction of their PII as hints, chunks in
+    which every capitalized word is a known name skip the LLM.
+    With identifier_memory, the identifiers confirmed in previous documents
+    are added to the hints, the masked_identifiers of a PII are not sent
+    to the verifier. With speculative, chunks whose first solutions
+    all pass the verification are committed without meta expert rounds.
+    With prepared_prompt_folder, the prompts of a version prepared ahead
+    of time are used instead of generating them mid-conversation.
+    Returns the identifiers the verifier passed keyed by PII name, the
+    rule engine contributes none.
     """
+    masked_identifiers = masked_identifiers or {}
     # 1) Build local paths
     (
         prompt_handcrafted_folder,
@@ -285,19 +443,34 @@ async def extract_pii_dynamic(
     )
 
     # 2) Load PII definitions
-    property_dict = utils.read_yaml(property_yml_file_path)
+    property_dict = registry.read_yaml(property_yml_file_path)
+    pii_filter = None
+    if candidate_filter:
+        pii_filter = load_candidate_filter(
+            property_yml_file_path=property_yml_file_path,
+            config_path=os.path.join(
+                os.path.dirname(property_yml_file_path),
+                "candidate_filter.yml"
+            )
+        )
+
+    pii_gazetteer = None
+    if gazetteer:
+        pii_gazetteer = load_gazetteer(os.path.join(
+            os.path.dirname(property_yml_file_path), "gazetteers"
+        ))
 
     # 3) Define concurrency limit
     semaphore = asyncio.Semaphore(19)
 
-    async def sem_task(pii_name: str):
+    async def sem_task(pii_name: str) -> tuple[str, list[str]]:
         async with semaphore:
-            return await asyncio.to_thread(
+            return pii_name, await asyncio.to_thread(
                 _sync_extract_pii_dynamic,
                 pii_name=pii_name,
                 category="independent",
                 text=text,
-                drop_category=True,
+                drop_category=False,
                 prompt_handcrafted_folder=prompt_handcrafted_folder,
                 prompt_folder_to_save=prompt_folder_to_save,
                 model_name_prompt_creater=model_name_prompt_creater,
@@ -312,17 +485,66 @@ async def extract_pii_dynamic(
                 conn=conn,
                 generate_new_prompt=generate_new_prompt,
                 refine_prompts=refine_prompts,
+                refine_candidates=refine_candidates,
+                refine_time_budget=refine_budget,
                 temperature=temperature,
                 base_url=base_url,
-                doc_id=doc_id
+                doc_id=doc_id,
+                structured_output=structured_output,
+                candidate_filter=pii_filter,
+                gazetteer=pii_gazetteer,
+                identifier_memory=identifier_memory,
+                speculative=speculative,
+                prepared_prompt_folder=prepared_prompt_folder,
+                masked_identifiers=masked_identifiers.get(pii_name)
             )
 
     # 4) Create and run tasks
-    tasks = [
+    pii_names = list(property_dict.keys())
+    tasks = []
+    if rule_engine:
+        engine = rule_engine_module.RuleEngine()
+        rule_pii_names = [
+            pii_name for pii_name in engine.pii_names
+            if pii_name in property_dict
+        ]
+        pii_names = [
+            pii_name for pii_name in pii_names
+            if pii_name not in rule_pii_names
+        ]
+        tasks.append(asyncio.create_task(asyncio.to_thread(
+            rule_engine_module.extract_pii_rules,
+            engine=engine,
+            texts=utils.split_text(text),
+            doc_id=doc_id,
+            conn=conn,
+            property_dict=property_dict,
+            agent=agent_factory.get_agent(
+                model_name=model_name_meta_expert,
+                base_url=base_url,
+                temperature=temperature,
+                api_key=api_key_meta_expert,
+                structured_output=structured_output
+            ),
+            confirm_prompt=registry.read_text(os.path.join(
+                prompt_handcrafted_folder, "rules", "confirm_borderline.md"
+            )),
+            pii_names=rule_pii_names
+        )))
+    conn.drop_node_categories(
+        categories=[pii_name.title() for pii_name in pii_names],
+        doc_id=doc_id
+    )
+    pii_tasks = [
         asyncio.create_task(sem_task(pii_name))
-        for pii_name in property_dict.keys()
+        for pii_name in pii_names
     ]
-    await asyncio.gather(*tasks)
+    await asyncio.gather(*tasks, *pii_tasks)
+    return {
+        pii_name: verified
+        for pii_name, verified in (task.result() for task in pii_tasks)
+        if verified
+    }
 
 
 def get_n_texts_random(
@@ -382,70 +604,184 @@ async def run_pii(
     api_key_meta_expert: str,
     temperature: float,
     generate_new_prompt: bool,
-    refine_prompts: bool
+    refine_prompts: bool,
+    structured_output: bool = False,
+    refine_candidates: int = 1,
+    refine_budget: float = None,
+    parallel_chunks: bool = False,
+    candidate_filter: bool = False,
+    rule_engine: bool = False,
+    gazetteer: bool = False,
+    identifier_memory: IdentifierMemory = None,
+    speculative: bool = False,
+    prepared_prompt_folder: str = None,
+    span_cache: SpanCache = None
 ):
     """
-    123
+    Runs the PII pipeline for one document as a DAG: the dynamic PIIs
+    and the static person extraction don't depend on each other and run
+    concurrently, the identifiers of each are located as soon as its
+    nodes are written, the export waits for both. With an identifier
+    memory, the identifiers confirmed in enough previous documents are
+    masked wherever they occur and skip the verifier, the dynamic
+    identifiers the verifier passed are recorded once the dynamic PIIs
+    are done. With a span cache, the spans located before
+    for the same text and nodes are reused.
     """
     text = read_text_file(file_path)
-    print(f"file_path for run_pii: {file_path}")    
+    logger.info(f"file_path for run_pii: {file_path}")
     doc_id = file_path.split(".")[0].split("/")[-1]
-    print(f"Start dynamic PIIs for doc: {doc_id}")
-    await extract_pii_dynamic(
-        text=text,
-        base_url=base_url,
-        model_name_prompt_creater=model_name_prompt_creater,
-        model_name_meta_expert=model_name_meta_expert,
-        api_key_prompt_creater=api_key_prompt_creater,
-        api_key_meta_expert=api_key_meta_expert,
-        conn=conn,
-        temperature=temperature,
-        refine_prompts=refine_prompts,
-        generate_new_prompt=generate_new_prompt,
-        doc_id=doc_id
-    )
-    print(f"Finished dynamic PIIs for doc_id: {doc_id}")
-    print("Start static PIIs")
-    extract_pii_static(
-        text=text,
-        doc_id=doc_id,
-        api_key=api_key_prompt_creater,
-        base_url=base_url,
-        model_name=model_name_prompt_creater,
-        temperature=temperature,
-        conn=conn,
-    )
-    print("Finished static PIIs")
-    result_path = os.path.join(
-        output_path, f"{doc_id}.json"
-    )
-    conn.save_nodes_as_json(
-        path=result_path,
-        doc_id=doc_id
-    )
-    with open(result_path, "r") as f:
-        nodes_json = json.load(f)
+    property_yml_file_path = create_paths(doc_id=doc_id)[2]
+    dynamic_labels = [
+        pii_name.title()
+        for pii_name in registry.read_yaml(property_yml_file_path).keys()
+    ]
+    # Looked up before the document itself is recorded
+    memory_identifiers = {}
+    if identifier_memory is not None:
+        for pii_name in registry.read_yaml(property_yml_file_path).keys():
+            found = identifier_memory.find_confirmed(text, pii_name)
+            if found:
+                memory_identifiers[pii_name] = found
+
+    async def dynamic_stage(results: dict) -> dict[str, list[str]]:
+        progress.message(f"Start dynamic PIIs for doc: {doc_id}")
+        verified = await extract_pii_dynamic(
+            text=text,
+            base_url=base_url,
+            model_name_prompt_creater=model_name_prompt_creater,
+            model_name_meta_expert=model_name_meta_expert,
+            api_key_prompt_creater=api_key_prompt_creater,
+            api_key_meta_expert=api_key_meta_expert,
+            conn=conn,
+            temperature=temperature,
+            refine_prompts=refine_prompts,
+            generate_new_prompt=generate_new_prompt,
+            doc_id=doc_id,
+            structured_output=structured_output,
+            refine_candidates=refine_candidates,
+            refine_budget=refine_budget,
+            candidate_filter=candidate_filter,
+            rule_engine=rule_engine,
+            gazetteer=gazetteer,
+            identifier_memory=identifier_memory,
+            speculative=speculative,
+            prepared_prompt_folder=prepared_prompt_folder,
+            masked_identifiers=memory_identifiers
+        )
+        progress.message(f"Finished dynamic PIIs for doc_id: {doc_id}")
+        return verified
+
+    async def static_stage(results: dict) -> None:
+        progress.message(f"Start static PIIs for doc: {doc_id}")
+        await asyncio.to_thread(
+            extract_pii_static,
+            text=text,
+            doc_id=doc_id,
+            api_key=api_key_prompt_creater,
+            base_url=base_url,
+            model_name=model_name_prompt_creater,
+            temperature=temperature,
+            conn=conn,
+            structured_output=structured_output,
+            parallel_chunks=parallel_chunks
+        )
+        progress.message(f"Finished static PIIs for doc_id: {doc_id}")
 
-    position_dict = prepare_evaluation.locate_identifiers(
-        nodes_json,
-        original_text=text,
-        doc_id=doc_id
-    )
-    position_path = os.path.join(
-        output_path, f"{doc_id}_positions.json"
-    )
-    with open(position_path, "w") as f:
-        json.dump(position_dict, f)
+    def locate_stage(labels: list[str]):
+        async def locate(results: dict) -> dict:
+            nodes = await asyncio.to_thread(
+                conn.read_nodes, doc_id=doc_id, labels=labels,
+                with_labels=True
+            )
+            return {
+                "nodes": nodes,
+                "positions": reevaluate.locate_node_spans(
+                    text, doc_id, nodes, span_cache
+                )
+            }
+        return locate
+
+    async def memory_stage(results: dict) -> None:
+        # Only the identifiers the verifier passed, not every node
+        identifier_memory.record_document(doc_id, results["dynamic"])
+        await asyncio.to_thread(identifier_memory.save)
+
+    async def export_stage(results: dict) -> dict[str, list[list[int]]]:
+        # The nodes and positions are handed over by the locate stages,
+        # nothing is read back from the database or the written files
+        nodes = (
+            results["locate_dynamic"]["nodes"]
+            + results["locate_static"]["nodes"]
+        )
+        await asyncio.to_thread(
+            neo4j_conn.write_nodes_json,
+            nodes,
+            os.path.join(output_path, f"{doc_id}.json")
+        )
+        position_dict = {
+            doc_id: results["locate_dynamic"]["positions"]
+            + results["locate_static"]["positions"]
+        }
+        if memory_identifiers:
+            position_dict[doc_id].extend(
+                prepare_evaluation.locate_gazetteer_identifiers(
+                    identifiers=[
+                        identifier
+                        for identifiers in memory_identifiers.values()
+                        for identifier in identifiers
+                    ],
+                    original_text=text,
+                    known_positions=position_dict[doc_id]
+                )
+            )
+        position_path = os.path.join(
+            output_path, f"{doc_id}_positions.json"
+        )
+        with open(position_path, "w") as f:
+            json.dump(position_dict, f)
+
+        # The same span searches as a re-evaluation of the exported nodes
+        temp_to_add = await asyncio.to_thread(
+            reevaluate.locate_missed_spans,
+            text,
+            doc_id,
+            nodes,
+            known_positions=position_dict[doc_id],
+            span_cache=span_cache,
+            gazetteer=gazetteer
+        )
+        position_dict[doc_id].extend(temp_to_add)
+        return prepare_evaluation.merge_overlapping_elements(
+            position_dict
+        )
 
-    temp_to_add = prepare_evaluation.add_regex_search(
-        conn=conn,
-        text_path=file_path,
-        result_path=position_path,
-        doc_id=doc_id
-    )
-    position_dict[doc_id].extend(temp_to_add)
-    position_dict = prepare_evaluation.merge_overlapping_elements(
-        position_dict
-    )
+    stages = [
+        pipeline.Stage("dynamic", dynamic_stage),
+        pipeline.Stage("static", static_stage),
+        pipeline.Stage(
+            "locate_dynamic",
+            locate_stage(dynamic_labels),
+            depends_on=["dynamic"]
+        ),
+        pipeline.Stage(
+            "locate_static",
+            locate_stage(["Entity_designation"]),
+            depends_on=["static"]
+        ),
+        pipeline.Stage(
+            "export",
+            export_stage,
+            depends_on=["locate_dynamic", "locate_static"]
+        )
+    ]
+    if identifier_memory is not None:
+        stages.append(pipeline.Stage(
+            "memory", memory_stage, depends_on=["dynamic"]
+        ))
+    try:
+        await pipeline.run_dag(stages)
+    finally:
+        progress.document_finished(doc_id)
 
     logger.info(f"Finished {doc_id}")
@@ -2,6 +2,7 @@ import argparse
 import os
 import sys
 import json
+import time
 from dotenv import load_dotenv
 from loguru import logger
 import asyncio
@@ -12,10 +13,20 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../../"
 from src.module.llm import LLMAgent
 from src.module import entities
 from src.module import neo4j_conn
+from src.module import memory_graph
 from src.module import llm_agents
 from src.module import utils
 from src.module import llm_agents_static
+from src.module import token_usage
+from src.module.progress import progress
+from src.module import logging_config
+from src.module import agent_factory
+from src.module import candidate_filter
+from src.module import speculation
+from src.module import prompt_preparation
+from src.module.identifier_memory import IdentifierMemory
 from src.evaluate import prepare_evaluation
+from src.evaluate.span_cache import SpanCache
 nest_asyncio.apply()
 
 
@@ -31,28 +42,57 @@ async def main():
     )
     log_dir = os.path.join(root_dir, "log")
 
-    logger.remove()
-    logger.add(
+    load_dotenv()
+    logging_config.setup_logger(
         os.path.join(log_dir, "Baum_pp_{time:YYYY-MM-DD}.log"),
+        jsonl_path=os.getenv("LOG_JSONL"),
+        level="DEBUG",
         rotation="10 MB",
         retention="7 days",
-        compression="zip",
-        level="DEBUG"
+        compression="zip"
     )
-
-    load_dotenv()
     logger.info("Loading environment variables")
+    if len(sys.argv) > 1 and sys.argv[1] == "prepare-prompts":
+        prepare_args = cli_helper.set_up_prepare_argparse().parse_args(
+            sys.argv[2:]
+        )
+        await cli_helper.prepare_prompts(
+            version=prepare_args.version or time.strftime("%Y%m%d-%H%M%S"),
+            base_url=os.getenv("BASE_URL"),
+            model_name_prompt_creater=os.getenv("MODEL_PROMPT_CREATER"),
+            model_name_meta_expert=os.getenv("MODEL_DYNAMIC"),
+            api_key=os.getenv("API_KEY"),
+            temperature=float(os.getenv("TEMPERATURE")),
+            refine_prompts=prepare_args.refine == 1,
+            max_workers=prepare_args.workers
+        )
+        print(f"Token usage: {token_usage.usage_tracker.summary()}")
+        agent_factory.close()
+        return
+
     parser = cli_helper.set_up_argparse()
     args = parser.parse_args()
     refine = True if args.refine == 1 else False
     generate_new_prompt = True if args.generate_new_prompt == 1 else False
 
-    conn = neo4j_conn.Neo4jConnection(
-        uri="bolt://neo4j:7687",
-        user="neo4j",
-        pwd="neo4jneo4j"
-    )
-    conn.query(query="""MATCH (n) DETACH DELETE n""")
+    cleanup_thread = None
+    if os.getenv("GRAPH_BACKEND", "neo4j") == "memory":
+        conn = memory_graph.InMemoryGraph(
+            run_id=os.getenv("RUN_ID"),
+            snapshot_path=os.getenv("GRAPH_SNAPSHOT")
+        )
+    else:
+        conn = neo4j_conn.Neo4jConnection(
+            uri="bolt://neo4j:7687",
+            user="neo4j",
+            pwd="neo4jneo4j",
+            run_id=os.getenv("RUN_ID")
+        )
+        # Nodes are isolated per run, old runs are deleted in the background
+        cleanup_thread = conn.start_background_cleanup(
+            max_age_hours=float(os.getenv("RUN_RETENTION_HOURS", "24"))
+        )
+    logger.info(f"Run: {conn.run_id}")
     API_KEY = os.getenv("API_KEY")
     MODEL_STATIC = os.getenv("MODEL_STATIC")
     SEED = int(os.getenv("SEED"))
@@ -60,6 +100,42 @@ async def main():
     MODEL_PROMPT_CREATER = os.getenv("MODEL_PROMPT_CREATER")
     BASE_URL = os.getenv("BASE_URL")
     TEMPERATURE = float(os.getenv("TEMPERATURE"))
+    STRUCTURED_OUTPUT = bool(int(os.getenv("STRUCTURED_OUTPUT", "0")))
+    PARALLEL_CHUNKS = bool(int(os.getenv("PARALLEL_CHUNKS", "0")))
+    CANDIDATE_FILTER = bool(int(os.getenv("CANDIDATE_FILTER", "0")))
+    RULE_ENGINE = bool(int(os.getenv("RULE_ENGINE", "0")))
+    GAZETTEER = bool(int(os.getenv("GAZETTEER", "0")))
+    IDENTIFIER_MEMORY = os.getenv("IDENTIFIER_MEMORY")
+    SPECULATIVE = bool(int(os.getenv("SPECULATIVE", "0")))
+    PROMPT_VERSION = os.getenv("PROMPT_VERSION")
+    SPAN_CACHE = os.getenv("SPAN_CACHE")
+    identifier_memory = None
+    if IDENTIFIER_MEMORY:
+        identifier_memory = IdentifierMemory(path=IDENTIFIER_MEMORY)
+    span_cache = SpanCache(SPAN_CACHE) if SPAN_CACHE else None
+
+    prepared_prompt_folder = None
+    if PROMPT_VERSION:
+        # Prompt generation runs once before the documents instead of
+        # mid-conversation in every document
+        versions_folder = cli_helper.create_prompt_versions_path()
+        version = prompt_preparation.resolve_version(
+            versions_folder, PROMPT_VERSION
+        )
+        if version is None:
+            version = time.strftime("%Y%m%d-%H%M%S")
+        prepared_prompt_folder = os.path.join(versions_folder, version)
+        if not os.path.isdir(prepared_prompt_folder):
+            await cli_helper.prepare_prompts(
+                version=version,
+                base_url=BASE_URL,
+                model_name_prompt_creater=MODEL_PROMPT_CREATER,
+                model_name_meta_expert=MODEL_DYNAMIC,
+                api_key=API_KEY,
+                temperature=TEMPERATURE,
+                refine_prompts=refine
+            )
+        print(f"Using prompt version: {version}")
 
     documents = cli_helper.get_n_texts_random(
         path=args.input_path,
@@ -79,7 +155,7 @@ async def main():
             if os.path.isfile(os.path.join(args.output_path, f))
         ]
 
-    print(files)
+    logger.info(f"Files: {files}")
 
     sem = asyncio.Semaphore(5)
 
@@ -98,7 +174,18 @@ async def main():
                     api_key_meta_expert=API_KEY,
                     temperature=TEMPERATURE,
                     refine_prompts=refine,
-                    generate_new_prompt=generate_new_prompt
+                    generate_new_prompt=generate_new_prompt,
+                    structured_output=STRUCTURED_OUTPUT,
+                    refine_candidates=args.refine_candidates,
+                    refine_budget=args.refine_budget,
+                    parallel_chunks=PARALLEL_CHUNKS,
+                    candidate_filter=CANDIDATE_FILTER,
+                    rule_engine=RULE_ENGINE,
+                    gazetteer=GAZETTEER,
+                    identifier_memory=identifier_memory,
+                    speculative=SPECULATIVE,
+                    prepared_prompt_folder=prepared_prompt_folder,
+                    span_cache=span_cache
                 )
             except Exception as e:
                 logger.error(f"Failed to process {file_name}: {e}")
@@ -109,8 +196,35 @@ async def main():
                 return None
 
     # Run all PII tasks with concurrency cap of 3
+    progress.start(
+        total_documents=len(files),
+        metrics_path=os.getenv("METRICS_FILE"),
+        snapshot_interval=float(os.getenv("METRICS_INTERVAL", "30"))
+    )
     await asyncio.gather(*(sem_task(f) for f in files))
+    progress.close()
+    # The cleanup still uses the driver, it is only closed after it
+    if cleanup_thread is not None:
+        cleanup_thread.join(timeout=60)
+    if cleanup_thread is not None and cleanup_thread.is_alive():
+        logger.warning("Cleanup of old runs still running, not closing Neo4j")
+    else:
+        conn.close()
     logger.info("All files processed.")
+    logger.info(f"Token usage: {token_usage.usage_tracker.summary()}")
+    print(f"Token usage: {token_usage.usage_tracker.summary()}")
+    if CANDIDATE_FILTER:
+        filter_summary = candidate_filter.filter_metrics.summary()
+        logger.info(f"Candidate filter:\n{filter_summary}")
+        print(f"Candidate filter:\n{filter_summary}")
+    if SPECULATIVE:
+        speculation_summary = speculation.speculation_metrics.summary()
+        logger.info(f"Speculative mode: {speculation_summary}")
+        print(f"Speculative mode: {speculation_summary}")
+    if span_cache is not None:
+        logger.info(f"Span cache: {span_cache.summary()}")
+        print(f"Span cache: {span_cache.summary()}")
+    agent_factory.close()
 
     position_files = [
         f for f in os.listdir(args.output_path)
@@ -0,0 +1,417 @@
+"""
+Evaluation of the masked spans against the Text Anonymization Benchmark
+(TAB) annotations, with the metrics of the TAB evaluation script:
+
+- token-level recall on all identifiers, overall and per entity type
+- mention-level recall on all identifiers, overall and per entity type
+- entity-level recall on direct and on quasi identifiers
+- uniform token-level and mention-level precision
+
+The documents are concatenated into one character axis, the masks and
+the tokens become NumPy arrays over that axis and every metric is a
+handful of vectorized operations, whatever the number of documents.
+
+    poetry run python -m src.evaluate.evaluation Data/texts/echr_dev.json Output/final.json
+"""
+import re
+import json
+import argparse
+import numpy as np
+from loguru import logger
+
+
+# Tokens of the token-level metrics: words and single punctuation marks
+_TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+_WHITESPACE_PATTERN = re.compile(r"\s+")
+
+# The identifier types which have to be masked
+_MASKED_IDENTIFIER_TYPES = ("DIRECT", "QUASI")
+
+
+def _spans_to_mask(
+    starts: np.ndarray,
+    ends: np.ndarray,
+    length: int
+) -> np.ndarray:
+    """
+    Returns the boolean mask of the characters covered by the spans.
+
+    Args:
+        starts (np.ndarray): The start offsets of the spans.
+        ends (np.ndarray): The end offsets of the spans (exclusive).
+        length (int): The number of characters.
+
+    Returns:
+        np.ndarray: The mask.
+    """
+    delta = np.zeros(length + 1, dtype=np.int64)
+    np.add.at(delta, starts, 1)
+    np.add.at(delta, ends, -1)
+    return np.cumsum(delta[:-1]) > 0
+
+
+def _mask_to_spans(mask: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Returns the runs of covered characters of a mask as spans.
+
+    Args:
+        mask (np.ndarray): The mask.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: The start and end offsets.
+    """
+    edges = np.diff(np.concatenate(([0], mask.astype(np.int8), [0])))
+    return np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+
+
+def _prefix(mask: np.ndarray) -> np.ndarray:
+    """Returns the prefix sums of a mask, starting with 0."""
+    return np.concatenate(([0], np.cumsum(mask, dtype=np.int64)))
+
+
+def _split_by_tokens(
+    starts: np.ndarray,
+    ends: np.ndarray,
+    token_starts: np.ndarray,
+    token_ends: np.ndarray
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Splits spans into the tokens they overlap, clipped to the spans.
+
+    Args:
+        starts (np.ndarray): The start offsets of the spans.
+        ends (np.ndarray): The end offsets of the spans.
+        token_starts (np.ndarray): The sorted start offsets of the tokens.
+        token_ends (np.ndarray): The sorted end offsets of the tokens.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray, np.ndarray]: The index of the span
+        of every piece and the start and end offsets of the pieces.
+    """
+    first = np.searchsorted(token_ends, starts, side="right")
+    last = np.searchsorted(token_starts, ends, side="left")
+    counts = np.maximum(last - first, 0)
+    span_index = np.repeat(np.arange(len(starts)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(
+        np.cumsum(counts) - counts, counts
+    )
+    token_index = np.repeat(first, counts) + offsets
+    return (
+        span_index,
+        np.maximum(token_starts[token_index], starts[span_index]),
+        np.minimum(token_ends[token_index], ends[span_index])
+    )
+
+
+def _covered(
+    starts: np.ndarray,
+    ends: np.ndarray,
+    masked_prefix: np.ndarray,
+    text_prefix: np.ndarray
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Tells which spans are fully masked, ignoring whitespace.
+
+    Args:
+        starts (np.ndarray): The start offsets of the spans.
+        ends (np.ndarray): The end offsets of the spans.
+        masked_prefix (np.ndarray): The prefix sums of the masked
+        non-whitespace characters.
+        text_prefix (np.ndarray): The prefix sums of the non-whitespace
+        characters.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: Whether each span is fully masked
+        and whether it has any non-whitespace character to be scored.
+    """
+    characters = text_prefix[ends] - text_prefix[starts]
+    masked = masked_prefix[ends] - masked_prefix[starts]
+    return masked == characters, characters > 0
+
+
+def _ratio(numerator, denominator) -> float:
+    return float(numerator / denominator) if denominator else float("nan")
+
+
+def _by_type(
+    values: np.ndarray,
+    type_codes: np.ndarray,
+    type_names: np.ndarray
+) -> dict[str, float]:
+    """Returns the mean of boolean values per entity type."""
+    hits = np.bincount(
+        type_codes,
+        weights=values.astype(np.float64),
+        minlength=len(type_names)
+    )
+    totals = np.bincount(type_codes, minlength=len(type_names))
+    return {
+        str(name): _ratio(hits[code], totals[code])
+        for code, name in enumerate(type_names)
+        if totals[code]
+    }
+
+
+class Corpus:
+    """
+    The TAB annotations and texts of the evaluated documents on one
+    character axis: every document starts at its offset, separated from
+    the next one by a character which is never masked, so spans of two
+    documents never merge.
+
+    Args:
+        documents (list[dict]): The documents in the TAB format, with
+        "doc_id", "text" and "annotations".
+    """
+    def __init__(self, documents: list[dict]):
+        self.doc_ids = [document["doc_id"] for document in documents]
+        lengths = np.array(
+            [len(document["text"]) for document in documents],
+            dtype=np.int64
+        )
+        self.lengths = lengths
+        self.offsets = np.concatenate(([0], np.cumsum(lengths + 1)[:-1]))
+        self.length = int(lengths.sum() + len(documents))
+
+        token_starts, token_ends = [], []
+        space_starts, space_ends = [], []
+        mentions = []
+        for offset, document in zip(self.offsets, documents):
+            for match in _TOKEN_PATTERN.finditer(document["text"]):
+                token_starts.append(offset + match.start())
+                token_ends.append(offset + match.end())
+            for match in _WHITESPACE_PATTERN.finditer(document["text"]):
+                space_starts.append(offset + match.start())
+                space_ends.append(offset + match.end())
+            for annotator, annotation in document["annotations"].items():
+                for mention in annotation["entity_mentions"]:
+                    if mention["identifier_type"] \
+                            not in _MASKED_IDENTIFIER_TYPES:
+                        continue
+                    mentions.append((
+                        offset + mention["start_offset"],
+                        offset + mention["end_offset"],
+                        mention["entity_type"],
+                        mention["identifier_type"],
+                        f"{document['doc_id']}/{annotator}/"
+                        f"{mention['entity_id']}"
+                    ))
+
+        self.token_starts = np.array(token_starts, dtype=np.int64)
+        self.token_ends = np.array(token_ends, dtype=np.int64)
+        text = ~_spans_to_mask(
+            np.array(space_starts, dtype=np.int64),
+            np.array(space_ends, dtype=np.int64),
+            self.length
+        )
+        text[self.offsets[1:] - 1] = False
+        if len(documents):
+            text[-1] = False
+        self.text = text
+        self.text_prefix = _prefix(text)
+
+        columns = list(zip(*mentions)) if mentions else [[], [], [], [], []]
+        self.mention_starts = np.array(columns[0], dtype=np.int64)
+        self.mention_ends = np.array(columns[1], dtype=np.int64)
+        self.type_names, self.mention_types = np.unique(
+            np.array(columns[2], dtype=str), return_inverse=True
+        )
+        self.mention_direct = np.array(columns[3], dtype=str) == "DIRECT"
+        _, self.mention_entities = np.unique(
+            np.array(columns[4], dtype=str), return_inverse=True
+        )
+        self.gold = _spans_to_mask(
+            self.mention_starts, self.mention_ends, self.length
+        )
+
+    def masked(self, masking: dict[str, list[list[int]]]) -> np.ndarray:
+        """
+        Returns the mask of the characters masked by a system, spans
+        reaching beyond their document are clipped to it.
+
+        Args:
+            masking (dict[str, list[list[int]]]): The masked spans per
+            document, e.g. the content of final.json.
+
+        Returns:
+            np.ndarray: The mask.
+        """
+        starts, ends = [], []
+        for offset, length, doc_id in zip(
+            self.offsets, self.lengths, self.doc_ids
+        ):
+            for start, end in masking.get(doc_id, []):
+                start, end = max(start, 0), min(end, length)
+                if start < end:
+                    starts.append(offset + start)
+                    ends.append(offset + end)
+        return _spans_to_mask(
+            np.array(starts, dtype=np.int64),
+            np.array(ends, dtype=np.int64),
+            self.length
+        )
+
+
+def evaluate(
+    documents: list[dict],
+    masking: dict[str, list[list[int]]]
+) -> dict:
+    """
+    Computes the TAB metrics of a masking. Every annotator's mention is
+    scored on its own (micro average over the annotators). A token or
+    mention counts as masked if all its non-whitespace characters are
+    masked; an entity if all its mentions are. A masked token or span
+    is correct if all its non-whitespace characters were masked by at
+    least one annotator (uniform weights).
+
+    Args:
+        documents (list[dict]): The documents in the TAB format.
+        masking (dict[str, list[list[int]]]): The masked spans per
+        document.
+
+    Returns:
+        dict: The metrics, with the recall per entity type.
+    """
+    corpus = Corpus(documents)
+    system = corpus.masked(masking)
+    masked_prefix = _prefix(system & corpus.text)
+
+    # Recall on the tokens and the mentions of the annotators
+    mention_index, piece_starts, piece_ends = _split_by_tokens(
+        corpus.mention_starts, corpus.mention_ends,
+        corpus.token_starts, corpus.token_ends
+    )
+    token_masked, token_scored = _covered(
+        piece_starts, piece_ends, masked_prefix, corpus.text_prefix
+    )
+    token_types = corpus.mention_types[mention_index][token_scored]
+    token_masked = token_masked[token_scored]
+    mention_masked, mention_scored = _covered(
+        corpus.mention_starts, corpus.mention_ends,
+        masked_prefix, corpus.text_prefix
+    )
+    mention_masked &= mention_scored
+
+    # An entity is masked if none of its mentions is left
+    entity_count = len(np.unique(corpus.mention_entities))
+    entity_masked = np.bincount(
+        corpus.mention_entities,
+        weights=(~mention_masked & mention_scored).astype(np.float64),
+        minlength=entity_count
+    ) == 0
+    entity_direct = np.zeros(entity_count, dtype=bool)
+    entity_direct[corpus.mention_entities[corpus.mention_direct]] = True
+
+    # Precision of the masked tokens and spans against all annotators
+    gold_prefix = _prefix(corpus.gold & corpus.text)
+    system_starts, system_ends = _mask_to_spans(system)
+    _, system_piece_starts, system_piece_ends = _split_by_tokens(
+        system_starts, system_ends, corpus.token_starts, corpus.token_ends
+    )
+    token_correct, system_token_scored = _covered(
+        system_piece_starts, system_piece_ends,
+        gold_prefix, corpus.text_prefix
+    )
+    span_correct, span_scored = _covered(
+        system_starts, system_ends, gold_prefix, corpus.text_prefix
+    )
+
+    return {
+        "documents": len(corpus.doc_ids),
+        "token_recall": _ratio(token_masked.sum(), len(token_masked)),
+        "token_recall_by_type": _by_type(
+            token_masked, token_types, corpus.type_names
+        ),
+        "mention_recall": _ratio(
+            mention_masked.sum(), mention_scored.sum()
+        ),
+        "mention_recall_by_type": _by_type(
+            mention_masked[mention_scored],
+            corpus.mention_types[mention_scored],
+            corpus.type_names
+        ),
+        "entity_recall_direct": _ratio(
+            entity_masked[entity_direct].sum(), entity_direct.sum()
+        ),
+        "entity_recall_quasi": _ratio(
+            entity_masked[~entity_direct].sum(), (~entity_direct).sum()
+        ),
+        "token_precision": _ratio(
+            token_correct[system_token_scored].sum(),
+            system_token_scored.sum()
+        ),
+        "mention_precision": _ratio(
+            span_correct[span_scored].sum(), span_scored.sum()
+        )
+    }
+
+
+def format_report(metrics: dict) -> str:
+    """
+    Formats the metrics like the output of the TAB evaluation script.
+
+    Args:
+        metrics (dict): The metrics of evaluate.
+
+    Returns:
+        str: The report.
+    """
+    lines = [
+        f"==> Token-level recall on all identifiers: "
+        f"{metrics['token_recall']:.3f}",
+        "==> Token-level recall on all identifiers, factored by type:"
+    ]
+    lines += [
+        f"\t{entity_type}:{recall:.3f}"
+        for entity_type, recall in metrics["token_recall_by_type"].items()
+    ]
+    lines += [
+        f"==> Mention-level recall on all identifiers: "
+        f"{metrics['mention_recall']:.3f}",
+        "==> Mention-level recall on all identifiers, factored by type:"
+    ]
+    lines += [
+        f"\t{entity_type}:{recall:.3f}"
+        for entity_type, recall in metrics["mention_recall_by_type"].items()
+    ]
+    lines += [
+        f"==> Entity-level recall on direct identifiers: "
+        f"{metrics['entity_recall_direct']:.3f}",
+        f"==> Entity-level recall on quasi identifiers: "
+        f"{metrics['entity_recall_quasi']:.3f}",
+        f"==> Uniform token-level precision on all identifiers: "
+        f"{metrics['token_precision']:.3f}",
+        f"==> Uniform mention-level precision on all identifiers: "
+        f"{metrics['mention_precision']:.3f}"
+    ]
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("gold_path", type=str)
+    parser.add_argument("masking_path", type=str)
+    parser.add_argument("--output", type=str, default=None)
+    args = parser.parse_args()
+
+    with open(args.gold_path, "r") as f:
+        documents = json.load(f)
+    with open(args.masking_path, "r") as f:
+        masking = json.load(f)
+    evaluated = [
+        document for document in documents if document["doc_id"] in masking
+    ]
+    if len(evaluated) < len(documents):
+        logger.info(
+            f"Evaluating the {len(evaluated)} of {len(documents)} documents "
+            f"in {args.masking_path}"
+        )
+    metrics = evaluate(evaluated, masking)
+    print(format_report(metrics))
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(metrics, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
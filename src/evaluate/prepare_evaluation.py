@@ -3,10 +3,18 @@ import uuid
 import json
 import os
 import sys
+from loguru import logger
 sys.path.append(os.path.abspath('..'))
 from src.module import utils
-from src.cli import cli_helper
 from src.module import neo4j_conn
+from src.module import gazetteer
+
+
+# The labels whose identifiers are searched in the whole text by
+# add_regex_search and locate_gazetteer_identifiers
+REGEX_LABELS = [
+    "Nationality_Ethnicity", "Facility", "Organization", "Named_Location"
+]
 
 
 # Mach das Programm auf ein Dokument, runne locate_identifiers und speichere das Ergebnis wo ab und am Ende combine alles.
@@ -165,7 +173,7 @@ def locate_identifiers(
                     "end": m.end()
                 })
             if not any_hit:
-                print(f"Context not found for uuid {rec.get('uuid')!r}")
+                logger.debug(f"Context not found for uuid {rec.get('uuid')!r}")
 
     for r in results:
         position_list.append([r["start"], r["end"]])
@@ -252,39 +260,42 @@ def save_text_from_docs(doc_json_path: str) -> None:
 
 def add_regex_search(
     conn: neo4j_conn.Neo4jConnection,
-    text_path,
-    result_path,
-    doc_id: str
+    original_text: str,
+    known_positions: list[list[int]],
+    doc_id: str,
+    identifiers: list[str] = None
 ) -> list[list[int]]:
-    print(f"add_regex_search result_path: {result_path}")
-    print(f"add_regex_search text_path: {text_path}")
-    positions_to_add = []
-    query = f"""
-    MATCH (n)
-    WHERE n:Nationality_Ethnicity OR n:Facility OR n:Organization OR n:Named_Location
-    AND n.doc_id = "{doc_id}"
-    RETURN n;
     """
-    query_result = conn.query(query=query)
-    temp = []
-    identifiers = []
-    for data in query_result:
-        temp.append(next(iter(data.data().values())))
-    identifiers = list(set([element["identifier"] for element in temp]))
-
-    text = cli_helper.read_text_file(text_path)
-    text = _replace_characters(text).\
+    Searches the identifiers of the Nationality_Ethnicity, Facility,
+    Organization and Named_Location nodes (REGEX_LABELS) in the text
+    and returns the positions the LLM missed.
+
+    Args:
+        conn (neo4j_conn.Neo4jConnection): The connection to the database.
+        original_text (str): The text of the document.
+        known_positions (list[list[int]]): The positions found by
+        locate_identifiers.
+        doc_id (str): The ID of the document.
+        identifiers (list[str]): The identifiers of the nodes, if they
+        are already in memory; read from the database otherwise.
+
+    Returns:
+        list[list[int]]: The positions not in known_positions.
+    """
+    positions_to_add = []
+    if identifiers is None:
+        identifiers = conn.read_identifiers(
+            doc_id=doc_id, labels=REGEX_LABELS
+        )
+    identifiers = list(set(identifiers))
+
+    text = _replace_characters(original_text).\
         replace("\u00A0", " ").\
         replace("\u00AD", "")
     results = []
 
-    with open(result_path, "r") as f:
-        nodes_json = json.load(f)
-    list_position_llm = nodes_json[list(nodes_json.keys())[0]]
-
     for ident in identifiers:
         try:
-            print(ident)
             regex_ident = _build_flexible_context_regex(ident)
             search_result = regex_ident.search(text)
             start, end = search_result.span()
@@ -293,11 +304,46 @@ def add_regex_search(
                 "end": end
             })
         except AttributeError as e:
-            print(f"add_regex_search AttributeError for {ident}. {e}")
+            logger.debug(f"add_regex_search AttributeError for {ident}. {e}")
 
     for element in results:
         temp_position = [element["start"], element["end"]]
-        if temp_position not in list_position_llm:
+        if temp_position not in known_positions:
             positions_to_add.append(temp_position)
 
     return positions_to_add
+
+
+def locate_gazetteer_identifiers(
+    identifiers: list[str],
+    original_text: str,
+    known_positions: list[list[int]]
+) -> list[list[int]]:
+    """
+    Locates every occurrence of the confirmed identifiers in the text
+    with a gazetteer trie, in one pass over the text instead of one
+    regex search per identifier like add_regex_search.
+
+    Args:
+        identifiers (list[str]): The confirmed identifiers, e.g. of the
+        Nationality_Ethnicity, Facility, Organization and Named_Location
+        nodes.
+        original_text (str): The text of the document.
+        known_positions (list[list[int]]): The positions found by
+        locate_identifiers.
+
+    Returns:
+        list[list[int]]: The positions not in known_positions.
+    """
+    text = _replace_characters(original_text).\
+        replace("\u00A0", " ").\
+        replace("\u00AD", "")
+    confirmed = gazetteer.Gazetteer(
+        {"confirmed": [_replace_characters(ident) for ident in identifiers]}
+    )
+    positions_to_add = []
+    for start, end, _, _ in confirmed.find(text):
+        if [start, end] not in known_positions \
+                and [start, end] not in positions_to_add:
+            positions_to_add.append([start, end])
+    return positions_to_add
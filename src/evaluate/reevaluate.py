@@ -0,0 +1,207 @@
+"""
+Re-evaluation of a finished run without the LLM: the nodes exported per
+document (<doc_id>.json in the output folder) are located in the texts
+(<doc_id>.txt) again, followed by the regex (or gazetteer) pass, and
+<doc_id>_positions.json and final.json are written anew like at the end
+of a run. The span searches are the ones of the pipeline (run_pii uses
+locate_node_spans and locate_missed_spans as well), so with a span
+cache the spans of unchanged texts and nodes are read from the cache a
+run filled instead of searched again.
+
+    poetry run python -m src.evaluate.reevaluate Output --span-cache output/span_cache
+"""
+import os
+import sys
+import json
+import argparse
+from dotenv import load_dotenv
+from loguru import logger
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../../")))
+from src.evaluate import prepare_evaluation
+from src.evaluate.span_cache import SpanCache, cached_spans
+
+
+def locate_node_spans(
+    text: str,
+    doc_id: str,
+    nodes: list[dict],
+    span_cache: SpanCache = None
+) -> list[list[int]]:
+    """
+    Locates the identifiers and persons of the nodes in the text.
+
+    Args:
+        text (str): The text of the document.
+        doc_id (str): The ID of the document.
+        nodes (list[dict]): The nodes, e.g. the ones of the dynamic PIIs.
+        span_cache (SpanCache): The span cache or None.
+
+    Returns:
+        list[list[int]]: The located positions.
+    """
+    return cached_spans(
+        span_cache,
+        text=text,
+        kind="locate",
+        compute=lambda: prepare_evaluation.locate_identifiers(
+            nodes,
+            original_text=text,
+            doc_id=doc_id
+        )[doc_id],
+        nodes=nodes
+    )
+
+
+def locate_missed_spans(
+    text: str,
+    doc_id: str,
+    nodes: list[dict],
+    known_positions: list[list[int]],
+    span_cache: SpanCache = None,
+    gazetteer: bool = False
+) -> list[list[int]]:
+    """
+    Searches the identifiers of the REGEX_LABELS nodes in the text, with
+    a regex per identifier or in one gazetteer pass.
+
+    Args:
+        text (str): The text of the document.
+        doc_id (str): The ID of the document.
+        nodes (list[dict]): The nodes of the document with their labels.
+        known_positions (list[list[int]]): The positions found by
+        locate_node_spans.
+        span_cache (SpanCache): The span cache or None.
+        gazetteer (bool): Whether to search with the gazetteer.
+
+    Returns:
+        list[list[int]]: The positions not in known_positions.
+    """
+    identifiers = [
+        node["identifier"] for node in nodes
+        if node.get("identifier")
+        and set(prepare_evaluation.REGEX_LABELS).intersection(
+            node.get("labels") or []
+        )
+    ]
+    if gazetteer:
+        return cached_spans(
+            span_cache,
+            text=text,
+            kind="gazetteer",
+            compute=lambda: prepare_evaluation.locate_gazetteer_identifiers(
+                identifiers=identifiers,
+                original_text=text,
+                known_positions=known_positions
+            ),
+            identifiers=sorted(set(identifiers)),
+            known_positions=known_positions
+        )
+    return cached_spans(
+        span_cache,
+        text=text,
+        kind="regex",
+        compute=lambda: prepare_evaluation.add_regex_search(
+            conn=None,
+            original_text=text,
+            known_positions=known_positions,
+            doc_id=doc_id,
+            identifiers=identifiers
+        ),
+        identifiers=sorted(set(identifiers)),
+        known_positions=known_positions
+    )
+
+
+def reevaluate_document(
+    text: str,
+    doc_id: str,
+    nodes: list[dict],
+    span_cache: SpanCache = None,
+    gazetteer: bool = False
+) -> tuple[dict[str, list[list[int]]], dict[str, list[list[int]]]]:
+    """
+    Locates the exported nodes of a document like the pipeline does: the
+    dynamic PIIs and the persons separately, then the regex pass.
+
+    Args:
+        text (str): The text of the document.
+        doc_id (str): The ID of the document.
+        nodes (list[dict]): The exported nodes of the document.
+        span_cache (SpanCache): The span cache or None.
+        gazetteer (bool): Whether to search with the gazetteer.
+
+    Returns:
+        tuple[dict[str, list[list[int]]], dict[str, list[list[int]]]]:
+        The located positions (<doc_id>_positions.json) and the merged
+        positions with the regex pass, both keyed by the doc ID.
+    """
+    persons = [node for node in nodes if "abbreviations" in node]
+    dynamic = [node for node in nodes if "abbreviations" not in node]
+    position_dict = {
+        doc_id: locate_node_spans(text, doc_id, dynamic, span_cache)
+        + locate_node_spans(text, doc_id, persons, span_cache)
+    }
+    located = {doc_id: list(position_dict[doc_id])}
+    position_dict[doc_id].extend(locate_missed_spans(
+        text,
+        doc_id,
+        nodes,
+        known_positions=located[doc_id],
+        span_cache=span_cache,
+        gazetteer=gazetteer
+    ))
+    return located, prepare_evaluation.merge_overlapping_elements(
+        position_dict
+    )
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("output_path", type=str)
+    parser.add_argument(
+        "--span-cache", type=str, default=os.getenv("SPAN_CACHE")
+    )
+    parser.add_argument(
+        "--gazetteer",
+        type=int,
+        default=int(os.getenv("GAZETTEER", "0"))
+    )
+    args = parser.parse_args()
+    span_cache = SpanCache(args.span_cache) if args.span_cache else None
+
+    position_dict_list = []
+    for file_name in sorted(os.listdir(args.output_path)):
+        if not file_name.endswith(".json") \
+                or file_name.endswith("_positions.json") \
+                or file_name == "final.json":
+            continue
+        doc_id = file_name[:-len(".json")]
+        text_path = os.path.join(args.output_path, f"{doc_id}.txt")
+        if not os.path.isfile(text_path):
+            logger.warning(f"No text for {file_name}, skipping it")
+            continue
+        with open(text_path, "r", encoding="utf-8") as f:
+            text = f.read()
+        with open(os.path.join(args.output_path, file_name), "r") as f:
+            nodes = json.load(f)
+        located, _ = reevaluate_document(
+            text, doc_id, nodes, span_cache, gazetteer=args.gazetteer == 1
+        )
+        with open(os.path.join(
+            args.output_path, f"{doc_id}_positions.json"
+        ), "w") as f:
+            json.dump(located, f)
+        position_dict_list.append(located)
+
+    # Like at the end of a run, see src/cli/main.py
+    with open(os.path.join(args.output_path, "final.json"), "w") as f:
+        json.dump(prepare_evaluation.combine(position_dict_list), f)
+    print(f"Re-evaluated {len(position_dict_list)} documents")
+    if span_cache is not None:
+        print(f"Span cache: {span_cache.summary()}")
+
+
+if __name__ == "__main__":
+    main()
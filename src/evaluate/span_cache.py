@@ -0,0 +1,223 @@
+import os
+import json
+import hashlib
+import threading
+from collections.abc import Callable
+from loguru import logger
+
+
+# Bump when the locating functions change, so stale spans aren't reused
+CACHE_VERSION = 1
+
+# The node properties the located spans depend on
+_NODE_KEYS = (
+    "identifier", "context", "full_name", "abbreviations", "aliases"
+)
+
+
+def text_hash(text: str) -> str:
+    """
+    Returns the hash of a document text.
+
+    Args:
+        text (str): The text of the document.
+
+    Returns:
+        str: The SHA-256 hex digest of the text.
+    """
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def inputs_hash(kind: str, nodes: list[dict] = None, **inputs) -> str:
+    """
+    Returns the hash of the inputs a span search depends on besides the
+    text. The nodes are reduced to the properties in _NODE_KEYS (and
+    whether they are persons) and sorted, so the order they were read
+    in doesn't matter.
+
+    Args:
+        kind (str): The span search, e.g. "locate" or "regex".
+        nodes (list[dict]): The nodes the spans are located for.
+        **inputs: Further JSON serializable inputs of the search.
+
+    Returns:
+        str: The SHA-256 hex digest of the inputs.
+    """
+    records = sorted(
+        json.dumps(
+            [node.get(key) for key in _NODE_KEYS]
+            + ["abbreviations" in node],
+            ensure_ascii=False,
+            default=str
+        )
+        for node in nodes or []
+    )
+    content = json.dumps(
+        [CACHE_VERSION, kind, records, inputs],
+        ensure_ascii=False,
+        sort_keys=True,
+        default=str
+    )
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+class SpanCache:
+    """
+    Persistent cache of the spans located in a document, keyed by the
+    hash of the text and the hash of the identifiers and contexts they
+    were located for (see inputs_hash). A re-evaluation with unchanged
+    texts and extractions reads the spans instead of running the regex
+    searches again.
+
+    The cache is a folder with one JSON file per text,
+    <folder>/<text hash>.json, mapping the input hashes to the spans.
+
+    Args:
+        folder (str): The folder of the cache, created on the first write.
+    """
+    def __init__(self, folder: str):
+        self.folder = folder
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._shards = {}
+
+    def _shard_path(self, key: str) -> str:
+        return os.path.join(self.folder, f"{key}.json")
+
+    def _shard(self, key: str) -> dict:
+        if key not in self._shards:
+            try:
+                with open(self._shard_path(key), "r") as f:
+                    self._shards[key] = json.load(f)
+            except (FileNotFoundError, json.JSONDecodeError):
+                self._shards[key] = {}
+        return self._shards[key]
+
+    def get(
+        self,
+        text: str,
+        kind: str,
+        nodes: list[dict] = None,
+        **inputs
+    ) -> list[list[int]] | None:
+        """
+        Returns the cached spans of a search.
+
+        Args:
+            text (str): The text of the document.
+            kind (str): The span search.
+            nodes (list[dict]): The nodes the spans are located for.
+            **inputs: Further inputs of the search.
+
+        Returns:
+            list[list[int]] | None: The spans or None if not cached.
+        """
+        key = inputs_hash(kind, nodes, **inputs)
+        with self._lock:
+            spans = self._shard(text_hash(text)).get(key)
+            if spans is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return [list(span) for span in spans]
+
+    def put(
+        self,
+        text: str,
+        kind: str,
+        spans: list[list[int]],
+        nodes: list[dict] = None,
+        **inputs
+    ) -> None:
+        """
+        Stores the spans of a search and writes the file of the text,
+        atomically.
+
+        Args:
+            text (str): The text of the document.
+            kind (str): The span search.
+            spans (list[list[int]]): The located spans.
+            nodes (list[dict]): The nodes the spans are located for.
+            **inputs: Further inputs of the search.
+
+        Returns:
+            None.
+        """
+        key = inputs_hash(kind, nodes, **inputs)
+        document = text_hash(text)
+        with self._lock:
+            shard = self._shard(document)
+            shard[key] = [list(span) for span in spans]
+            os.makedirs(self.folder, exist_ok=True)
+            temp_path = f"{self._shard_path(document)}.tmp"
+            with open(temp_path, "w") as f:
+                json.dump(shard, f)
+            os.replace(temp_path, self._shard_path(document))
+
+    def cached(
+        self,
+        text: str,
+        kind: str,
+        compute: Callable[[], list[list[int]]],
+        nodes: list[dict] = None,
+        **inputs
+    ) -> list[list[int]]:
+        """
+        Returns the cached spans of a search or computes and stores them.
+
+        Args:
+            text (str): The text of the document.
+            kind (str): The span search.
+            compute (Callable[[], list[list[int]]]): Locates the spans.
+            nodes (list[dict]): The nodes the spans are located for.
+            **inputs: Further inputs of the search.
+
+        Returns:
+            list[list[int]]: The spans.
+        """
+        spans = self.get(text, kind, nodes, **inputs)
+        if spans is None:
+            spans = compute()
+            self.put(text, kind, spans, nodes, **inputs)
+        return spans
+
+    def summary(self) -> str:
+        """
+        Returns the hits and misses of the cache.
+
+        Returns:
+            str: The summary.
+        """
+        total = self.hits + self.misses
+        rate = self.hits / total if total else 0.0
+        return f"{self.hits} hits, {self.misses} misses ({rate:.1%} hit rate)"
+
+
+def cached_spans(
+    cache: SpanCache | None,
+    text: str,
+    kind: str,
+    compute: Callable[[], list[list[int]]],
+    nodes: list[dict] = None,
+    **inputs
+) -> list[list[int]]:
+    """
+    Runs compute through the cache if there is one.
+
+    Args:
+        cache (SpanCache | None): The cache or None.
+        text (str): The text of the document.
+        kind (str): The span search.
+        compute (Callable[[], list[list[int]]]): Locates the spans.
+        nodes (list[dict]): The nodes the spans are located for.
+        **inputs: Further inputs of the search.
+
+    Returns:
+        list[list[int]]: The spans.
+    """
+    if cache is None:
+        return compute()
+    spans = cache.cached(text, kind, compute, nodes, **inputs)
+    logger.debug(f"Span cache ({kind}): {cache.summary()}")
+    return spans
@@ -0,0 +1,282 @@
+import threading
+import importlib.util
+import httpx
+from openai import OpenAI
+from loguru import logger
+
+from . import llm
+
+
+# HTTP/2 needs the optional h2 package, without it HTTP/1.1 keep-alive
+# connections are pooled
+_HTTP2 = importlib.util.find_spec("h2") is not None
+
+
+class AgentFactory:
+    """
+    Hands out long-lived objects for the LLM traffic of the whole run:
+    one HTTP connection pool with keep-alive (and HTTP/2 if available),
+    one OpenAI client per (api_key, base_url) on top of it and one
+    LLMAgent per (model, base_url, temperature). The sync OpenAI client
+    and the httpx pool are thread-safe, so the objects are shared
+    between all documents and PII threads. Whether a backend supports
+    structured output is remembered per (base_url, model) once it
+    rejected a response format.
+
+    Parameters
+    ----------
+    max_connections : int
+        The maximal number of connections of the pool
+    max_keepalive_connections : int
+        The maximal number of idle connections kept open
+    keepalive_expiry : float
+        Seconds an idle connection is kept open
+    timeout : float
+        Timeout of a request in seconds
+    """
+    def __init__(
+        self,
+        max_connections: int = 200,
+        max_keepalive_connections: int = 100,
+        keepalive_expiry: float = 60.0,
+        timeout: float = 600.0
+    ):
+        self._lock = threading.Lock()
+        self._limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry
+        )
+        self._timeout = timeout
+        self._http_client = None
+        self._clients = {}
+        self._agents = {}
+        self._structured_supported = {}
+
+    def get_http_client(self) -> httpx.Client:
+        """
+        Returns the HTTP connection pool shared by all clients
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        httpx.Client
+            The shared HTTP client
+        """
+        with self._lock:
+            if self._http_client is None:
+                self._http_client = httpx.Client(
+                    http2=_HTTP2,
+                    limits=self._limits,
+                    timeout=self._timeout
+                )
+                logger.info(f"Created shared HTTP pool (HTTP/2: {_HTTP2})")
+            return self._http_client
+
+    def get_client(
+        self,
+        api_key: str,
+        base_url: str
+    ) -> OpenAI:
+        """
+        Returns the OpenAI client for the API key and base URL
+
+        Parameters
+        ----------
+        api_key : str
+            The API key for the LLM API
+        base_url : str
+            The base URL of the LLM API
+
+        Returns
+        -------
+        OpenAI
+            The shared client
+        """
+        http_client = self.get_http_client()
+        key = (api_key, base_url)
+        with self._lock:
+            if key not in self._clients:
+                self._clients[key] = OpenAI(
+                    api_key=api_key,
+                    base_url=base_url,
+                    http_client=http_client
+                )
+            return self._clients[key]
+
+    def get_agent(
+        self,
+        model_name: str,
+        base_url: str,
+        temperature: float,
+        api_key: str,
+        structured_output: bool = False
+    ) -> "llm.LLMAgent":
+        """
+        Returns the plain LLMAgent for the model, base URL and
+        temperature. Agents hold no conversation state, so they can be
+        shared between documents and threads.
+
+        Parameters
+        ----------
+        model_name : str
+            The name of the model
+        base_url : str
+            The base URL of the LLM API
+        temperature : float
+            The temperature of the model
+        api_key : str
+            The API key for the LLM API
+        structured_output : bool
+            If True, JSON schema constrained output is requested
+
+        Returns
+        -------
+        LLMAgent
+            The shared agent
+        """
+        key = (model_name, base_url, temperature, api_key, structured_output)
+        with self._lock:
+            agent = self._agents.get(key)
+        if agent is None:
+            agent = llm.LLMAgent(
+                prompt_folder=None,
+                model_name=model_name,
+                api_key=api_key,
+                base_url=base_url,
+                temperature=temperature,
+                structured_output=structured_output
+            )
+            with self._lock:
+                agent = self._agents.setdefault(key, agent)
+        return agent
+
+    def structured_output_supported(
+        self,
+        base_url: str,
+        model_name: str
+    ) -> bool:
+        """
+        Returns whether the backend may support structured output, True
+        until it rejected a response format
+
+        Parameters
+        ----------
+        base_url : str
+            The base URL of the LLM API
+        model_name : str
+            The name of the model
+
+        Returns
+        -------
+        bool
+            Whether response formats are sent to the backend
+        """
+        with self._lock:
+            return self._structured_supported.get((base_url, model_name), True)
+
+    def mark_structured_output_unsupported(
+        self,
+        base_url: str,
+        model_name: str
+    ) -> None:
+        """
+        Remembers that the backend rejected a response format, later
+        requests to it are sent without one
+
+        Parameters
+        ----------
+        base_url : str
+            The base URL of the LLM API
+        model_name : str
+            The name of the model
+
+        Returns
+        -------
+        None
+        """
+        with self._lock:
+            self._structured_supported[(base_url, model_name)] = False
+
+    def close(self) -> None:
+        """
+        Closes the shared HTTP connection pool
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        """
+        with self._lock:
+            if self._http_client is not None:
+                self._http_client.close()
+            self._http_client = None
+            self._clients = {}
+            self._agents = {}
+
+
+_default_factory = AgentFactory()
+
+
+def get_client(api_key: str, base_url: str) -> OpenAI:
+    """
+    Returns the shared OpenAI client of the default factory, see
+    AgentFactory.get_client
+    """
+    return _default_factory.get_client(api_key=api_key, base_url=base_url)
+
+
+def get_agent(
+    model_name: str,
+    base_url: str,
+    temperature: float,
+    api_key: str,
+    structured_output: bool = False
+) -> "llm.LLMAgent":
+    """
+    Returns the shared LLMAgent of the default factory, see
+    AgentFactory.get_agent
+    """
+    return _default_factory.get_agent(
+        model_name=model_name,
+        base_url=base_url,
+        temperature=temperature,
+        api_key=api_key,
+        structured_output=structured_output
+    )
+
+
+def structured_output_supported(base_url: str, model_name: str) -> bool:
+    """
+    Returns whether the backend may support structured output, see
+    AgentFactory.structured_output_supported
+    """
+    return _default_factory.structured_output_supported(
+        base_url=base_url, model_name=model_name
+    )
+
+
+def mark_structured_output_unsupported(
+    base_url: str,
+    model_name: str
+) -> None:
+    """
+    Remembers that the backend rejected a response format, see
+    AgentFactory.mark_structured_output_unsupported
+    """
+    _default_factory.mark_structured_output_unsupported(
+        base_url=base_url, model_name=model_name
+    )
+
+
+def close() -> None:
+    """
+    Closes the HTTP connection pool of the default factory
+    """
+    _default_factory.close()
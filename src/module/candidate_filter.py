@@ -0,0 +1,273 @@
+import re
+import threading
+
+from .registry import registry
+
+
+FULL = "full"
+SINGLE_CALL = "single_call"
+SKIP = "skip"
+
+_MODES = {"off", SINGLE_CALL, SKIP}
+_EXAMPLE_SPAN_RE = re.compile(r"<span[^>]*>(.*?)</span", re.DOTALL)
+
+
+def _example_spans(pii_property: dict) -> list[str]:
+    """
+    Returns the annotated spans of the examples of a PII in properties.yml
+
+    Parameters
+    ----------
+    pii_property : dict
+        The entry of the PII in properties.yml
+
+    Returns
+    -------
+    list[str]
+        The spans
+    """
+    spans = []
+    for example in pii_property.get("example") or []:
+        for span in _EXAMPLE_SPAN_RE.findall(example):
+            span = " ".join(span.split())
+            if span and span not in spans:
+                spans.append(span)
+    return spans
+
+
+class FilterMetrics:
+    """
+    Counts the decisions of the candidate filter per PII over the whole
+    run and, in audit mode, the identifiers the full conversation found in
+    pairs the filter would have skipped (the recall impact).
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.per_pii = {}
+
+    def _entry(self, pii_name: str) -> dict:
+        return self.per_pii.setdefault(pii_name, {
+            "pairs": 0,
+            FULL: 0,
+            SINGLE_CALL: 0,
+            SKIP: 0,
+            "full_steps": 0,
+            "audited_pairs": 0,
+            "missed_pairs": 0,
+            "missed_identifiers": 0
+        })
+
+    def record_decision(self, pii_name: str, decision: str) -> None:
+        """
+        Counts the decision for a (chunk, PII) pair
+
+        Parameters
+        ----------
+        pii_name : str
+            The name of the PII
+        decision : str
+            full, single_call or skip
+
+        Returns
+        -------
+        None
+        """
+        with self._lock:
+            entry = self._entry(pii_name)
+            entry["pairs"] += 1
+            entry[decision] += 1
+
+    def record_full_conversation(self, pii_name: str, steps: int) -> None:
+        """
+        Adds the number of steps of a full conversation, used to estimate
+        the steps saved by skipped pairs
+
+        Parameters
+        ----------
+        pii_name : str
+            The name of the PII
+        steps : int
+            The number of meta expert steps of the conversation
+
+        Returns
+        -------
+        None
+        """
+        with self._lock:
+            self._entry(pii_name)["full_steps"] += steps
+
+    def record_audit(self, pii_name: str, identifiers: int) -> None:
+        """
+        Counts the identifiers found by the full conversation in a pair
+        the filter would have skipped
+
+        Parameters
+        ----------
+        pii_name : str
+            The name of the PII
+        identifiers : int
+            The number of identifiers found in the pair
+
+        Returns
+        -------
+        None
+        """
+        with self._lock:
+            entry = self._entry(pii_name)
+            entry["audited_pairs"] += 1
+            if identifiers:
+                entry["missed_pairs"] += 1
+                entry["missed_identifiers"] += identifiers
+
+    def summary(self) -> str:
+        """
+        Returns one line per PII with the decisions, the estimated meta
+        expert steps saved and the audited recall impact
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        str
+            The summary
+        """
+        lines = []
+        with self._lock:
+            for pii_name, entry in sorted(self.per_pii.items()):
+                full = entry[FULL] or 1
+                saved = entry[SKIP] * entry["full_steps"] / full
+                line = (
+                    f"{pii_name}: {entry['pairs']} pairs, "
+                    f"{entry[FULL]} full, {entry[SINGLE_CALL]} single call, "
+                    f"{entry[SKIP]} skipped (~{saved:.0f} steps saved)"
+                )
+                if entry["audited_pairs"]:
+                    line += (
+                        f", audit: {entry['missed_identifiers']} identifiers "
+                        f"in {entry['missed_pairs']}/{entry['audited_pairs']} "
+                        f"filtered pairs"
+                    )
+                lines.append(line)
+        return "\n".join(lines)
+
+
+filter_metrics = FilterMetrics()
+
+
+class CandidateFilter:
+    """
+    Fast local detector of candidate evidence for a PII in a chunk. The
+    evidence score of a (chunk, PII) pair is the number of matches of the
+    configured regexes and keywords and of the example spans of the PII
+    in properties.yml. Pairs below the threshold of their PII are skipped
+    or sent through a single extraction call instead of the full
+    conversation, see entity_description/candidate_filter.yml.
+
+    Parameters
+    ----------
+    property_dict : dict
+        The content of properties.yml
+    config : dict
+        The content of candidate_filter.yml
+    """
+    def __init__(self, property_dict: dict, config: dict):
+        self.audit = bool(config.get("audit", False))
+        self._rules = {}
+        for pii_name, pii_config in (config.get("pii") or {}).items():
+            mode = pii_config.get("mode", "off")
+            if mode not in _MODES:
+                raise ValueError(
+                    f"Invalid candidate filter mode {mode!r} for {pii_name}"
+                )
+            if mode == "off":
+                continue
+            patterns = list(pii_config.get("patterns") or [])
+            patterns += [
+                rf"\b{re.escape(keyword)}\b"
+                for keyword in pii_config.get("keywords") or []
+            ]
+            patterns += [
+                rf"\b{re.escape(span)}\b"
+                for span in _example_spans(property_dict.get(pii_name) or {})
+            ]
+            self._rules[pii_name] = (
+                mode,
+                int(pii_config.get("threshold", 1)),
+                [re.compile(pattern, re.IGNORECASE) for pattern in patterns]
+            )
+
+    def score(self, text: str, pii_name: str) -> int:
+        """
+        Returns the evidence score of the PII in the text, stops counting
+        at the threshold
+
+        Parameters
+        ----------
+        text : str
+            The chunk
+        pii_name : str
+            The name of the PII
+
+        Returns
+        -------
+        int
+            The number of evidence matches
+        """
+        _, threshold, patterns = self._rules[pii_name]
+        score = 0
+        for pattern in patterns:
+            for _ in pattern.finditer(text):
+                score += 1
+                if score >= threshold:
+                    return score
+        return score
+
+    def decide(self, text: str, pii_name: str) -> str:
+        """
+        Decides how the (chunk, PII) pair is processed
+
+        Parameters
+        ----------
+        text : str
+            The chunk
+        pii_name : str
+            The name of the PII
+
+        Returns
+        -------
+        str
+            full, single_call or skip
+        """
+        if pii_name not in self._rules:
+            return FULL
+        mode, threshold, _ = self._rules[pii_name]
+        if self.score(text, pii_name) >= threshold:
+            return FULL
+        return mode
+
+
+def load_candidate_filter(
+    property_yml_file_path: str,
+    config_path: str
+) -> CandidateFilter:
+    """
+    Creates the candidate filter from properties.yml and its config
+
+    Parameters
+    ----------
+    property_yml_file_path : str
+        The path to properties.yml
+    config_path : str
+        The path to candidate_filter.yml
+
+    Returns
+    -------
+    CandidateFilter
+        The candidate filter
+    """
+    return CandidateFilter(
+        property_dict=registry.read_yaml(property_yml_file_path),
+        config=registry.read_yaml(config_path)
+    )
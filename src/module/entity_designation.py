@@ -8,11 +8,9 @@ class Entity_designation(LLMAgent):
         prompt_folder: str,
         model_name: str = None,
         api_key: str = "YOUR_API_KEY",
-        port: int = 8080,
-        local: bool = False
+        port: int = 8080
     ):
         super().__init__(
-            local=local,
             prompt_folder=prompt_folder,
             model_name=model_name,
             api_key=api_key,
@@ -0,0 +1,194 @@
+import os
+import re
+import uuid
+import bisect
+
+from .registry import registry
+
+
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+# The candidates of names the gazetteer has to account for in resolve
+_CAPITALIZED_RE = re.compile(r"\b[A-Z]\w*")
+_END = object()
+
+
+class Gazetteer:
+    """
+    Token trie of known names (locations, nationalities, organizations).
+    The text is tokenized once and every token start is walked down the
+    trie, so tagging is linear in the text length times the length of the
+    longest entry, regardless of the number of entries. Matches are
+    case-insensitive, aligned to tokens and the longest entry wins.
+
+    Parameters
+    ----------
+    entries : dict[str, list[str]]
+        The entries keyed by their label (the PII name)
+    """
+    def __init__(self, entries: dict[str, list[str]] = None):
+        self._root = {}
+        self.labels = []
+        for label, names in (entries or {}).items():
+            for name in names:
+                self.add(name, label)
+
+    def add(self, name: str, label: str) -> None:
+        """
+        Adds an entry
+
+        Parameters
+        ----------
+        name : str
+            The name
+        label : str
+            The label of the name
+
+        Returns
+        -------
+        None
+        """
+        tokens = _TOKEN_RE.findall(name.lower())
+        if not tokens:
+            return
+        node = self._root
+        for token in tokens:
+            node = node.setdefault(token, {})
+        node.setdefault(_END, set()).add(label)
+        if label not in self.labels:
+            self.labels.append(label)
+
+    def find(self, text: str) -> list[tuple[int, int, str, str]]:
+        """
+        Returns the non-overlapping longest matches in the text
+
+        Parameters
+        ----------
+        text : str
+            The text
+
+        Returns
+        -------
+        list[tuple[int, int, str, str]]
+            Start, end, label and surface form of the matches, one entry
+            per label of a matched name
+        """
+        tokens = [
+            (m.start(), m.end(), m.group().lower())
+            for m in _TOKEN_RE.finditer(text)
+        ]
+        matches = []
+        i = 0
+        while i < len(tokens):
+            node = self._root
+            longest = None
+            j = i
+            while j < len(tokens) and tokens[j][2] in node:
+                node = node[tokens[j][2]]
+                j += 1
+                if _END in node:
+                    longest = (j, node[_END])
+            if longest is None:
+                i += 1
+                continue
+            j, labels = longest
+            start, end = tokens[i][0], tokens[j - 1][1]
+            for label in sorted(labels):
+                matches.append((start, end, label, text[start:end]))
+            i = j
+        return matches
+
+    def tag(self, text: str, label: str) -> list[str]:
+        """
+        Returns the distinct surface forms of the entries of a label in
+        the text, in order of appearance
+
+        Parameters
+        ----------
+        text : str
+            The text
+        label : str
+            The label (PII name)
+
+        Returns
+        -------
+        list[str]
+            The candidate spans
+        """
+        candidates = []
+        for _, _, match_label, surface in self.find(text):
+            if match_label == label and surface not in candidates:
+                candidates.append(surface)
+        return candidates
+
+    def resolve(self, text: str, label: str) -> list[dict] | None:
+        """
+        Resolves the chunk without the LLM if the gazetteer knows every
+        capitalized word in it, i.e. each lies in a match of any label.
+        The names of the label are then all its identifiers in the chunk
+        (possibly none); a single unknown capitalized word could be a
+        name the gazetteer lacks and needs the LLM.
+
+        Parameters
+        ----------
+        text : str
+            The chunk
+        label : str
+            The label (PII name)
+
+        Returns
+        -------
+        list[dict] | None
+            The solutions in the format of the conversation, [{}] if the
+            chunk has no names of the label, None if it isn't resolved
+        """
+        matches = self.find(text)
+        starts = [start for start, _, _, _ in matches]
+        for word in _CAPITALIZED_RE.finditer(text):
+            i = bisect.bisect_right(starts, word.start()) - 1
+            if i < 0 or matches[i][1] < word.end():
+                return None
+        solutions = []
+        for start, end, match_label, surface in matches:
+            if match_label != label:
+                continue
+            # The sentence around the name as its context
+            context_start = max(
+                text.rfind(".", 0, start), text.rfind("\n", 0, start)
+            ) + 1
+            context_end = min(
+                position for position in (
+                    text.find(".", end), text.find("\n", end), len(text)
+                ) if position >= 0
+            )
+            solutions.append({str(uuid.uuid4())[:16]: {
+                "identifier": surface,
+                "context": text[context_start:context_end].strip()
+            }})
+        return solutions or [{}]
+
+
+def load_gazetteer(directory: str) -> Gazetteer:
+    """
+    Loads the gazetteer files of a directory. Every <pii_name>.txt holds
+    one entry per line, lines starting with # are comments.
+
+    Parameters
+    ----------
+    directory : str
+        The directory of the gazetteer files
+
+    Returns
+    -------
+    Gazetteer
+        The gazetteer
+    """
+    entries = {}
+    for file_name in sorted(os.listdir(directory)):
+        if not file_name.endswith(".txt"):
+            continue
+        content = registry.read_text(os.path.join(directory, file_name))
+        entries[file_name[:-len(".txt")]] = [
+            line.strip() for line in content.splitlines()
+            if line.strip() and not line.lstrip().startswith("#")
+        ]
+    return Gazetteer(entries)
@@ -0,0 +1,201 @@
+import os
+import json
+import threading
+from loguru import logger
+
+from .gazetteer import Gazetteer
+
+
+def normalize_identifier(identifier: str) -> str:
+    """
+    Normalizes an identifier for the memory
+
+    Parameters
+    ----------
+    identifier : str
+        The identifier
+
+    Returns
+    -------
+    str
+        The lower-cased identifier with collapsed whitespace
+    """
+    return " ".join(identifier.split()).lower()
+
+
+class IdentifierMemory:
+    """
+    Persistent memory of the identifiers confirmed in completed documents,
+    keyed by (pii_name, normalized identifier) with the number of
+    documents they were confirmed in. Court names, laws, countries and
+    organizations recur across judgments: known identifiers are located
+    in new documents with a gazetteer trie and passed to the extraction
+    as hints. Once confirmed in min_count documents, their occurrences
+    are masked directly and they are no longer sent to the verifier.
+    record_document is given only the identifiers whose verdict passed
+    in a verified conversation (see
+    MetaExpertConversation.verified_identifiers), not the nodes of
+    single calls, gazetteer-resolved chunks or the rule engine.
+
+    The memory is a JSON file:
+
+    {
+        "documents": [doc_id, ...],
+        "identifiers": {pii_name: {normalized identifier: count}}
+    }
+
+    Parameters
+    ----------
+    path : str
+        The path to the JSON file, created on the first save
+    min_count : int
+        The number of documents an identifier has to be confirmed in to
+        be masked directly
+    """
+    def __init__(self, path: str, min_count: int = 2):
+        self.path = path
+        self.min_count = min_count
+        self._lock = threading.Lock()
+        self._documents = set()
+        self._identifiers = {}
+        self._gazetteers = {}
+        if os.path.isfile(path):
+            with open(path, "r") as f:
+                content = json.load(f)
+            self._documents = set(content.get("documents", []))
+            self._identifiers = content.get("identifiers", {})
+            logger.info(
+                f"Loaded identifier memory of {len(self._documents)} "
+                f"documents from {path}"
+            )
+
+    def record_document(
+        self,
+        doc_id: str,
+        identifiers: dict[str, list[str]]
+    ) -> None:
+        """
+        Adds the confirmed identifiers of a completed document, every
+        identifier counts once per document
+
+        Parameters
+        ----------
+        doc_id : str
+            The ID of the document.
+        identifiers : dict[str, list[str]]
+            The confirmed identifiers keyed by PII name
+
+        Returns
+        -------
+        None
+        """
+        with self._lock:
+            if doc_id in self._documents:
+                return
+            self._documents.add(doc_id)
+            for pii_name, pii_identifiers in identifiers.items():
+                counts = self._identifiers.setdefault(pii_name, {})
+                for identifier in {
+                    normalize_identifier(i) for i in pii_identifiers
+                }:
+                    if identifier:
+                        counts[identifier] = counts.get(identifier, 0) + 1
+                self._gazetteers.pop(pii_name, None)
+
+    def save(self) -> None:
+        """
+        Writes the memory to its JSON file, atomically
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        """
+        with self._lock:
+            content = {
+                "documents": sorted(self._documents),
+                "identifiers": self._identifiers
+            }
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            temp_path = f"{self.path}.tmp"
+            with open(temp_path, "w") as f:
+                json.dump(content, f)
+            os.replace(temp_path, self.path)
+
+    def confirmed(self, pii_name: str) -> dict[str, int]:
+        """
+        Returns the identifiers of the PII confirmed in at least
+        min_count documents
+
+        Parameters
+        ----------
+        pii_name : str
+            The name of the PII
+
+        Returns
+        -------
+        dict[str, int]
+            The normalized identifiers and their counts
+        """
+        with self._lock:
+            return {
+                identifier: count
+                for identifier, count in self._identifiers.get(
+                    pii_name, {}
+                ).items()
+                if count >= self.min_count
+            }
+
+    def find(self, text: str, pii_name: str) -> list[str]:
+        """
+        Returns the known identifiers of the PII in the text, in order of
+        appearance
+
+        Parameters
+        ----------
+        text : str
+            The text
+        pii_name : str
+            The name of the PII
+
+        Returns
+        -------
+        list[str]
+            The identifiers as written in the text
+        """
+        with self._lock:
+            gazetteer = self._gazetteers.get(pii_name)
+            if gazetteer is None:
+                gazetteer = Gazetteer(
+                    {pii_name: list(self._identifiers.get(pii_name, {}))}
+                )
+                self._gazetteers[pii_name] = gazetteer
+        return gazetteer.tag(text, pii_name)
+
+
+    def find_confirmed(self, text: str, pii_name: str) -> list[str]:
+        """
+        Returns the identifiers of the PII in the text that were confirmed
+        in at least min_count documents, in order of appearance
+
+        Parameters
+        ----------
+        text : str
+            The text
+        pii_name : str
+            The name of the PII
+
+        Returns
+        -------
+        list[str]
+            The identifiers as written in the text
+        """
+        confirmed = self.confirmed(pii_name)
+        return [
+            identifier for identifier in self.find(text, pii_name)
+            if normalize_identifier(identifier) in confirmed
+        ]
@@ -0,0 +1,224 @@
+import re
+import json
+
+
+# Outside of a candidate only openings that look like JSON matter: an
+# object with a key or an array of structured values. References in
+# prose such as "[1]" or "{several}" and quotes (e.g. "it's") are
+# skipped by the regex engine. Inside a candidate whole strings are
+# consumed by the regex engine instead of a Python level loop.
+_OPEN_RE = re.compile(r"\{\s*[\"'}]|\[\s*[\"'{\[\]]")
+_TOKEN_RE = re.compile(
+    r'"(?:[^"\\]|\\.)*"|\'(?:[^\'\\]|\\.)*\'|[{}\[\]]',
+    re.DOTALL
+)
+_FENCE_RE = re.compile(r"```[ \t]*(?:json|JSON)?[ \t]*\n?(.*?)```", re.DOTALL)
+_CLOSING = {"{": "}", "[": "]"}
+_DECODER = json.JSONDecoder()
+# Nesting deeper than the recursion limit fails like malformed JSON
+_DECODE_ERRORS = (json.JSONDecodeError, RecursionError)
+_REPAIR_RE = re.compile(
+    r'"(?:[^"\\]|\\.)*"|\'((?:[^\'\\]|\\.)*)\'|,(?=\s*[}\]])'
+    r"|\b(?:True|False|None)\b",
+    re.DOTALL
+)
+_QUOTE_ESCAPE_RE = re.compile(r"\\'|\\\"|\"")
+_PYTHON_LITERALS = {"True": "true", "False": "false", "None": "null"}
+
+
+def _record_balanced_ends(
+    text: str,
+    start: int,
+    ends: dict[int, int | None]
+) -> None:
+    """
+    Walks the tokens from the opening bracket at start until it is closed
+    or can't be anymore, and records the end of every opening passed on
+    the way: the end (exclusive) of its balanced object or array, None
+    if the brackets are not balanced. Strings in single or double quotes
+    are skipped, so brackets inside of them are not counted.
+
+    An opening inside the walk sees the same tokens from there on, so
+    its end is the one it would get from a walk of its own. A mismatched
+    or missing closing bracket leaves every open bracket unbalanced.
+
+    Parameters
+    ----------
+    text : str
+        The text to scan
+    start : int
+        The position of the opening bracket
+    ends : dict[int, int | None]
+        The ends by the position of the opening, updated in place
+
+    Returns
+    -------
+    None
+    """
+    pos = start
+    stack = []
+    while True:
+        token = _TOKEN_RE.search(text, pos)
+        if token is None:
+            break
+        pos = token.end()
+        value = token.group(0)
+        if value in _CLOSING:
+            stack.append((_CLOSING[value], token.start()))
+        elif value in ("}", "]"):
+            closing, opened = stack.pop()
+            if value != closing:
+                stack.append((closing, opened))
+                break
+            ends[opened] = pos
+            if not stack:
+                return
+    for _, opened in stack:
+        ends[opened] = None
+
+
+def _repair_token(match: re.Match) -> str:
+    """
+    Replaces a single token matched by _REPAIR_RE with its strict
+    JSON counterpart.
+
+    Parameters
+    ----------
+    match : re.Match
+        The matched token
+
+    Returns
+    -------
+    str
+        The replacement
+    """
+    token = match.group(0)
+    if token[0] == '"':
+        return token
+    if token[0] == "'":
+        inner = _QUOTE_ESCAPE_RE.sub(
+            lambda m: "'" if m.group(0) == "\\'" else '\\"',
+            match.group(1)
+        )
+        return f'"{inner}"'
+    if token == ",":
+        return ""
+    return _PYTHON_LITERALS[token]
+
+
+def _repair(candidate: str) -> str:
+    """
+    Repairs the most common deviations of LLMs from strict JSON:
+    single quoted strings, trailing commas and Python literals.
+
+    Parameters
+    ----------
+    candidate : str
+        The JSON candidate to repair
+
+    Returns
+    -------
+    str
+        The repaired candidate
+    """
+    return _REPAIR_RE.sub(_repair_token, candidate)
+
+
+def _scan(text: str) -> tuple[object, bool] | None:
+    """
+    Scans the text for the first candidate that can be parsed. Strict
+    JSON is decoded straight from the opening by the C decoder, only
+    if that fails the balanced candidate is cut out and repaired. If
+    an opening has no balanced end or doesn't parse, e.g. a bracket in
+    a quote of the prose, the scan continues right after it, so a
+    valid candidate later on or nested in it is still found.
+
+    The balanced ends are looked up in a table filled by the bracket
+    walks (see _record_balanced_ends), which records the end of every
+    opening it passes. A new walk only starts at an opening no earlier
+    walk passed, e.g. one it read as part of a string, so prose full of
+    unbalanced brackets is walked once instead of once per opening. An
+    opening known to be unbalanced can't start strict JSON either and
+    is skipped without decoding.
+
+    Parameters
+    ----------
+    text : str
+        The text to scan
+
+    Returns
+    -------
+    tuple[object, bool] | None
+        The parsed value and whether it had to be repaired, None if
+        no candidate could be parsed
+    """
+    ends = {}
+    pos = 0
+    while True:
+        opening = _OPEN_RE.search(text, pos)
+        if opening is None:
+            return None
+        start = opening.start()
+        pos = start + 1
+        if start in ends and ends[start] is None:
+            continue
+        try:
+            return _DECODER.raw_decode(text, start)[0], False
+        except _DECODE_ERRORS:
+            pass
+        if start not in ends:
+            _record_balanced_ends(text, start, ends)
+        end = ends[start]
+        if end is not None:
+            try:
+                return json.loads(_repair(text[start:end])), True
+            except _DECODE_ERRORS:
+                pass
+
+
+def extract_json(response: str) -> tuple[object, str]:
+    """
+    Extracts the first JSON object or array from a LLM response in a
+    single pass. Fenced code blocks are preferred, afterwards the
+    whole response is scanned for bare JSON.
+
+    The path that was used is returned as well and is one of
+    "fenced", "fenced_repaired", "bare", "bare_repaired" or "none".
+
+    Parameters
+    ----------
+    response : str
+        The response to extract from
+
+    Returns
+    -------
+    tuple[object, str]
+        The parsed JSON (None if nothing was found) and the path
+    """
+    if response is None:
+        return None, "none"
+
+    fence = _FENCE_RE.search(response)
+    if fence is not None:
+        body = fence.group(1).strip()
+        try:
+            return json.loads(body), "fenced"
+        except _DECODE_ERRORS:
+            result = _scan(body)
+        if result is not None:
+            value, repaired = result
+            return value, "fenced_repaired" if repaired else "fenced"
+
+    stripped = response.strip()
+    if stripped[:1] in _CLOSING:
+        try:
+            return json.loads(stripped), "bare"
+        except _DECODE_ERRORS:
+            pass
+
+    result = _scan(response)
+    if result is not None:
+        value, repaired = result
+        return value, "bare_repaired" if repaired else "bare"
+
+    return None, "none"
@@ -1,14 +1,17 @@
 import uuid
 import os
-from openai import OpenAI, AsyncOpenAI
-import re
-import json
-import pprint
+from openai import BadRequestError, UnprocessableEntityError
 import yaml
 import asyncio
 from typing import Union
 from loguru import logger
 
+from . import agent_factory
+from . import json_extraction
+from . import prompt_layout
+from .token_usage import usage_tracker
+from .logging_config import log_payload, PROMPT, RESPONSE
+
 
 class LLMAgent:
     """
@@ -28,17 +31,20 @@ class LLMAgent:
         The temperature of the model
     base_url : str
         The base URL of the LLM API
+    structured_output : bool
+        If True, JSON schema constrained output is requested where
+        a schema is given
     """
 
     def __init__(
         self,
-        local: bool,
         prompt_folder: str,
         model_name: str = None,
         api_key: str = "YOUR_API_KEY",
         port: int = None,  # 8080
         temperature: float = 1.0,
-        base_url: str = "https://api.openai.com/v1"
+        base_url: str = "https://api.openai.com/v1",
+        structured_output: bool = False
     ):
         """
         Initializes the LLM Agent
@@ -53,19 +59,20 @@ class LLMAgent:
             The API key for the OpenAI API
         port : int
             The port of the OpenAI API
+        structured_output : bool
+            If True, JSON schema constrained output is requested where
+            a schema is given
         """
         self.model_name = model_name
         self.api_key = api_key
         self.prompt_folder = prompt_folder
         self.temperature = temperature
-        if local:
-            self.client = OpenAI(
-                api_key=self.api_key, base_url=base_url
-            )
-        else:
-            self.client = AsyncOpenAI(
-                api_key=self.api_key, base_url=base_url
-            )
+        self.structured_output = structured_output
+        self.base_url = base_url
+        # All agents share one thread-safe client and connection pool
+        self.client = agent_factory.get_client(
+            api_key=self.api_key, base_url=base_url
+        )
 
     def read_prompt(
         self,
@@ -103,13 +110,137 @@ class LLMAgent:
 
         return prompt
 
+    def _build_request(
+        self,
+        developer_prompt: str,
+        conversation_list: list[dict[str, str]],
+        response_schema: dict = None
+    ) -> dict:
+        """
+        Builds the arguments of a chat completion request
+
+        Parameters
+        ----------
+        developer_prompt : str
+            The developer prompt
+        conversation_list : list[dict[str, str]]
+            The conversation list
+        response_schema : dict
+            The JSON schema (see schemas.py) the response should follow
+
+        Returns
+        -------
+        dict
+            The request arguments
+        """
+        messages = [{
+            "role": "system",
+            "content": prompt_layout.normalize_prefix(developer_prompt)
+        }]
+        for conversation in conversation_list:
+            messages.append(conversation)
+
+        log_payload(
+            PROMPT, "Sending prompt", model=self.model_name, messages=messages
+        )
+        request = {
+            "model": self.model_name,
+            "messages": messages,
+            "temperature": self.temperature
+        }
+        if self.structured_output and response_schema is not None \
+                and agent_factory.structured_output_supported(
+                    base_url=self.base_url, model_name=self.model_name
+                ):
+            request["response_format"] = {
+                "type": "json_schema",
+                "json_schema": response_schema
+            }
+        return request
+
+    @staticmethod
+    def _rejects_response_format(error: Exception) -> bool:
+        """
+        Checks whether a rejected request was rejected for its response
+        format, not e.g. for the length of the prompt
+
+        Parameters
+        ----------
+        error : Exception
+            The error of the backend
+
+        Returns
+        -------
+        bool
+            Whether the error concerns the response format
+        """
+        # The parameter or code named by the backend decides, the
+        # message only if it names neither
+        param = getattr(error, "param", None)
+        if param:
+            return str(param).split(".")[0] == "response_format"
+        code = str(getattr(error, "code", None) or "").lower()
+        if "response_format" in code or "json_schema" in code:
+            return True
+        message = str(error).lower()
+        return any(
+            key in message
+            for key in ("response_format", "json_schema", "structured")
+        )
+
+    def _create_completion(self, request: dict) -> str:
+        """
+        Sends a chat completion request over the shared client. If the
+        backend rejects the response format, this request is sent again
+        without it and the backend is marked in the agent factory, so
+        later requests to it leave the response format out.
+
+        Parameters
+        ----------
+        request : dict
+            The request arguments (see _build_request)
+
+        Returns
+        -------
+        str
+            The response
+        """
+        try:
+            response = self.client.chat.completions.create(**request)
+        except (BadRequestError, UnprocessableEntityError) as e:
+            if "response_format" not in request \
+                    or not self._rejects_response_format(e):
+                raise e
+            logger.warning(
+                f"Structured output not supported by backend, "
+                f"falling back to the legacy parser: {e}"
+            )
+            agent_factory.mark_structured_output_unsupported(
+                base_url=self.base_url, model_name=self.model_name
+            )
+            request = {
+                key: value for key, value in request.items()
+                if key != "response_format"
+            }
+            response = self.client.chat.completions.create(**request)
+        usage_tracker.record(response.usage)
+        content = response.choices[0].message.content
+        log_payload(
+            RESPONSE, "Response", model=self.model_name, response=content
+        )
+        return content
+
     async def send_prompt_async(
         self,
         developer_prompt: str,
         conversation_list: list[dict[str, str]],
+        response_schema: dict = None
     ) -> str:
         """
-        Sends prompt and returns response asynchronously
+        Sends prompt and returns response asynchronously. If structured
+        output is enabled and a schema is given, the response is
+        constrained to the schema. If the backend rejects the response
+        format, the prompt is sent again without it.
 
         Parameters
         ----------
@@ -117,28 +248,24 @@ class LLMAgent:
             The developer prompt
         conversation_list : list[dict[str, str]]
             The conversation list
+        response_schema : dict
+            The JSON schema (see schemas.py) the response should follow
 
         Returns
         -------
         str
             The response
         """
-        messages = [{"role": "system", "content": developer_prompt}]
-        for conversation in conversation_list:
-            messages.append(conversation)
-
-        logger.info(f"Sending prompt: {pprint.pformat(messages)}")
-        response = await self.client.chat.completions.create(
-            model=self.model_name,
-            messages=messages,
-            temperature=self.temperature
+        request = self._build_request(
+            developer_prompt, conversation_list, response_schema
         )
-        return response.choices[0].message.content
+        return await asyncio.to_thread(self._create_completion, request)
 
     def send_prompt(
         self,
         developer_prompt: str,
         conversation_list: list[dict[str, str]],
+        response_schema: dict = None
     ) -> str:
         """
         Sends prompt and returns response synchronously
@@ -149,23 +276,18 @@ class LLMAgent:
             The developer prompt
         conversation_list : list[dict[str, str]]
             The conversation list
+        response_schema : dict
+            The JSON schema (see schemas.py) the response should follow
 
         Returns
         -------
         str
             The response
         """
-        # Use asyncio.run() to execute the async function
-        response_temp = asyncio.run(
-            self.send_prompt_async(developer_prompt, conversation_list)
-        )
-
-        logger.info(
-            "\n\n ----- Response:\n\n {response_temp}\n-----------------",
-            response_temp=response_temp
+        request = self._build_request(
+            developer_prompt, conversation_list, response_schema
         )
-
-        return response_temp
+        return self._create_completion(request)
 
     def send_prompt_simple(
         self,
@@ -197,62 +319,13 @@ class LLMAgent:
 
         return response.choices[0].message.content
 
-    def _extract_json_erroneous(
-        self,
-        response: str
-    ) -> dict:
-        """
-        Extracts the JSON from the response if no backticks.
-
-        Parameters
-        ----------
-        response : str
-            The response to extract from.
-
-        Returns
-        -------
-        dict
-            The extracted JSON.
-        """
-        m = re.search(r'{\s*"extracted_information"\s*:\s*\[', response)
-        if m:
-            start = m.start()
-
-            # Balance braces to extract the full JSON object
-            depth = 0
-            in_str = False
-            escape = False
-            end = None
-
-            for i, ch in enumerate(response[start:], start=start):
-                if in_str:
-                    if escape:
-                        escape = False
-                    elif ch == '\\':
-                        escape = True
-                    elif ch == '"':
-                        in_str = False
-                else:
-                    if ch == '"':
-                        in_str = True
-                    elif ch == '{':
-                        depth += 1
-                    elif ch == '}':
-                        depth -= 1
-                        if depth == 0:
-                            end = i + 1
-                            break
-
-            if end is not None:
-                json_str = response[start:end].strip()
-                return json.loads(json_str)
-
     def _extract_json_from_response(
         self,
         response: str
     ) -> dict:
         """
-        Extracts the JSON from the response.
+        Extracts the JSON from the response. The path used for the
+        extraction (fenced, bare or repaired) is logged.
 
         Parameters
         ----------
@@ -262,42 +335,13 @@ class LLMAgent:
         Returns
         -------
         dict
-            The extracted JSON.
+            The extracted JSON, None if no JSON could be found.
         """
-        try:
-            return json.loads(
-                re.search(r"```json\s([\s\S]*?)```", response).group(1)
-            )
-        except (AttributeError, json.JSONDecodeError, IndexError):
-            try:
-                return json.loads(
-                    re.search(r"(?s)`\s*(\{.*?\})\s*`", response).group(1)
-            )
-            except (AttributeError, json.JSONDecodeError, IndexError):
-                try:
-                    return json.loads(response)
-                except (AttributeError, json.JSONDecodeError, IndexError):
-                    try:
-                        pattern = r"```json\s*\n([\s\S]*?)\n```"
-                        match = re.findall(pattern, response)[0]
-                        return match.replace("```json", "")
-                    except (AttributeError, json.JSONDecodeError, IndexError):
-                        try:
-                            return json.loads(
-                                re.search(r"```(.*?)```", response, re.DOTALL).group(1)
-                            )
-                        except (AttributeError, json.JSONDecodeError, IndexError):
-                            try:
-                                return json.loads(response)
-                            except (AttributeError, json.JSONDecodeError, IndexError):
-                                try:
-                                    return self._extract_json_erroneous(response)
-                                except (AttributeError, json.JSONDecodeError, IndexError) as e:
-                                    print(f"""
-                                    Json could not be found for response:
-                                    {response}
-                                    """)
-                                    raise e
+        result, path = json_extraction.extract_json(response)
+        logger.debug(f"JSON extracted from response via path '{path}'")
+        if path == "none":
+            logger.warning(f"Json could not be found for response: {response}")
+        return result
 
     def load_yml(
         self,
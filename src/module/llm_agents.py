@@ -8,12 +8,19 @@ from typing import Union
 import yaml
 import asyncio
 import textwrap
+import time
 from loguru import logger
 
 
 from .llm import LLMAgent
 from .neo4j_conn import Neo4jConnection
 from . import utils
+from . import schemas
+from . import prompt_layout
+from .registry import registry
+from .identifier_memory import normalize_identifier
+from .speculation import speculation_metrics
+from .logging_config import log_payload, CONVERSATION, RESPONSE, VERIFICATION
 
 
 class PromptCreater(LLMAgent):
@@ -29,12 +36,12 @@ class PromptCreater(LLMAgent):
         model_name: str = None,
         base_url: str = "https://api.openai.com/v1",
         temperature: float = 1.0,
-        local: bool = False,
         refine_prompts: bool = False,
+        refine_candidates: int = 1,
+        refine_time_budget: float = None,
         **prompts
     ):
         super().__init__(
-            local=local,
             prompt_folder=prompt_handcrafted_folder,
             model_name=model_name,
             temperature=temperature,
@@ -42,11 +49,14 @@ class PromptCreater(LLMAgent):
             base_url=base_url
         )
         self.doc_id = doc_id
-        self.yml = utils.read_yaml(property_yml_file)
+        self.yml = registry.read_yaml(property_yml_file)
         self.category = category
         self.refine_prompts = refine_prompts
+        # With more than one candidate the parallel feedback loop is used
+        self.refine_candidates = refine_candidates
+        self.refine_time_budget = refine_time_budget
         self.prompt_folder_to_save = prompt_folder_to_save
-        prompt_config_yml = utils.read_yaml(prompt_config_yml)
+        prompt_config_yml = registry.read_yaml(prompt_config_yml)
         self.prompts = utils.set_prompts_argument(
             prompt_folder=self.prompt_folder,
             prompt_config_yml=prompt_config_yml
@@ -139,7 +149,6 @@ class PromptCreater(LLMAgent):
         try:
             with open(file_path, "w") as f:
                 f.write(prompt)
-            print(f"Prompt saved to '{file_path}'")
             logger.info(f"Prompt saved to '{file_path}'")
         except OSError as e:
             raise OSError(f"Error saving file '{file_path}': {e}")
@@ -209,8 +218,7 @@ class PromptCreater(LLMAgent):
             The JSON string
         """
         if guidelines_path is not None:
-            with open(guidelines_path, "r") as f:
-                guidelines = f.read()
+            guidelines = registry.read_text(guidelines_path)
         pii_dict = utils.get_property_information(
             yml=self.yml,
             pii_name=pii_name
@@ -412,6 +420,186 @@ class PromptCreater(LLMAgent):
             return True
         return False
 
+    def score_feedback(
+        self,
+        text: str
+    ) -> int:
+        """
+        Returns the lowest score of a feedback, so that a candidate
+        reaching the cutoff also passes check_score
+
+        Parameters
+        ----------
+        text : str
+            The feedback with scores in the form x/10
+
+        Returns
+        -------
+        int
+            The lowest score, 10 if the feedback has no scores (like
+            check_score, which passes them)
+        """
+        matches = re.findall(r'\b(\d+)/10\b', text)
+        return min((int(match) for match in matches), default=10)
+
+    async def create_candidates(
+        self,
+        developer_prompt: str,
+        conversation_list: list[dict[str, str]],
+        user_feedback: str,
+        n_candidates: int
+    ) -> list[tuple[str, str]]:
+        """
+        Generates revisions of a prompt concurrently and gets the feedback
+        on each of them concurrently
+
+        Parameters
+        ----------
+        developer_prompt : str
+            The feedback prompt
+        conversation_list : list[dict[str, str]]
+            The conversation ending with the request to incorporate the
+            feedback
+        user_feedback : str
+            The request for feedback on a revision
+        n_candidates : int
+            The number of revisions
+
+        Returns
+        -------
+        list[tuple[str, str]]
+            The revisions and their feedback
+        """
+        async with asyncio.TaskGroup() as tg:
+            revision_tasks = [
+                tg.create_task(self.send_prompt_async(
+                    developer_prompt=developer_prompt,
+                    conversation_list=conversation_list
+                ))
+                for _ in range(n_candidates)
+            ]
+        revisions = [task.result() for task in revision_tasks]
+        async with asyncio.TaskGroup() as tg:
+            feedback_tasks = [
+                tg.create_task(self.send_prompt_async(
+                    developer_prompt=developer_prompt,
+                    conversation_list=conversation_list + [
+                        {"role": "assistant", "content": revision},
+                        {"role": "user", "content": user_feedback}
+                    ]
+                ))
+                for revision in revisions
+            ]
+        return list(zip(
+            revisions, [task.result() for task in feedback_tasks]
+        ))
+
+    def parallel_feedback_loop(
+        self,
+        generated_prompt: str,
+        n_candidates: int = 3,
+        cutoff: int = 8,
+        max_rounds: int = 5,
+        time_budget: float = None
+    ) -> tuple[str, list[dict]]:
+        """
+        Parallel variant of feedback_loop: every round refines the best
+        prompt so far into n_candidates revisions concurrently, scores
+        them concurrently and keeps the best one. Stops once the best
+        score reaches the cutoff, after max_rounds or when the wall-clock
+        time budget is used up. The best score is logged against the
+        elapsed time after every round.
+
+        Parameters
+        ----------
+        generated_prompt : str
+            The generated prompt
+        n_candidates : int
+            The number of revisions per round
+        cutoff : int
+            The score (x/10) every criterion has to reach
+        max_rounds : int
+            The maximum number of rounds
+        time_budget : float
+            The wall-clock budget in seconds, no new round is started
+            after it is used up. If None, only the rounds are limited
+
+        Returns
+        -------
+        tuple[str, list[dict]]
+            The best prompt and the trace of the rounds (round, elapsed
+            seconds, scores of the candidates and best score)
+        """
+        start = time.perf_counter()
+        developer_prompt = self.return_prompt(
+            type_prompt="feedback"
+        )
+        user_incorporate_feedback = self.return_prompt(
+            type_prompt="incorporate"
+        )
+        user_feedback = "Please provide feedback on the new prompt."
+
+        best_prompt = generated_prompt
+        best_feedback = self.send_prompt(
+            developer_prompt=developer_prompt,
+            conversation_list=[{
+                "role": "user",
+                "content": f"<prompt>{generated_prompt}</prompt>"
+            }]
+        )
+        best_score = self.score_feedback(best_feedback)
+        trace = [{
+            "round": 0,
+            "elapsed": time.perf_counter() - start,
+            "scores": [best_score],
+            "best_score": best_score
+        }]
+
+        round_number = 0
+        while best_score < cutoff and round_number < max_rounds:
+            if time_budget is not None \
+                    and time.perf_counter() - start >= time_budget:
+                logger.info(
+                    f"Feedback loop stopped by the time budget of "
+                    f"{time_budget}s"
+                )
+                break
+            round_number += 1
+            conversation_list = [
+                {"role": "user", "content": f"<prompt>{best_prompt}</prompt>"},
+                {"role": "assistant", "content": best_feedback},
+                {"role": "user", "content": user_incorporate_feedback}
+            ]
+            candidates = asyncio.run(self.create_candidates(
+                developer_prompt=developer_prompt,
+                conversation_list=conversation_list,
+                user_feedback=user_feedback,
+                n_candidates=n_candidates
+            ))
+            scores = [
+                self.score_feedback(feedback) for _, feedback in candidates
+            ]
+            best_index = max(range(len(scores)), key=scores.__getitem__)
+            if scores[best_index] >= best_score:
+                best_prompt, best_feedback = candidates[best_index]
+                best_score = scores[best_index]
+            trace.append({
+                "round": round_number,
+                "elapsed": time.perf_counter() - start,
+                "scores": scores,
+                "best_score": best_score
+            })
+            logger.info(
+                "Feedback loop round {round_number}: best score {score}/10 "
+                "after {elapsed:.1f}s (candidates: {scores})",
+                round_number=round_number,
+                score=best_score,
+                elapsed=trace[-1]["elapsed"],
+                scores=scores
+            )
+
+        return best_prompt, trace
+
     def feedback_loop(
         self,
         generated_prompt
@@ -459,7 +647,6 @@ class PromptCreater(LLMAgent):
                 "Feedback loop round: {round_number}:",
                 round_number=round_number + 1,
             )
-            print(f"Round: {round_number + 1}")
             conversation_list.extend([
                 {"role": "assistant", "content": responses[-1]},
                 {"role": "user", "content": user_incorporate_feedback}
@@ -495,7 +682,8 @@ class PromptCreater(LLMAgent):
     ) -> str:
         """
         Starts the feedback loop with the prompt if
-        refine_prompts is set to True
+        refine_prompts is set to True, the parallel one if
+        refine_candidates is larger than 1
 
         Parameters
         ----------
@@ -507,7 +695,13 @@ class PromptCreater(LLMAgent):
         str
             The (potentially) refined prompt
         """
-        if self.refine_prompts:
+        if self.refine_prompts and self.refine_candidates > 1:
+            prompt, _ = self.parallel_feedback_loop(
+                generated_prompt=prompt,
+                n_candidates=self.refine_candidates,
+                time_budget=self.refine_time_budget
+            )
+        elif self.refine_prompts:
             prompt, _ = self.feedback_loop(
                 generated_prompt=prompt
             )
@@ -544,7 +738,6 @@ class PromptCreater(LLMAgent):
 class MetaPrompter(LLMAgent):
     def __init__(
         self,
-        local: bool,
         doc_id: str,
         prompt_folder: str,
         yml_file: str,
@@ -557,21 +750,22 @@ class MetaPrompter(LLMAgent):
         temperature: float = 1.0,
         port: int = None,
         conn: Neo4jConnection = None,
+        structured_output: bool = False,
     ):
         super().__init__(
-            local=local,
             prompt_folder=prompt_folder,
             model_name=model_name,
             temperature=temperature,
             api_key=api_key,
             base_url=base_url,
-            port=port
+            port=port,
+            structured_output=structured_output
         )
-        self.yml = utils.read_yaml(yml_file)
+        self.yml = registry.read_yaml(yml_file)
         self.conn = conn
         self.doc_id = doc_id
         self.prompt_creater = prompt_creater
-        prompt_config_yml = utils.read_yaml(prompt_config_yml)
+        prompt_config_yml = registry.read_yaml(prompt_config_yml)
         self.prompts = utils.set_prompts_argument(
             prompt_folder=self.prompt_folder,
             prompt_config_yml=prompt_config_yml
@@ -611,8 +805,7 @@ class MetaPrompter(LLMAgent):
             The JSON string
         """
         if guidelines_path is not None:
-            with open(guidelines_path, "r") as f:
-                guidelines = f.read()
+            guidelines = registry.read_text(guidelines_path)
         pii_dict = utils.get_property_information(
             yml=self.yml,
             pii_name=pii_name
@@ -716,6 +909,13 @@ class MetaPrompter(LLMAgent):
         str
             The next step
         """
+        try:
+            next_step = json.loads(response)
+            if isinstance(next_step, dict) and "Next" in next_step:
+                return json.dumps({"Next": next_step["Next"]})
+        except json.JSONDecodeError:
+            pass
+
         patterns = [
             r'(\{"Next":\s?"\w+"\})'
         ]
@@ -967,14 +1167,13 @@ class MetaPrompterIndependent(MetaPrompter):
         prompt_creater: PromptCreater,
         prompt_config_yml: str,
         model_name: str = None,
-        local: bool = False,
         base_url: str = "https://api.openai.com/v1",
         temperature: float = 1.0,
         port: int = None,
         conn: Neo4jConnection = None,
+        structured_output: bool = False,
     ):
         super().__init__(
-            local=local,
             doc_id=doc_id,
             prompt_folder=prompt_folder,
             model_name=model_name,
@@ -986,14 +1185,16 @@ class MetaPrompterIndependent(MetaPrompter):
             yml_file=yml_file,
             prompt_config_yml=prompt_config_yml,
             prompt_creater=prompt_creater,
-            conn=conn
+            conn=conn,
+            structured_output=structured_output
         )
 
     def extract_with_prompt(
         self,
         text: str,
         generated_prompts: str,
-        pii_name: str
+        pii_name: str,
+        hints: list[str] = None
     ) -> str:
         """
         Extracts the solution from the text with the help
@@ -1007,6 +1208,8 @@ class MetaPrompterIndependent(MetaPrompter):
             The generated prompts
         pii_name : str
             The name of the PII
+        hints : list[str]
+            Candidate spans of the gazetteer in the text
 
         Returns
         -------
@@ -1017,20 +1220,27 @@ class MetaPrompterIndependent(MetaPrompter):
             yml=self.yml,
             pii_name=pii_name
         )
-        user_prompt_text = textwrap.dedent(f"""
-            <text>{text}</text>
-            <pii>{pii_dict[pii_name]}</pii>
-            <pii_description>{pii_dict[pii_name]["description"]}</pii_description>
-        """)
+        suffix = [("text", text)]
+        if hints:
+            suffix.append((
+                "gazetteer_hints",
+                "Candidate spans found by a gazetteer lookup, they may be "
+                f"incomplete or wrong: {json.dumps(hints, ensure_ascii=False)}"
+            ))
+        user_prompt_text = prompt_layout.assemble_user_prompt(
+            prefix=[
+                ("pii", str(pii_dict[pii_name])),
+                ("pii_description", pii_dict[pii_name]["description"])
+            ],
+            suffix=suffix
+        )
         conversation_list = [{"role": "user", "content": user_prompt_text}]
         response = self.send_prompt(
             developer_prompt=generated_prompts,
-            conversation_list=conversation_list
+            conversation_list=conversation_list,
+            response_schema=schemas.EXTRACTION_SCHEMA
         )
-        print("--")
-        print("response\n")
-        print(response)
-        print("--")
+        logger.debug(f"Extraction response:\n{response}")
         response = self._extract_json_from_response(response)
         return json.dumps(response)
 
@@ -1060,7 +1270,7 @@ class MetaPrompterIndependent(MetaPrompter):
 
             return uuid_list
         except:
-            print(solution)
+            logger.warning(f"Could not add UUIDs to the solution: {solution}")
 
 
     async def send_solutions_for_verification(
@@ -1094,17 +1304,21 @@ class MetaPrompterIndependent(MetaPrompter):
         """
         tasks = []
         solutions = json.loads(solutions)
+        # The text and PII are shared by the whole fan-out, only the
+        # solution differs, so it goes last to keep the prefix cacheable
+        prefix = [("pii", f"{pii_name}: {pii_description}")]
         async with asyncio.TaskGroup() as tg:
             for solution in solutions:
-                user_prompt = f"""
-                <solution>{solution}</solution>
-                <text>{text}</text>
-                <pii>{pii_name}: {pii_description}</pii>
-                """
+                user_prompt = prompt_layout.assemble_user_prompt(
+                    prefix=prefix,
+                    suffix=[("solution", str(solution))],
+                    text=text
+                )
                 conversation_list = [{"role": "user", "content": user_prompt}]
                 task = tg.create_task(self.send_prompt_async(
                     developer_prompt=verification_prompt,
-                    conversation_list=conversation_list
+                    conversation_list=conversation_list,
+                    response_schema=schemas.VERIFICATION_SCHEMA
                 ))
                 tasks.append(task)
 
@@ -1131,7 +1345,7 @@ class MetaPrompterIndependent(MetaPrompter):
         wrong_solutions = {}
         correct_solutions = {}
         temp_dict = json.loads(verify_results)
-        print(verify_results)
+        logger.debug(f"Categorizing verification results: {verify_results}")
         for key, value in temp_dict.items():
             if value["bool"]:
                 correct_solutions[key] = value
@@ -1176,17 +1390,22 @@ class MetaPrompterIndependent(MetaPrompter):
             pii_name=pii_name
         )[pii_name]
 
-        user_prompt = f"""
-        <text>{text}</text>
-        <correct_solution>{json.dumps(correct_solutions)}</correct_solution>
-        <wrong_solution>{json.dumps(wrong_solutions)}</wrong_solution>
-        <pii_name>{pii_name}</pii_name>
-        <pii_description>{pii_dict["description"]}</pii_description>
-        """
+        user_prompt = prompt_layout.assemble_user_prompt(
+            prefix=[
+                ("pii_name", pii_name),
+                ("pii_description", pii_dict["description"])
+            ],
+            suffix=[
+                ("correct_solution", json.dumps(correct_solutions)),
+                ("wrong_solution", json.dumps(wrong_solutions))
+            ],
+            text=text
+        )
         conversation_list = [{"role": "user", "content": user_prompt}]
         reponse = self.send_prompt(
             developer_prompt=issue_prompt,
-            conversation_list=conversation_list
+            conversation_list=conversation_list,
+            response_schema=schemas.EXTRACTION_SCHEMA
         )
         logger.info(
             "Response: {reponse}\n-----------------",
@@ -1211,7 +1430,6 @@ class MetaPrompterIndependent(MetaPrompter):
 class MetaPrompterIndividuals(MetaPrompter):
     def __init__(
         self,
-        local: bool,
         doc_id: str,
         prompt_folder: str,
         yml_file: str,
@@ -1224,9 +1442,9 @@ class MetaPrompterIndividuals(MetaPrompter):
         base_url: str = "https://api.openai.com/v1",
         port: int = None,
         conn: Neo4jConnection = None,
+        structured_output: bool = False,
     ):
         super().__init__(
-            local=local,
             doc_id=doc_id,
             prompt_folder=prompt_folder,
             model_name=model_name,
@@ -1238,7 +1456,8 @@ class MetaPrompterIndividuals(MetaPrompter):
             yml_file=yml_file,
             prompt_config_yml=prompt_config_yml,
             prompt_creater=prompt_creater,
-            conn=conn
+            conn=conn,
+            structured_output=structured_output
         )
 
     def read_persons(self) -> str:
@@ -1254,23 +1473,7 @@ class MetaPrompterIndividuals(MetaPrompter):
         str
             The persons as a JSON string
         """
-
-        query = f"""
-        MATCH (designation:Entity_designation)
-        WHERE designation = {self.doc_id}
-        RETURN designation
-        """
-        result = self.conn.query(query)
-
-        person_dict = {}
-        for person in result:
-            person_dict[person["designation"].get("uuid")] = {
-                "full name": person["designation"].get("name"),
-                "abbrevations": person["designation"].get("abbrevation"),
-                "alias": person["designation"].get("nick_name_alias"),
-            }
-
-        return json.dumps(person_dict)
+        return self.conn.read_persons(self.doc_id)
 
     def add_uuid_to_solution(
         self,
@@ -1411,7 +1614,8 @@ class MetaPrompterIndividuals(MetaPrompter):
                 conversation_list = [{"role": "user", "content": user_prompt}]
                 task = tg.create_task(self.send_prompt_async(
                     developer_prompt=verification_prompt,
-                    conversation_list=conversation_list
+                    conversation_list=conversation_list,
+                    response_schema=schemas.VERIFICATION_SCHEMA
                 ))
                 tasks.append(task)
 
@@ -1439,7 +1643,9 @@ class MetaPrompterIndividuals(MetaPrompter):
         tuple[list[str], dict[str, dict[str, str]]]
             The corrected identifiers and the incorrect dictionary
         """
-        print(verification_results)
+        logger.debug(
+            f"Categorizing verification results: {verification_results}"
+        )
         solution_dict = self.prepare_solution_for_verification(solutions)
         solution_temp_dict = {
             inner["uuid_of_solution"]: {
@@ -1536,7 +1742,7 @@ class MetaPrompterIndividuals(MetaPrompter):
             solutions=old_response,
             verification_results=verification_results
         )
-        print(correct_solutions)
+        logger.debug(f"Correct solutions: {correct_solutions}")
         solutions_list = self.prepare_solution_for_verification(old_response)
         solutions_list.extend(further_solutions)
         correct_solutions_list = [
@@ -1607,10 +1813,14 @@ class MetaExpertConversation():
         guidelines_path_extracting: str,
         guidelines_path_issue: str,
         guidelines_path_verify: str,
-        refine_prompts: bool = False
+        refine_prompts: bool = False,
+        prepared_prompt_folder: str = None
     ):
         self.agent = agent
         self.text = text
+        # Version of prompt_preparation.prepare_prompts, only read
+        self.prepared_prompt_folder = prepared_prompt_folder
+        self.hints = None
         self.generated_prompt_folder = generated_prompt_folder
         self.generate_new_prompt = generate_new_prompt
         self.pii_name = pii_name
@@ -1622,6 +1832,11 @@ class MetaExpertConversation():
         self.proposed_solutions = []
         self.verify_solutions = []
         self.verification_attempt = 0
+        # Set when the verification gave up, nothing counts as verified
+        self.ended_on_limit = False
+        # Normalized identifiers masked by the identifier memory, they
+        # are not sent to the verifier
+        self.masked_identifiers = set()
 
         prompts = agent.prompts["meta_prompting"]["general"]
         self.meta_expert_prompt = agent.meta_expert_prompt
@@ -1656,7 +1871,7 @@ class MetaExpertConversation():
                 self.generate_new_prompt = True
                 # TODO: Das wieder richtig stellen
                 # self.refine_prompts = True
-            print(f"{pii_name}: {self.to_generate}")
+            logger.info(f"{pii_name}: {self.to_generate}")
 
     def select_prompt_from_config(
         self,
@@ -1703,6 +1918,63 @@ class MetaExpertConversation():
 
         return self.take_next_step()
 
+    def speculative_loop(
+        self
+    ) -> list[dict]:
+        """
+        Speculative variant of conversation_loop: the solutions of the
+        first extraction are verified right away instead of waiting for
+        the meta expert to choose the verification. If all verdicts pass,
+        the solutions are committed without any meta expert round,
+        otherwise the conversation falls back to the full loop from the
+        verification. Needs a stored verification prompt, without one the
+        full loop runs.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        list[dict]
+            The final solutions, see end_conversation
+        """
+        if not self.generated_prompts["verifying"] \
+                or self.to_generate["verifying"]:
+            return self.conversation_loop()
+
+        self.start_conversation()
+        self.take_next_step()
+        # Stands in for the instructions the meta expert would give for
+        # the verification, the stored verification prompt is used
+        self.add_to_conversation_list(role="assistant", content=json.dumps({
+            "job description": "Expert Verifier",
+            "instructions": (
+                f"Verify every extracted {self.pii_name} solution against "
+                f"the text."
+            )
+        }))
+        self.step_queue.append({"Next": "verification"})
+        self.verify_solution()
+
+        verdicts = json.loads(self.verify_solutions[-1])
+        if isinstance(verdicts, dict) and all(
+            isinstance(verdict, dict) and verdict.get("bool") is True
+            for verdict in verdicts.values()
+        ):
+            speculation_metrics.record_chunk(committed=True, skipped_rounds=2)
+            logger.info(f"{self.pii_name}: All verdicts passed, committing")
+            self.step_queue.append({"Next": "end"})
+            return self.end_conversation() or [{}]
+
+        speculation_metrics.record_chunk(committed=False, skipped_rounds=1)
+        self.generate_next_step()
+        while self.step_queue[-1]["Next"] != "end":
+            self.take_next_step()
+            self.generate_next_step()
+
+        return self.take_next_step()
+
     def add_to_conversation_list(
         self,
         role: str,
@@ -1725,11 +1997,10 @@ class MetaExpertConversation():
         self.conversation_list.append(
             {"role": role, "content": content}
         )
-        logger.info(
-            textwrap.dedent("""Added to conversation list:
-            {role}:\n\n{content}
-            --------------------------------
-            """),
+        log_payload(
+            CONVERSATION,
+            "Added to conversation list",
+            pii_name=self.pii_name,
             role=role,
             content=content
         )
@@ -1765,7 +2036,9 @@ class MetaExpertConversation():
     ) -> None:
         """
         Takes the generated prompts from the folder and loads them into
-        the generated_prompts dictionary
+        the generated_prompts dictionary. Prompts of the prepared version
+        are preferred, prompts missing there are taken from the folder of
+        the document
 
         Parameters
         ----------
@@ -1775,22 +2048,27 @@ class MetaExpertConversation():
         -------
         None
         """
-        file_path = os.path.join(
-            self.generated_prompt_folder,
-            self.prompt_generator.category,
-            self.pii_name
-        )
+        folders = [self.generated_prompt_folder]
+        if self.prepared_prompt_folder is not None:
+            folders.insert(0, self.prepared_prompt_folder)
         prompt_types = ["extracting", "issue", "verifying"]
 
         for prompt_type in prompt_types:
-            file_path_temp = os.path.join(
-                file_path,
-                f"{self.pii_name}_{prompt_type}.md"
-            )
-            try:
-                with open(file_path_temp, "r") as f:
-                    self.generated_prompts[prompt_type].append(f.read())
-            except FileNotFoundError:
+            for folder in folders:
+                file_path_temp = os.path.join(
+                    folder,
+                    self.prompt_generator.category,
+                    self.pii_name,
+                    f"{self.pii_name}_{prompt_type}.md"
+                )
+                try:
+                    self.generated_prompts[prompt_type].append(
+                        registry.read_text(file_path_temp)
+                    )
+                    break
+                except FileNotFoundError:
+                    continue
+            else:
                 self.to_generate[prompt_type] = True
 
     def start_conversation(
@@ -1856,14 +2134,17 @@ class MetaExpertConversation():
         None
         """
         next_step = self.step_queue[-1]["Next"]
-        print(f"Taking action for {self.pii_name}: {next_step}")
+        logger.info(f"Taking action for {self.pii_name}: {next_step}")
         match next_step:
             case "extracting":
                 self.run_prompt(type="extracting")
             case "verification":
                 if self.verification_attempt >= 2:
-                    print(f"Too many failed attempts for {self.pii_name}")
+                    logger.warning(
+                        f"Too many failed attempts for {self.pii_name}"
+                    )
                     self.verification_attempt = 0
+                    self.ended_on_limit = True
                     return self.end_conversation()
                 else:
                     self.verify_solution()
@@ -1874,6 +2155,34 @@ class MetaExpertConversation():
             case _:
                 raise ValueError("Invalid next step")
 
+    def extract_with_hints(
+        self,
+        generated_prompt: str
+    ) -> str:
+        """
+        Extracts the solution from the text with the generated prompt,
+        passing the gazetteer hints of the chunk if there are any
+
+        Parameters
+        ----------
+        generated_prompt : str
+            The generated extraction prompt
+
+        Returns
+        -------
+        str
+            The response from the LLM
+        """
+        kwargs = {}
+        if self.hints:
+            kwargs["hints"] = self.hints
+        return self.agent.extract_with_prompt(
+            text=self.text,
+            generated_prompts=generated_prompt,
+            pii_name=self.pii_name,
+            **kwargs
+        )
+
     def extract_solution(
         self
     ) -> None:
@@ -1885,10 +2194,8 @@ class MetaExpertConversation():
         -------
         None
         """
-        reponse_temp = self.agent.extract_with_prompt(
-            text=self.text,
-            generated_prompts=self.generated_prompts["extracting"][-1],
-            pii_name=self.pii_name
+        reponse_temp = self.extract_with_hints(
+            self.generated_prompts["extracting"][-1]
         )
         self.responses.append(reponse_temp)
 
@@ -1931,8 +2238,11 @@ class MetaExpertConversation():
 
         previous_step = self.step_queue[-1]["Next"]
 
-        logger.info(f"""Prior conversation until adding step to conv:
-            {self.conversation_list[-1]["content"]}"""
+        log_payload(
+            CONVERSATION,
+            "Prior conversation until adding step to conv",
+            pii_name=self.pii_name,
+            content=self.conversation_list[-1]["content"]
         )
         prompt = self.next_instruction_meta_prompt
         try:
@@ -1941,23 +2251,15 @@ class MetaExpertConversation():
                 .replace("{{previous_step}}", previous_step) \
                 .replace("{{response}}", response)
         except Exception as e:
-            print("---")
-            print("\n\n\n\n\n\n\n")
-            print(self.pii_name)
-            print(previous_step)
-            print(response)
-            print(e)
-            print("----")
+            logger.warning(
+                f"{self.pii_name}: Could not add the {previous_step} "
+                f"response to the next instruction prompt: {e}"
+            )
             prompt = prompt \
                 .replace("{{expert}}", "None") \
                 .replace("{{previous_step}}", previous_step) \
                 .replace("{{response}}", previous_step)
 
-            print("---")
-            print(prompt)
-            print("---")
-            print("\n\n\n\n\n\n\n")
-
         self.add_to_conversation_list(
             role="user", content=prompt
         )
@@ -1983,8 +2285,7 @@ class MetaExpertConversation():
                 .replace("{{previous_step}}", previous_step) \
                 .replace("{{response}}", response)
         except Exception as e:
-            print(f"Exception: {e}")
-            print(f"{self.pii_name} (Error match): {text}")
+            logger.warning(f"{self.pii_name} (Error match): {e}: {text}")
 
         return prompt
 
@@ -2005,7 +2306,8 @@ class MetaExpertConversation():
         user_prompt = self.construct_last_step()
         reponse_temp = self.agent.send_prompt(
             developer_prompt=self.meta_expert_next_step_prompt,
-            conversation_list=[{"role": "user", "content": user_prompt}]
+            conversation_list=[{"role": "user", "content": user_prompt}],
+            response_schema=schemas.NEXT_STEP_SCHEMA
         )
         next_step = json.loads(self.agent.extract_next_step(reponse_temp))
         self.step_queue.append(next_step)
@@ -2030,6 +2332,7 @@ class MetaExpertConversation():
         None
         """
         if self.step_queue[-1]["Next"] != "end":
+            start = time.perf_counter()
             self.create_next_step()
             response_temp = self.agent.send_prompt(
                 developer_prompt=self.meta_expert_prompt,
@@ -2051,6 +2354,9 @@ class MetaExpertConversation():
             self.add_to_conversation_list(
                 role="assistant", content=content_temp
             )
+            speculation_metrics.record_meta_round(
+                time.perf_counter() - start
+            )
 
     def run_prompt(
         self,
@@ -2070,12 +2376,15 @@ class MetaExpertConversation():
         None
         """
         if type == "extracting":
-            reponse_temp = self.agent.extract_with_prompt(
-                text=self.text,
-                generated_prompts=self.generated_prompts[type][-1],
-                pii_name=self.pii_name
+            reponse_temp = self.extract_with_hints(
+                self.generated_prompts[type][-1]
+            )
+            log_payload(
+                RESPONSE,
+                "Extraction response",
+                pii_name=self.pii_name,
+                response=reponse_temp
             )
-            logger.info(f"Extraction response\n\n'{reponse_temp}'")
             self.responses.append(reponse_temp)
             solution_dict = self.agent.add_uuid_to_solution(
                 json.loads(self.responses[-1])
@@ -2087,6 +2396,38 @@ class MetaExpertConversation():
             issue_handling=False
         )
 
+    def single_call(
+        self
+    ) -> list[dict] | None:
+        """
+        Extracts the PII with one call of the stored extraction prompt,
+        without verification and issue solving. Used for chunks without
+        candidate evidence, see candidate_filter.py
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        list[dict] | None
+            The solutions in the format of end_conversation or None if
+            no extraction prompt is stored yet
+        """
+        if not self.generated_prompts["extracting"]:
+            return None
+        response = self.extract_with_hints(
+            self.generated_prompts["extracting"][-1]
+        )
+        log_payload(
+            RESPONSE,
+            "Single call extraction response",
+            pii_name=self.pii_name,
+            response=response
+        )
+        solutions = self.agent.add_uuid_to_solution(json.loads(response))
+        return solutions or [{}]
+
     def create_verifying_prompt(
         self
     ) -> None:
@@ -2101,7 +2442,7 @@ class MetaExpertConversation():
         -------
         None
         """
-        print(f"{self.pii_name}: Create verifying prompt")
+        logger.info(f"{self.pii_name}: Create verifying prompt")
         instruction_json = json.loads(self.conversation_list[-1]["content"])
         final_prompt = self.prompt_generator.create_prompt_with_examples(
             instructions=instruction_json,
@@ -2138,7 +2479,7 @@ class MetaExpertConversation():
         None
 
         """
-        print(f"{self.pii_name}: Creating issue prompt.")
+        logger.info(f"{self.pii_name}: Creating issue prompt.")
         instruction_json = json.loads(self.conversation_list[-1]["content"])
         final_prompt = self.prompt_generator.create_prompt_with_examples(
             instructions=instruction_json,
@@ -2157,32 +2498,67 @@ class MetaExpertConversation():
         if not self.generate_new_prompt:
             self.to_generate["issue"] = False
 
+    def solutions_to_verify(self) -> str:
+        """
+        Returns the last proposed solutions without the ones whose
+        identifier is masked by the identifier memory
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        str
+            The solutions to send to the verifier as JSON string
+        """
+        solutions = json.loads(self.proposed_solutions[-1])
+        if not self.masked_identifiers or not isinstance(solutions, list):
+            return self.proposed_solutions[-1]
+        return json.dumps([
+            solution for solution in solutions
+            if not any(
+                isinstance(value, dict)
+                and normalize_identifier(str(value.get("identifier", "")))
+                in self.masked_identifiers
+                for value in solution.values()
+            )
+        ])
+
     def retry_verify(self, pii_dict):
         """
         123
         """
+        solutions = self.solutions_to_verify()
+        if not json.loads(solutions):
+            logger.info(f"{self.pii_name}: No solutions left to verify")
+            return json.dumps({})
         results = asyncio.run(self.agent.send_solutions_for_verification(
             text=self.text,
             verification_prompt=self.generated_prompts["verifying"][-1],
-            solutions=self.proposed_solutions[-1],
+            solutions=solutions,
             pii_name=self.pii_name,
             pii_description=pii_dict[self.pii_name]["description"]
         ))
-        logger.info(f"Verification response'{results}'")
-        print(f"Verification response: '{results}'")
+        log_payload(
+            VERIFICATION,
+            "Verification response",
+            pii_name=self.pii_name,
+            results=results
+        )
         try:
             temp_result = self.process_verification_results(
                 verification_results=results,
-                unverified_solutions=json.loads(self.proposed_solutions[-1])
+                unverified_solutions=json.loads(solutions)
             )
 
             for key, value in json.loads(temp_result).items():
                 try:
                     value["bool"]
                 except KeyError:
-                    print(f"Retrying Verify for: {self.pii_name}")
-                    print(parsed)
-                    print(value)
+                    logger.warning(
+                        f"Retrying Verify for: {self.pii_name}: {value}"
+                    )
                     return self.retry_verify(pii_dict=pii_dict)
         except AttributeError:
             return self.retry_verify(pii_dict=pii_dict)
@@ -2218,12 +2594,11 @@ class MetaExpertConversation():
         )
         result = self.retry_verify(pii_dict=pii_dict)
         if result == {}:
-            print("result is {--}")
+            logger.warning(f"{self.pii_name}: Empty verification result")
             result = self.retry_verify(pii_dict=pii_dict)
         self.verify_solutions.append(result)
 
-        print(f"{self.pii_name}")
-        print(f"Result added to conv: \n {result}")
+        logger.debug(f"{self.pii_name}: Result added to conv:\n{result}")
 
         self.add_next_step_meta_to_conversation(
             response=self.verify_solutions[-1],
@@ -2251,7 +2626,6 @@ class MetaExpertConversation():
                 prompt=self.generated_prompts["issue"][-1],
                 type="issue"
             )
-        print(self.pii_name)
         correct_solutions, wrong_solutions = self.agent.categorize_solutions(
             self.verify_solutions[-1]
         )
@@ -2299,6 +2673,43 @@ class MetaExpertConversation():
         else:
             return [{}]
 
+    def verified_identifiers(
+        self,
+        solutions: list[dict]
+    ) -> list[str]:
+        """
+        Returns the identifiers of the final solutions that passed a
+        verification of the conversation. Single calls and conversations
+        that gave up on the verification have none.
+
+        Parameters
+        ----------
+        solutions : list[dict]
+            The final solutions, see end_conversation
+
+        Returns
+        -------
+        list[str]
+            The verified identifiers
+        """
+        if self.ended_on_limit:
+            return []
+        passed = set()
+        for verification in self.verify_solutions:
+            verdicts = json.loads(verification)
+            if not isinstance(verdicts, dict):
+                continue
+            for verdict in verdicts.values():
+                if isinstance(verdict, dict) and verdict.get("bool") is True:
+                    passed.add(verdict.get("identifier"))
+        return [
+            value["identifier"]
+            for solution in solutions or []
+            for value in solution.values()
+            if isinstance(value, dict) and value.get("identifier")
+            and value["identifier"] in passed
+        ]
+
     def process_verification_results(
         self,
         verification_results: list[str],
@@ -2340,7 +2751,10 @@ class MetaExpertConversationIndependet(MetaExpertConversation):
         guidelines_path_extracting: str,
         guidelines_path_verify: str,
         guidelines_path_issue: str,
-        refine_prompts: bool = False
+        refine_prompts: bool = False,
+        hints: list[str] = None,
+        prepared_prompt_folder: str = None,
+        masked_identifiers: list[str] = None
     ):
         super().__init__(
             agent=agent,
@@ -2352,8 +2766,15 @@ class MetaExpertConversationIndependet(MetaExpertConversation):
             pii_name=pii_name,
             guidelines_path_extracting=guidelines_path_extracting,
             guidelines_path_issue=guidelines_path_issue,
-            refine_prompts=refine_prompts
-        )
+            refine_prompts=refine_prompts,
+            prepared_prompt_folder=prepared_prompt_folder
+        )
+        # Candidate spans of the gazetteer, passed to the extraction
+        self.hints = hints
+        self.masked_identifiers = {
+            normalize_identifier(identifier)
+            for identifier in masked_identifiers or []
+        }
 
     def process_verification_results(
         self,
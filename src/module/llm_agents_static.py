@@ -14,11 +14,31 @@ from loguru import logger
 from .llm import LLMAgent
 from .neo4j_conn import Neo4jConnection
 from . import utils
+from . import schemas
+from .registry import registry
+from .person_registry import PersonRegistry
+from .logging_config import log_payload, CONVERSATION, VERIFICATION
 
 
 class MetaExpertConversation():
     """
     Handles the conversation with the meta expert
+
+    Parameters
+    ----------
+    agent : LLMAgent
+        The LLM agent
+    text : str
+        The chunk of the document
+    prompt_folder : str
+        The folder where the prompts are stored
+    conn : Neo4jConnection
+        The connection to the Neo4j database
+    doc_id : str
+        The ID of the document.
+    person_registry : PersonRegistry
+        The persons found in the previous chunks, if None they are read
+        from the database
     """
     def __init__(
         self,
@@ -26,12 +46,14 @@ class MetaExpertConversation():
         text: str,
         prompt_folder: str,
         conn: Neo4jConnection,
-        doc_id: str
+        doc_id: str,
+        person_registry: PersonRegistry = None
     ):
         self.agent = agent
         self.text = text
         self.conn = conn
         self.doc_id = doc_id
+        self.person_registry = person_registry
         self.prompt_folder = prompt_folder
         self.proposed_solutions = []
         self.verify_solutions = []
@@ -70,8 +92,7 @@ class MetaExpertConversation():
         for file in os.listdir(file_path):
             file_type = file.split("_")[1].split(".")[0]
             file_name = os.path.join(file_path, file)
-            with open(file_name, "r") as f:
-                self.generated_prompts[file_type] = f.read()
+            self.generated_prompts[file_type] = registry.read_text(file_name)
 
     def load_meta_prompts(
         self
@@ -93,14 +114,17 @@ class MetaExpertConversation():
             "meta_prompting"
         )
 
-        with open(os.path.join(file_path, "meta_expert.md"), "r") as f:
-            self.meta_expert_prompt = f.read()
-        with open(os.path.join(file_path, "next_step_meta.md"), "r") as f:
-            self.next_step_meta_prompt = f.read()
+        self.meta_expert_prompt = registry.read_text(
+            os.path.join(file_path, "meta_expert.md")
+        )
+        self.next_step_meta_prompt = registry.read_text(
+            os.path.join(file_path, "next_step_meta.md")
+        )
 
     def read_persons(self) -> str:
         """
-        Reads the persons from the database and returns them as a JSON string
+        Reads the persons from the person registry or, without one, from
+        the database and returns them as a JSON string
 
         Parameters
         ----------
@@ -111,23 +135,10 @@ class MetaExpertConversation():
         str
             The persons as a JSON string
         """
+        if self.person_registry is not None:
+            return self.person_registry.to_prompt()
 
-        query = f"""
-        MATCH (designation:Entity_designation)
-        WHERE designation.doc_id = "{self.doc_id}"
-        RETURN designation
-        """
-        result = self.conn.query(query)
-
-        person_dict = {}
-        for person in result:
-            person_dict[person["designation"].get("uuid")] = {
-                "full name": person["designation"].get("name"),
-                "abbrevations": person["designation"].get("abbrevation"),
-                "alias": person["designation"].get("nick_name_alias"),
-            }
-
-        return json.dumps(person_dict)
+        return self.conn.read_persons(self.doc_id)
 
     def start_conversation(
         self
@@ -211,7 +222,8 @@ class MetaExpertConversation():
 
         response = self.agent.send_prompt(
             developer_prompt=self.generated_prompts["extracting"],
-            conversation_list=conversation_list
+            conversation_list=conversation_list,
+            response_schema=schemas.PERSONS_SCHEMA
         )
 
         logger.info(
@@ -254,7 +266,8 @@ class MetaExpertConversation():
                 conversation_list = [{"role": "user", "content": user_prompt}]
                 task = tg.create_task(self.agent.send_prompt_async(
                     developer_prompt=self.generated_prompts["verifying"],
-                    conversation_list=conversation_list
+                    conversation_list=conversation_list,
+                    response_schema=schemas.VERIFICATION_SCHEMA
                 ))
                 tasks.append(task)
 
@@ -303,7 +316,7 @@ class MetaExpertConversation():
         None
         """
         results = asyncio.run(self.send_solutions_for_verification())
-        logger.info(f"Verification response: \n\n'{results}'")
+        log_payload(VERIFICATION, "Verification response", results=results)
 
         verified_solutions = self.process_verification_results(results)
         logger.info(
@@ -360,7 +373,8 @@ class MetaExpertConversation():
 
         reponse = self.agent.send_prompt(
             developer_prompt=issue_prompt,
-            conversation_list=conversation_list
+            conversation_list=conversation_list,
+            response_schema=schemas.PERSONS_SCHEMA
         )
         logger.info(
             "Response:\n {reponse}\n-----------------",
@@ -421,11 +435,9 @@ class MetaExpertConversation():
         self.conversation_list.append(
             {"role": role, "content": content}
         )
-        logger.info(
-            textwrap.dedent("""Added to conversation list:
-            {role}:\n\n{content}
-            --------------------------------
-            """),
+        log_payload(
+            CONVERSATION,
+            "Added to conversation list",
             role=role,
             content=content
         )
@@ -490,7 +502,7 @@ class MetaExpertConversation():
         None
         """
         next_step = self.step_queue[-1]["Next"]
-        print(f"Taking action: {next_step}")
+        logger.info(f"Taking action: {next_step}")
         match next_step:
             case "extracting":
                 self.extract_individuals()
@@ -520,6 +532,13 @@ class MetaExpertConversation():
         str
             The next step
         """
+        try:
+            next_step = json.loads(response)
+            if isinstance(next_step, dict) and "Next" in next_step:
+                return json.dumps({"Next": next_step["Next"]})
+        except json.JSONDecodeError:
+            pass
+
         patterns = [
             r'(\{"Next":\s?"\w+"\})',
             r"(\{'Next':\s?'\w+'\})"
@@ -557,15 +576,14 @@ class MetaExpertConversation():
             conversation_list = self.conversation_list
         reponse_temp = self.agent.send_prompt(
             developer_prompt=self.meta_expert_prompt,
-            conversation_list=conversation_list
+            conversation_list=conversation_list,
+            response_schema=schemas.NEXT_STEP_SCHEMA
         )
-        logger.info(
-            "Conv list: {conversation_list}\n-----------------",
-            conversation_list=self.conversation_list
-        )
-        logger.info(
-            "Response: {reponse_temp}\n-----------------",
-            reponse_temp=reponse_temp
+        log_payload(
+            CONVERSATION,
+            "Next step decision",
+            conversation_list=self.conversation_list,
+            response=reponse_temp
         )
         try:
             next_step = json.loads(self.extract_next_step(reponse_temp))
@@ -636,19 +654,24 @@ class ResultCorrecter():
         The response from the LLM
     doc_id : str
         The ID of the document.
+    person_registry : PersonRegistry
+        The persons of the document, if None they are read from and
+        written to the database directly
     """
     def __init__(
         self,
         agent: LLMAgent,
         prompt_folder: str,
         conn: Neo4jConnection,
-        doc_id: str
+        doc_id: str,
+        person_registry: PersonRegistry = None
     ):
         self.agent = agent
         self.conn = conn
         self.prompt_folder = prompt_folder
         self.response = None
         self.doc_id = doc_id
+        self.person_registry = person_registry
         self.load_correction_prompt()
 
     def load_correction_prompt(self) -> None:
@@ -670,8 +693,7 @@ class ResultCorrecter():
             "condense.md"
         )
 
-        with open(file_path, "r") as f:
-            self.correction_prompt = f.read()
+        self.correction_prompt = registry.read_text(file_path)
 
     def send_prompt(self) -> dict[str, dict[str, str, str]]:
         """
@@ -695,9 +717,13 @@ class ResultCorrecter():
         -------
         None
         """
+        if self.person_registry is not None:
+            person_dict = self.person_registry.to_prompt()
+        else:
+            person_dict = self.conn.read_persons(self.doc_id)
         conversation_list = [{
             "role": "user",
-            "content": f"<person_dict>{self.conn.read_persons(self.doc_id)}</person_dict>"
+            "content": f"<person_dict>{person_dict}</person_dict>"
         }]
         response_temp = self.agent.send_prompt(
             developer_prompt=self.correction_prompt,
@@ -709,8 +735,11 @@ class ResultCorrecter():
 
     def load_result_in_database(self) -> None:
         """
-        Drops the Entity_designation category and recreates the nodes
-        with the corrected information
+        Replaces the Entity_designation nodes with the corrected
+        information, only the changed nodes are written (see
+        Neo4jConnection.upsert_nodes_individual). With a person registry the
+        corrected persons replace the registered ones and are flushed in
+        bulk; if the correction failed the registered persons are kept.
 
         Parameters
         ----------
@@ -721,11 +750,13 @@ class ResultCorrecter():
         None
 
         """
-        self.conn.drop_node_category(
-            category="Entity_designation",
-            doc_id=self.doc_id
-        )
-        self.conn.create_nodes_individual(
+        if self.person_registry is not None:
+            if self.response:
+                self.person_registry.replace(self.response)
+            self.person_registry.flush(self.conn)
+            return
+
+        self.conn.upsert_nodes_individual(
             result=self.response,
             doc_id=self.doc_id
         )
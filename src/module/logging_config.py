@@ -1,22 +1,240 @@
+import os
+import json
+import random
+import threading
 from loguru import logger
 
 
-def setup_logger(file_path: str) -> None:
+# Categories of the LLM traffic logged with log_payload
+PROMPT = "prompt"
+RESPONSE = "response"
+CONVERSATION = "conversation"
+VERIFICATION = "verification"
+
+
+class PayloadLogSettings:
+    """
+    Truncation and sampling of the payloads logged with log_payload. The
+    settings are read from the environment:
+
+    LOG_MAX_PAYLOAD
+        The maximum number of characters of a string in a payload,
+        0 disables the truncation (default 2000)
+    LOG_SAMPLE_RATES
+        Comma separated category=rate pairs, e.g.
+        "prompt=0.1,response=0.1,conversation=0". Categories without a
+        rate are always logged
+
+    Attributes
+    ----------
+    max_payload : int
+        The maximum number of characters of a string in a payload
+    sample_rates : dict[str, float]
+        The share of the records logged per category
+    """
+    def __init__(self, max_payload: int = 2000, sample_rates: dict = None):
+        self.max_payload = max_payload
+        self.sample_rates = dict(sample_rates or {})
+
+    @classmethod
+    def from_env(cls) -> "PayloadLogSettings":
+        """
+        Reads the settings from the environment
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        PayloadLogSettings
+            The settings
+        """
+        sample_rates = {}
+        for pair in os.getenv("LOG_SAMPLE_RATES", "").split(","):
+            if "=" not in pair:
+                continue
+            category, rate = pair.split("=", 1)
+            sample_rates[category.strip()] = float(rate)
+        return cls(
+            max_payload=int(os.getenv("LOG_MAX_PAYLOAD", "2000")),
+            sample_rates=sample_rates
+        )
+
+    def sampled(self, category: str) -> bool:
+        """
+        Decides if a record of the category is logged
+
+        Parameters
+        ----------
+        category : str
+            The category of the record
+
+        Returns
+        -------
+        bool
+            True if the record is logged
+        """
+        rate = self.sample_rates.get(category, 1.0)
+        return rate >= 1.0 or (rate > 0.0 and random.random() < rate)
+
+    def truncate(self, value):
+        """
+        Truncates the strings of a payload to max_payload characters
+
+        Parameters
+        ----------
+        value : Any
+            The payload, strings in nested lists and dicts are truncated
+
+        Returns
+        -------
+        Any
+            The truncated payload
+        """
+        if isinstance(value, str):
+            if self.max_payload and len(value) > self.max_payload:
+                return (
+                    f"{value[:self.max_payload]}"
+                    f"...[+{len(value) - self.max_payload} chars]"
+                )
+            return value
+        if isinstance(value, dict):
+            return {key: self.truncate(item) for key, item in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [self.truncate(item) for item in value]
+        return value
+
+
+payload_settings = PayloadLogSettings.from_env()
+
+
+def log_payload(category: str, message: str, **payload) -> None:
+    """
+    Logs LLM traffic (prompts, responses, conversation steps) at INFO.
+    Records are sampled per category before anything is formatted and
+    the strings of the payload are truncated, so large prompts don't
+    cost formatting time on the request path. The payload is bound to
+    the record and written by the sinks, see setup_logger.
+
+    Parameters
+    ----------
+    category : str
+        The category of the record (PROMPT, RESPONSE, ...)
+    message : str
+        The short message of the record
+    **payload
+        The payload of the record
+
+    Returns
+    -------
+    None
+    """
+    if not payload_settings.sampled(category):
+        return
+    logger.bind(
+        category=category,
+        payload=payload_settings.truncate(payload)
+    ).info(message)
+
+
+def _text_format(record: dict) -> str:
+    """
+    Formats a record for the text log, with the payload if there is one
+
+    Parameters
+    ----------
+    record : dict
+        The loguru record
+
+    Returns
+    -------
+    str
+        The format of the record
+    """
+    text = "{time: MMMM D, YYYY - HH:mm:ss} {level} <green>{message}</green>"
+    if "payload" in record["extra"]:
+        text += " | {extra[payload]}"
+    return text + "\n{exception}"
+
+
+class JsonlSink:
+    """
+    Loguru sink writing the records of log_payload as JSON lines. Added
+    with enqueue=True, the serialization and the writes run in the
+    logging thread.
+
+    Parameters
+    ----------
+    path : str
+        The path to the JSONL file
+    """
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._file = open(path, "a")
+
+    def __call__(self, message) -> None:
+        record = message.record
+        line = json.dumps({
+            "time": record["time"].isoformat(),
+            "level": record["level"].name,
+            "category": record["extra"].get("category"),
+            "thread": record["thread"].name,
+            "message": record["message"],
+            "payload": record["extra"].get("payload")
+        }, ensure_ascii=False, default=str)
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def stop(self) -> None:
+        with self._lock:
+            self._file.close()
+
+
+def setup_logger(
+    file_path: str,
+    jsonl_path: str = None,
+    level: str = "INFO",
+    **file_options
+) -> None:
     """
-    Sets up the logger with the given file path.
+    Sets up the logger with the given file path. The sinks are added
+    with enqueue=True, so the disk I/O runs in a logging thread instead
+    of the threads sending the requests. With a JSONL path, the records
+    of log_payload are additionally written as JSON lines. The payload
+    settings are read again from the environment.
 
     Parameters
     ----------
     file_path : str
         The path to the log file.
+    jsonl_path : str
+        The path to the JSONL file of the LLM traffic
+    level : str
+        The minimum level of the log file
+    **file_options
+        Further options of the log file (rotation, retention, ...)
 
     Returns
     -------
     None
     """
-    logger.remove(0)
+    global payload_settings
+    payload_settings = PayloadLogSettings.from_env()
+    logger.remove()
     logger.add(
         file_path,
-        format="{time: MMMM D, YYYY - HH:mm:ss} {level} <green>{message}</green>",
-        level="INFO"
+        format=_text_format,
+        level=level,
+        enqueue=True,
+        **file_options
     )
+    if jsonl_path is not None:
+        logger.add(
+            JsonlSink(jsonl_path),
+            level="INFO",
+            enqueue=True,
+            filter=lambda record: "category" in record["extra"]
+        )
@@ -0,0 +1,681 @@
+import os
+import re
+import json
+import threading
+from collections.abc import Iterator
+from loguru import logger
+
+from .neo4j_conn import (
+    Neo4jConnection,
+    RUN_LABEL_PREFIX,
+    as_list,
+    new_run_id,
+    write_nodes_json
+)
+
+
+class InMemoryGraph:
+    """
+    In-process graph store with the interface of Neo4jConnection, for
+    benchmarks, tests and single machine runs which don't need a Neo4j
+    database. The nodes are indexed by label, by doc_id and by their
+    merge keys (uuid, name), so the methods never scan the whole graph.
+    All methods are thread-safe.
+
+    Raw Cypher (query and stream) isn't supported. With a snapshot path
+    the graph is loaded from the file if it exists and written back by
+    save_snapshot and close.
+
+    Parameters
+    ----------
+    run_id : str
+        The ID of the run, a new one is created if None
+    snapshot_path : str
+        The path of the JSON snapshot of the graph, None disables it
+    """
+    def __init__(self, run_id: str = None, snapshot_path: str = None):
+        self.run_id = re.sub(r"\W", "_", run_id or new_run_id())
+        self.run_label = f"{RUN_LABEL_PREFIX}{self.run_id}"
+        self.snapshot_path = snapshot_path
+        self._lock = threading.RLock()
+        self._next_id = 0
+        self._nodes = {}
+        self._by_label = {}
+        self._by_doc_id = {}
+        self._by_key = {}
+        self._relationships = {}
+        self._relationships_by_node = {}
+        if snapshot_path is not None and os.path.exists(snapshot_path):
+            self.load_snapshot(snapshot_path)
+
+    # Node storage and indexes
+
+    def _index(self, node_id: int, key: str, value) -> None:
+        for label in self._nodes[node_id]["labels"]:
+            self._by_key.setdefault((label, key, value), set()).add(node_id)
+
+    def _unindex(self, node_id: int, key: str, value) -> None:
+        for label in self._nodes[node_id]["labels"]:
+            ids = self._by_key.get((label, key, value))
+            if ids is not None:
+                ids.discard(node_id)
+                if not ids:
+                    del self._by_key[(label, key, value)]
+
+    def _set(self, node_id: int, key: str, value) -> None:
+        properties = self._nodes[node_id]["properties"]
+        old = properties.get(key)
+        if key == "doc_id":
+            if old in self._by_doc_id:
+                self._by_doc_id[old].discard(node_id)
+            self._by_doc_id.setdefault(value, set()).add(node_id)
+        elif key in ("uuid", "name"):
+            if key in properties:
+                self._unindex(node_id, key, old)
+            self._index(node_id, key, value)
+        properties[key] = value
+
+    def _create(self, labels: list[str], properties: dict) -> int:
+        node_id = self._next_id
+        self._next_id += 1
+        self._nodes[node_id] = {"labels": list(labels), "properties": {}}
+        for label in labels:
+            self._by_label.setdefault(label, set()).add(node_id)
+        for key, value in properties.items():
+            self._set(node_id, key, value)
+        return node_id
+
+    def _match(self, label: str, key: str, value) -> set[int]:
+        return set(self._by_key.get((label, key, value), ()))
+
+    def _merge(self, label: str, key: str, value) -> tuple[list[int], bool]:
+        """
+        Returns the nodes matching the merge key, creating one if there
+        is none, and whether it was created
+        """
+        node_ids = self._match(label, key, value)
+        if node_ids:
+            return sorted(node_ids), False
+        return [self._create([label], {key: value})], True
+
+    def _delete(self, node_id: int) -> None:
+        properties = self._nodes[node_id]["properties"]
+        for key in ("uuid", "name"):
+            if key in properties:
+                self._unindex(node_id, key, properties[key])
+        for label in self._nodes.pop(node_id)["labels"]:
+            self._by_label[label].discard(node_id)
+        if properties.get("doc_id") in self._by_doc_id:
+            self._by_doc_id[properties["doc_id"]].discard(node_id)
+        for relationship in self._relationships_by_node.pop(node_id, set()):
+            self._relationships.pop(relationship, None)
+            for other in (relationship[0], relationship[2]):
+                if other != node_id and other in self._relationships_by_node:
+                    self._relationships_by_node[other].discard(relationship)
+
+    def _doc_nodes(self, doc_id: str, labels: list[str] = None) -> list[int]:
+        node_ids = self._by_doc_id.get(doc_id, set())
+        if labels is not None:
+            labelled = set()
+            for label in labels:
+                labelled |= self._by_label.get(label, set())
+            node_ids = node_ids & labelled
+        return sorted(node_ids)
+
+    # Interface of Neo4jConnection
+
+    catch_key_exception = Neo4jConnection.catch_key_exception
+
+    def close(self) -> None:
+        if self.snapshot_path is not None:
+            self.save_snapshot()
+
+    def query(self, query, parameters=None, db=None):
+        raise NotImplementedError(
+            "The in-memory graph doesn't run Cypher queries"
+        )
+
+    def stream(self, query, parameters=None, db=None) -> Iterator:
+        raise NotImplementedError(
+            "The in-memory graph doesn't run Cypher queries"
+        )
+
+    def labels(self, *labels: str) -> str:
+        """
+        Returns the label expression of Neo4jConnection.labels, for
+        callers building their own queries
+
+        Parameters
+        ----------
+        *labels : str
+            The labels of the nodes
+
+        Returns
+        -------
+        str
+            The label expression
+        """
+        return ":".join(list(labels) + [f"`{self.run_label}`"])
+
+    def read_persons(self, doc_id: str) -> str:
+        """
+        Reads the persons of a document and returns them as a JSON string
+
+        Parameters
+        ----------
+        doc_id : str
+            The ID of the document.
+
+        Returns
+        -------
+        str
+            The persons as a JSON string
+        """
+        with self._lock:
+            person_dict = {}
+            for node_id in self._doc_nodes(doc_id, ["Entity_designation"]):
+                person = self._nodes[node_id]["properties"]
+                person_dict[person.get("uuid")] = {
+                    "full name": person.get("full_name"),
+                    "abbreviations": person.get("abbreviations"),
+                    "aliases": person.get("aliases"),
+                }
+        return json.dumps(person_dict)
+
+    def create_nodes_pii_independent(
+        self,
+        pii: str,
+        result: list[dict[str, dict]],
+        doc_id: str
+    ) -> None:
+        """
+        Takes the results and creates nodes for each result, merged on
+        their uuid
+
+        Parameters
+        ----------
+        pii : str
+            The PII which the nodes will be created for
+        result : list[dict[str, dict]]
+            The result of the request to the LLM
+        doc_id : str
+            The ID of the document.
+
+        Returns
+        -------
+        None
+        """
+        pii = pii.title()
+        with self._lock:
+            for result_dict in result:
+                for key, value in result_dict.items():
+                    node_ids, _ = self._merge(pii, "uuid", key)
+                    for node_id in node_ids:
+                        self._set(
+                            node_id, "identifier", value["identifier"].lower()
+                        )
+                        self._set(node_id, "context", value["context"])
+                        self._set(node_id, "doc_id", doc_id)
+
+    def create_nodes_pii(
+        self,
+        pii: str,
+        result: dict[str, dict],
+        doc_id: str
+    ) -> None:
+        """
+        Takes the results and creates nodes for each result, merged on
+        their name
+
+        Parameters
+        ----------
+        pii : str
+            The PII which the nodes will be created for
+        result : dict
+            The result of the request to the LLM
+        doc_id : str
+            The ID of the document.
+
+        Returns
+        -------
+        None
+        """
+        pii = pii.title()
+        with self._lock:
+            for value in result.values():
+                node_ids, _ = self._merge(
+                    pii, "name", value["identifier"].lower()
+                )
+                for node_id in node_ids:
+                    self._set(node_id, "doc_id", doc_id)
+
+    def create_nodes_individual(
+        self,
+        result: dict[str, dict],
+        doc_id: str
+    ) -> None:
+        """
+        Takes the results and creates nodes for each individual, merged
+        on their uuid. The full name is only set on new nodes.
+
+        Parameters
+        ----------
+        result : dict
+            The result of the individual extraction from the LLM
+        doc_id : str
+            The ID of the document.
+
+        Returns
+        -------
+        None
+        """
+        with self._lock:
+            for person_id, value in result.items():
+                node_ids, created = self._merge(
+                    "Entity_designation", "uuid", person_id
+                )
+                for node_id in node_ids:
+                    if created:
+                        self._set(
+                            node_id, "full_name",
+                            self.catch_key_exception(value)
+                        )
+                    self._set(node_id, "abbreviations", value["abbreviations"])
+                    self._set(node_id, "aliases", value["aliases"])
+                    self._set(node_id, "doc_id", doc_id)
+
+    def create_relationships(
+        self,
+        property: str,
+        result: dict[str, dict]
+    ) -> None:
+        """
+        Takes the results and links the PII nodes to the persons, the
+        contexts of a link are collected on the relationship
+
+        Parameters
+        ----------
+        property : str
+            The property which the nodes represent
+        result : dict
+            The result of the request to the LLM
+
+        Returns
+        -------
+        None
+        """
+        property = property.title()
+        relationship_type = f"HAS_{property.upper()}"
+        with self._lock:
+            for value in result.values():
+                persons = self._match(
+                    "Entity_designation", "uuid", value["person_uuid"]
+                )
+                piis = self._match(property, "name", value["identifier"])
+                for pii_id in sorted(piis):
+                    for person_id in sorted(persons):
+                        key = (pii_id, relationship_type, person_id)
+                        relationship = self._relationships.setdefault(
+                            key, {"context": []}
+                        )
+                        relationship["context"].append(value["context"])
+                        for node_id in (pii_id, person_id):
+                            self._relationships_by_node.setdefault(
+                                node_id, set()
+                            ).add(key)
+
+    def drop_node_category(
+        self,
+        category: str,
+        doc_id: str,
+        batch_size: int = 10000
+    ) -> None:
+        """
+        Drops all nodes of a certain category with their relationships
+
+        Parameters
+        ----------
+        category : str
+            The category of the nodes to be dropped
+        doc_id : str
+            The ID of the document.
+        batch_size : int
+            Unused, for the interface of Neo4jConnection
+
+        Returns
+        -------
+        None
+        """
+        self.drop_node_categories([category], doc_id=doc_id)
+
+    def drop_node_categories(
+        self,
+        categories: list[str],
+        doc_id: str,
+        batch_size: int = 10000
+    ) -> None:
+        """
+        Drops all nodes of a document having one of the given categories
+        with their relationships
+
+        Parameters
+        ----------
+        categories : list[str]
+            The categories of the nodes to be dropped
+        doc_id : str
+            The ID of the document.
+        batch_size : int
+            Unused, for the interface of Neo4jConnection
+
+        Returns
+        -------
+        None
+        """
+        with self._lock:
+            for node_id in self._doc_nodes(doc_id, list(categories)):
+                self._delete(node_id)
+
+    def upsert_nodes_individual(
+        self,
+        result: dict[str, dict],
+        doc_id: str
+    ) -> dict[str, int]:
+        """
+        Replaces the Entity_designation nodes of a document with the
+        given individuals, touching only the nodes that changed (see
+        Neo4jConnection.upsert_nodes_individual)
+
+        Parameters
+        ----------
+        result : dict
+            The individuals keyed by ID, in the format of
+            create_nodes_individual
+        doc_id : str
+            The ID of the document.
+
+        Returns
+        -------
+        dict[str, int]
+            The number of deleted, written and unchanged nodes
+        """
+        counts = {"deleted": 0, "written": 0, "unchanged": 0}
+        with self._lock:
+            existing = {
+                self._nodes[node_id]["properties"].get("uuid"): node_id
+                for node_id in self._doc_nodes(doc_id, ["Entity_designation"])
+            }
+            for person_id, node_id in existing.items():
+                if person_id not in result:
+                    self._delete(node_id)
+                    counts["deleted"] += 1
+            for person_id, value in result.items():
+                properties = {
+                    "full_name": self.catch_key_exception(value),
+                    "abbreviations": as_list(value.get("abbreviations")),
+                    "aliases": as_list(value.get("aliases")),
+                    "doc_id": doc_id
+                }
+                node_ids, _ = self._merge(
+                    "Entity_designation", "uuid", person_id
+                )
+                for node_id in node_ids:
+                    current = self._nodes[node_id]["properties"]
+                    if all(
+                        current.get(key) == value
+                        for key, value in properties.items()
+                    ):
+                        counts["unchanged"] += 1
+                        continue
+                    for key, value in properties.items():
+                        self._set(node_id, key, value)
+                    counts["written"] += 1
+        logger.debug(f"Upserted individuals of {doc_id}: {counts}")
+        return counts
+
+    def iter_nodes(self, doc_id: str) -> Iterator[dict]:
+        """
+        Yields the nodes of a document with their labels under "labels"
+
+        Parameters
+        ----------
+        doc_id : str
+            The ID of the document.
+
+        Returns
+        -------
+        Iterator[dict]
+            The properties of the nodes
+        """
+        for node in self.read_nodes(doc_id, labels=None, with_labels=True):
+            yield node
+
+    def save_nodes_as_json(
+        self,
+        path: str,
+        doc_id: str
+    ) -> None:
+        """
+        Saves the nodes of a document as a JSON file
+
+        Parameters
+        ----------
+        path : str
+            The path to the JSON file
+        doc_id : str
+            The ID of the document.
+
+        Returns
+        -------
+        None
+        """
+        write_nodes_json(self.iter_nodes(doc_id), path)
+
+    def read_nodes(
+        self,
+        doc_id: str,
+        labels: list[str],
+        with_labels: bool = False
+    ) -> list[dict]:
+        """
+        Reads the nodes of a document having one of the given labels
+
+        Parameters
+        ----------
+        doc_id : str
+            The ID of the document.
+        labels : list[str]
+            The labels of the nodes to read, None reads all nodes
+        with_labels : bool
+            If True, the labels of a node are added under "labels"
+
+        Returns
+        -------
+        list[dict]
+            The properties of the nodes
+        """
+        nodes = []
+        with self._lock:
+            for node_id in self._doc_nodes(doc_id, labels):
+                node = dict(self._nodes[node_id]["properties"])
+                if with_labels:
+                    node["labels"] = list(self._nodes[node_id]["labels"])
+                nodes.append(node)
+        return nodes
+
+    def ensure_doc_id_indexes(self, labels: list[str]) -> None:
+        """
+        Does nothing, the nodes are always indexed by doc_id
+        """
+
+    def read_identifiers(self, doc_id: str, labels: list[str]) -> list[str]:
+        """
+        Reads the distinct identifiers of the nodes of a document having
+        one of the given labels
+
+        Parameters
+        ----------
+        doc_id : str
+            The ID of the document.
+        labels : list[str]
+            The labels of the nodes
+
+        Returns
+        -------
+        list[str]
+            The identifiers
+        """
+        identifiers = []
+        with self._lock:
+            for node_id in self._doc_nodes(doc_id, list(labels)):
+                identifier = self._nodes[node_id]["properties"].get(
+                    "identifier"
+                )
+                if identifier is not None and identifier not in identifiers:
+                    identifiers.append(identifier)
+        return identifiers
+
+    def delete_run(
+        self,
+        run_label: str = None,
+        batch_size: int = 10000
+    ) -> None:
+        """
+        Deletes all nodes, the graph only holds the nodes of its own run
+
+        Parameters
+        ----------
+        run_label : str
+            The label of the run, defaults to the run of the graph
+        batch_size : int
+            Unused, for the interface of Neo4jConnection
+
+        Returns
+        -------
+        None
+        """
+        if run_label not in (None, self.run_label):
+            return
+        with self._lock:
+            self._nodes.clear()
+            self._by_label.clear()
+            self._by_doc_id.clear()
+            self._by_key.clear()
+            self._relationships.clear()
+            self._relationships_by_node.clear()
+
+    def list_runs(self) -> list[str]:
+        """
+        Returns the label of the run if the graph holds any nodes
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        list[str]
+            The run labels
+        """
+        with self._lock:
+            return [self.run_label] if self._nodes else []
+
+    def cleanup_runs(
+        self,
+        max_age_hours: float = 24.0,
+        batch_size: int = 10000
+    ) -> list[str]:
+        """
+        Does nothing, the graph only holds the nodes of its own run
+        """
+        return []
+
+    def start_background_cleanup(
+        self,
+        max_age_hours: float = 24.0,
+        batch_size: int = 10000
+    ) -> None:
+        """
+        Does nothing, the graph only holds the nodes of its own run
+        """
+
+    # Snapshots
+
+    def save_snapshot(self, path: str = None) -> None:
+        """
+        Writes the nodes and relationships to a JSON file, atomically
+
+        Parameters
+        ----------
+        path : str
+            The path of the snapshot, defaults to snapshot_path
+
+        Returns
+        -------
+        None
+        """
+        path = path or self.snapshot_path
+        with self._lock:
+            content = {
+                "run_id": self.run_id,
+                "nodes": [
+                    {"id": node_id, **node}
+                    for node_id, node in self._nodes.items()
+                ],
+                "relationships": [
+                    {
+                        "start": start,
+                        "type": relationship_type,
+                        "end": end,
+                        "properties": properties
+                    }
+                    for (start, relationship_type, end), properties
+                    in self._relationships.items()
+                ]
+            }
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump(content, f, ensure_ascii=False, default=str)
+        os.replace(temp_path, path)
+        logger.info(
+            f"Saved graph snapshot with {len(content['nodes'])} nodes "
+            f"to {path}"
+        )
+
+    def load_snapshot(self, path: str) -> None:
+        """
+        Adds the nodes and relationships of a snapshot to the graph
+
+        Parameters
+        ----------
+        path : str
+            The path of the snapshot
+
+        Returns
+        -------
+        None
+        """
+        with open(path, "r") as f:
+            content = json.load(f)
+        with self._lock:
+            node_ids = {}
+            for node in content["nodes"]:
+                node_ids[node["id"]] = self._create(
+                    node["labels"], node["properties"]
+                )
+            for relationship in content["relationships"]:
+                key = (
+                    node_ids[relationship["start"]],
+                    relationship["type"],
+                    node_ids[relationship["end"]]
+                )
+                self._relationships[key] = relationship["properties"]
+                for node_id in (key[0], key[2]):
+                    self._relationships_by_node.setdefault(
+                        node_id, set()
+                    ).add(key)
+        logger.info(
+            f"Loaded graph snapshot with {len(content['nodes'])} nodes "
+            f"from {path}"
+        )
@@ -1,13 +1,116 @@
 from neo4j import GraphDatabase
+import re
 import json
+import time
+import uuid
+import threading
+from collections.abc import Iterable, Iterator
+from loguru import logger
+
+
+RUN_LABEL_PREFIX = "Run_"
+_RUN_TIME_FORMAT = "%Y%m%d%H%M%S"
+
+
+def new_run_id() -> str:
+    """
+    Returns a new run ID, starting with the start time of the run so
+    that the age of a run can be read from its label
+
+    Parameters
+    ----------
+    None
+
+    Returns
+    -------
+    str
+        The run ID
+    """
+    return f"{time.strftime(_RUN_TIME_FORMAT)}_{uuid.uuid4().hex[:6]}"
+
+
+def write_nodes_json(nodes: Iterable[dict], path: str) -> int:
+    """
+    Writes nodes as a compact JSON list, one node at a time, so the
+    nodes don't have to be collected before they are written
+
+    Parameters
+    ----------
+    nodes : Iterable[dict]
+        The properties of the nodes
+    path : str
+        The path to the JSON file
+
+    Returns
+    -------
+    int
+        The number of nodes written
+    """
+    count = 0
+    with open(path, "w") as f:
+        f.write("[")
+        for node in nodes:
+            if count:
+                f.write(",\n")
+            f.write(json.dumps(node, ensure_ascii=False, default=str))
+            count += 1
+        f.write("]\n")
+    return count
+
+
+def as_list(value) -> list[str]:
+    """
+    Returns the non-empty strings of a LLM value which may be None, a
+    string or a list of strings
+
+    Parameters
+    ----------
+    value : None | str | list[str]
+        The value
+
+    Returns
+    -------
+    list[str]
+        The strings
+    """
+    if value is None:
+        return []
+    if isinstance(value, str):
+        value = [value]
+    return [
+        element.strip() for element in value
+        if isinstance(element, str) and element.strip()
+    ]
 
 
 class Neo4jConnection:
-    def __init__(self, uri, user, pwd):
+    """
+    Connection to the Neo4j database. Every node created through the
+    connection carries the label of its run (Run_<run_id>) and all
+    queries of the connection are restricted to that label, so runs
+    sharing a database don't see or delete each other's nodes and old
+    runs can be dropped label by label (see delete_run and
+    start_background_cleanup).
+
+    Parameters
+    ----------
+    uri : str
+        The URI of the database
+    user : str
+        The user
+    pwd : str
+        The password
+    run_id : str
+        The ID of the run, a new one is created if None
+    """
+    def __init__(self, uri, user, pwd, run_id: str = None):
         self.__uri = uri
         self.__user = user
         self.__pwd = pwd
         self.__driver = None
+        self.run_id = re.sub(r"\W", "_", run_id or new_run_id())
+        self.run_label = f"{RUN_LABEL_PREFIX}{self.run_id}"
+        self._indexed_labels = set()
         try:
             self.__driver = GraphDatabase.driver(
                 self.__uri,
@@ -35,6 +138,59 @@ class Neo4jConnection:
                 session.close()
         return response
 
+    def stream(self, query, parameters=None, db=None) -> Iterator:
+        """
+        Runs a query and yields its records as they arrive, instead of
+        materializing them like query
+
+        Parameters
+        ----------
+        query : str
+            The query
+        parameters : dict
+            The parameters of the query
+        db : str
+            The database, defaults to the default database
+
+        Returns
+        -------
+        Iterator
+            The records of the query
+
+        Raises
+        ------
+        Exception
+            The error of the driver, a partially read result can't be
+            told apart from a complete one otherwise
+        """
+        assert self.__driver is not None, "Driver not initialized!"
+        session = self.__driver.session(database=db) if db is not None \
+            else self.__driver.session()
+        try:
+            yield from session.run(query, parameters)
+        except Exception as e:
+            logger.error(f"Query failed: {e}")
+            raise
+        finally:
+            session.close()
+
+    def labels(self, *labels: str) -> str:
+        """
+        Returns the label expression of a node pattern restricted to the
+        run, e.g. "Entity_designation:`Run_<run_id>`"
+
+        Parameters
+        ----------
+        *labels : str
+            The labels of the nodes
+
+        Returns
+        -------
+        str
+            The label expression
+        """
+        return ":".join(list(labels) + [f"`{self.run_label}`"])
+
     def read_persons(self, doc_id: str) -> str:
         """
         Reads the persons from the database and returns them as a JSON string
@@ -51,7 +207,7 @@ class Neo4jConnection:
         """
 
         query = f"""
-        MATCH (designation:Entity_designation)
+        MATCH (designation:{self.labels("Entity_designation")})
         WHERE designation.doc_id = "{doc_id}"
         RETURN designation
         """
@@ -104,7 +260,7 @@ class Neo4jConnection:
             }
             query = f"""
                 UNWIND $piis AS pii
-                MERGE (p:{pii} {{uuid: pii.uuid}})
+                MERGE (p:{self.labels(pii)} {{uuid: pii.uuid}})
                 ON CREATE SET p.uuid = pii.uuid
                 SET p.identifier = pii.identifier
                 SET p.context = pii.context
@@ -155,7 +311,7 @@ class Neo4jConnection:
 
         query = f"""
         UNWIND $piis AS pii
-        MERGE (p:{pii} {{name: pii.name}})
+        MERGE (p:{self.labels(pii)} {{name: pii.name}})
         SET p.doc_id = $doc_id
         """
         self.query(
@@ -226,9 +382,9 @@ class Neo4jConnection:
                 for uuid, value in result.items()
             ]
         }
-        query = """
+        query = f"""
             UNWIND $individuals AS individual
-            MERGE (i:Entity_designation {uuid: individual.uuid_person})
+            MERGE (i:{self.labels("Entity_designation")} {{uuid: individual.uuid_person}})
             ON CREATE SET i.full_name = individual.full_name
             SET i.abbreviations = individual.abbreviations
             SET i.aliases = individual.aliases
@@ -274,8 +430,8 @@ class Neo4jConnection:
         property = property.title()
         query = f"""
             UNWIND $Links as link
-            MATCH (e:Entity_designation {{uuid: link.person_uuid}})
-            MATCH (p:{property} {{name: link.node_name}})
+            MATCH (e:{self.labels("Entity_designation")} {{uuid: link.person_uuid}})
+            MATCH (p:{self.labels(property)} {{name: link.node_name}})
             MERGE (p)-[r:HAS_{property.upper()}]->(e)
             ON CREATE SET r.context = [link.context]
             ON MATCH SET r.context = COALESCE(r.context, []) + link.context
@@ -289,10 +445,11 @@ class Neo4jConnection:
     def drop_node_category(
         self,
         category: str,
-        doc_id: str
+        doc_id: str,
+        batch_size: int = 10000
     ) -> None:
         """
-        Drops all nodes of a certain category
+        Drops all nodes of a certain category, see drop_node_categories
 
         Parameters
         ----------
@@ -300,18 +457,171 @@ class Neo4jConnection:
             The category of the nodes to be dropped
         doc_id : str
             The ID of the document.
+        batch_size : int
+            The number of nodes deleted per transaction
 
         Returns
         -------
         None
         """
+        self.drop_node_categories(
+            categories=[category],
+            doc_id=doc_id,
+            batch_size=batch_size
+        )
+
+    def drop_node_categories(
+        self,
+        categories: list[str],
+        doc_id: str,
+        batch_size: int = 10000
+    ) -> None:
+        """
+        Drops all nodes of a document having one of the given categories
+        in one query. The nodes are deleted in bounded transactions and
+        aren't returned to the client.
+
+        Parameters
+        ----------
+        categories : list[str]
+            The categories of the nodes to be dropped
+        doc_id : str
+            The ID of the document.
+        batch_size : int
+            The number of nodes deleted per transaction
+
+        Returns
+        -------
+        None
+        """
+        if not categories:
+            return
         query = f"""
-        MATCH (n:{category})
-        WHERE n.doc_id = "{doc_id}"
-        DETACH DELETE n
-        RETURN n
+        MATCH (n:{self.labels()})
+        WHERE n.doc_id = $doc_id
+        AND any(label IN labels(n) WHERE label IN $categories)
+        CALL {{ WITH n DETACH DELETE n }} IN TRANSACTIONS OF $batch_size ROWS
+        """
+        self.query(
+            query,
+            parameters={
+                "doc_id": doc_id,
+                "categories": list(categories),
+                "batch_size": batch_size
+            }
+        )
+
+    def upsert_nodes_individual(
+        self,
+        result: dict[str, dict],
+        doc_id: str
+    ) -> dict[str, int]:
         """
-        self.query(query)
+        Replaces the Entity_designation nodes of a document with the
+        given individuals, touching only the nodes that changed: nodes
+        missing from the result are deleted, new and changed ones are
+        merged, unchanged ones (and their relationships) are kept. The
+        nodes end up as after drop_node_category followed by
+        create_nodes_individual.
+
+        Parameters
+        ----------
+        result : dict
+            The individuals keyed by ID, in the format of
+            create_nodes_individual
+        doc_id : str
+            The ID of the document.
+
+        Returns
+        -------
+        dict[str, int]
+            The number of deleted, written and unchanged nodes
+        """
+        existing = {
+            node.get("uuid"): node
+            for node in self.read_nodes(
+                doc_id=doc_id,
+                labels=["Entity_designation"]
+            )
+        }
+        individuals = []
+        for person_id, value in result.items():
+            individual = {
+                "uuid_person": person_id,
+                "full_name": self.catch_key_exception(value),
+                "abbreviations": as_list(value.get("abbreviations")),
+                "aliases": as_list(value.get("aliases"))
+            }
+            node = existing.get(person_id)
+            if node is None \
+                    or node.get("full_name") != individual["full_name"] \
+                    or list(node.get("abbreviations") or []) \
+                    != individual["abbreviations"] \
+                    or list(node.get("aliases") or []) \
+                    != individual["aliases"]:
+                individuals.append(individual)
+        removed = [
+            person_id for person_id in existing if person_id not in result
+        ]
+
+        if removed:
+            query = f"""
+            UNWIND $uuids AS uuid
+            MATCH (i:{self.labels("Entity_designation")} {{uuid: uuid}})
+            WHERE i.doc_id = $doc_id
+            DETACH DELETE i
+            """
+            self.query(
+                query,
+                parameters={"uuids": removed, "doc_id": doc_id}
+            )
+        if individuals:
+            query = f"""
+            UNWIND $individuals AS individual
+            MERGE (i:{self.labels("Entity_designation")} {{uuid: individual.uuid_person}})
+            SET i.full_name = individual.full_name
+            SET i.abbreviations = individual.abbreviations
+            SET i.aliases = individual.aliases
+            SET i.doc_id = $doc_id
+            """
+            self.query(
+                query,
+                parameters={"individuals": individuals, "doc_id": doc_id}
+            )
+        counts = {
+            "deleted": len(removed),
+            "written": len(individuals),
+            "unchanged": len(result) - len(individuals)
+        }
+        logger.debug(f"Upserted individuals of {doc_id}: {counts}")
+        return counts
+
+    def iter_nodes(self, doc_id: str) -> Iterator[dict]:
+        """
+        Yields the nodes of a document as they are read, with their
+        labels (without the run label) under "labels"
+
+        Parameters
+        ----------
+        doc_id : str
+            The ID of the document.
+
+        Returns
+        -------
+        Iterator[dict]
+            The properties of the nodes
+        """
+        query = f"""
+        MATCH (n:{self.labels()})
+        WHERE n.doc_id = $doc_id
+        RETURN n, labels(n) AS labels
+        """
+        for data in self.stream(query, parameters={"doc_id": doc_id}):
+            node = dict(data["n"])
+            node["labels"] = [
+                label for label in data["labels"] if label != self.run_label
+            ]
+            yield node
 
     def save_nodes_as_json(
         self,
@@ -319,7 +629,8 @@ class Neo4jConnection:
         doc_id: str
     ) -> None:
         """
-        Saves the nodes as a JSON file
+        Saves the nodes as a JSON file, streamed from the database into
+        the file (see write_nodes_json)
 
         Parameters
         ----------
@@ -328,18 +639,293 @@ class Neo4jConnection:
         doc_id : str
             The ID of the document.
 
+        Returns
+        -------
+        None
+        """
+        write_nodes_json(self.iter_nodes(doc_id), path)
+
+    def read_nodes(
+        self,
+        doc_id: str,
+        labels: list[str],
+        with_labels: bool = False
+    ) -> list[dict]:
+        """
+        Reads the nodes of a document having one of the given labels
+
+        Parameters
+        ----------
+        doc_id : str
+            The ID of the document.
+        labels : list[str]
+            The labels of the nodes to read
+        with_labels : bool
+            If True, the labels of a node (without the run label) are
+            added under "labels"
+
+        Returns
+        -------
+        list[dict]
+            The properties of the nodes
+        """
+        query = f"""
+        MATCH (n:{self.labels()})
+        WHERE n.doc_id = $doc_id
+        AND any(label IN labels(n) WHERE label IN $labels)
+        RETURN n, labels(n) AS labels
+        """
+        result = self.query(
+            query,
+            parameters={"doc_id": doc_id, "labels": list(labels)}
+        )
+        nodes = []
+        for data in result or []:
+            node = dict(data["n"])
+            if with_labels:
+                node["labels"] = [
+                    label for label in data["labels"]
+                    if label != self.run_label
+                ]
+            nodes.append(node)
+        return nodes
+
+    def ensure_doc_id_indexes(self, labels: list[str]) -> None:
+        """
+        Creates the doc_id index of each label if it doesn't exist yet,
+        once per label and connection
+
+        Parameters
+        ----------
+        labels : list[str]
+            The labels of the nodes
+
+        Returns
+        -------
+        None
+        """
+        for label in labels:
+            if label in self._indexed_labels:
+                continue
+            self.query(
+                f"CREATE INDEX {label.lower()}_doc_id IF NOT EXISTS "
+                f"FOR (n:{label}) ON (n.doc_id)"
+            )
+            self._indexed_labels.add(label)
+
+    def read_identifiers(self, doc_id: str, labels: list[str]) -> list[str]:
+        """
+        Reads the distinct identifiers of the nodes of a document having
+        one of the given labels. Only the identifier strings are
+        returned and streamed; every label is matched in its own branch,
+        so the doc_id index of the label is used (see
+        ensure_doc_id_indexes).
+
+        Parameters
+        ----------
+        doc_id : str
+            The ID of the document.
+        labels : list[str]
+            The labels of the nodes
+
+        Returns
+        -------
+        list[str]
+            The identifiers
+        """
+        if not labels:
+            return []
+        self.ensure_doc_id_indexes(labels)
+        query = "\nUNION\n".join(
+            f"""
+            MATCH (n:{self.labels(label)})
+            WHERE n.doc_id = $doc_id AND n.identifier IS NOT NULL
+            RETURN n.identifier AS identifier
+            """
+            for label in labels
+        )
+        return [
+            data["identifier"]
+            for data in self.stream(query, parameters={"doc_id": doc_id})
+        ]
+
+    def bulk_create_nodes(
+        self,
+        label: str,
+        nodes: list[dict],
+        batch_size: int = 10000
+    ) -> int:
+        """
+        Writes nodes of one label with one UNWIND query per batch, each
+        batch in its own transaction. The nodes are merged on their
+        import_id, which is unique within the run: the constraint is
+        created before the first batch, so the MERGE is an index lookup
+        and reloading the same results doesn't duplicate nodes.
+
+        Parameters
+        ----------
+        label : str
+            The label of the nodes
+        nodes : list[dict]
+            The nodes, each with an "import_id" and its "properties"
+        batch_size : int
+            The number of nodes written per transaction
+
+        Returns
+        -------
+        int
+            The number of nodes written
+
+        Raises
+        ------
+        RuntimeError
+            If a batch couldn't be written
+        """
+        constraint = f"{self.run_label.lower()}_import_id"
+        self.query(
+            f"CREATE CONSTRAINT {constraint} IF NOT EXISTS "
+            f"FOR (n:`{self.run_label}`) REQUIRE n.import_id IS UNIQUE"
+        )
+        query = f"""
+        UNWIND $nodes AS node
+        MERGE (n:`{self.run_label}` {{import_id: node.import_id}})
+        SET n:{label}
+        SET n += node.properties
+        """
+        for start in range(0, len(nodes), batch_size):
+            result = self.query(
+                query,
+                parameters={"nodes": nodes[start:start + batch_size]}
+            )
+            if result is None:
+                raise RuntimeError(
+                    f"Writing the {label} nodes {start} to "
+                    f"{start + batch_size} failed, {start} were written"
+                )
+        return len(nodes)
+
+    def delete_run(
+        self,
+        run_label: str = None,
+        batch_size: int = 10000
+    ) -> None:
+        """
+        Deletes all nodes of a run in bounded transactions, without
+        returning them
+
+        Parameters
+        ----------
+        run_label : str
+            The label of the run, defaults to the run of the connection
+        batch_size : int
+            The number of nodes deleted per transaction
+
         Returns
         -------
         None
         """
         query = f"""
+        MATCH (n:`{run_label or self.run_label}`)
+        CALL {{ WITH n DETACH DELETE n }} IN TRANSACTIONS OF $batch_size ROWS
+        """
+        self.query(query, parameters={"batch_size": batch_size})
+
+    def list_runs(self) -> list[str]:
+        """
+        Returns the labels of the runs in the database
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        list[str]
+            The run labels
+        """
+        query = """
+        CALL db.labels() YIELD label
+        WHERE label STARTS WITH $prefix
+        RETURN label
+        """
+        result = self.query(query, parameters={"prefix": RUN_LABEL_PREFIX})
+        return [data["label"] for data in result or []]
+
+    def cleanup_runs(
+        self,
+        max_age_hours: float = 24.0,
+        batch_size: int = 10000
+    ) -> list[str]:
+        """
+        Deletes the runs started more than max_age_hours ago and the nodes
+        without a run label (written before runs were isolated). The
+        current run, runs with a custom ID and younger runs, which may
+        still be processing, are kept.
+
+        Parameters
+        ----------
+        max_age_hours : float
+            The age in hours after which a run is deleted
+        batch_size : int
+            The number of nodes deleted per transaction
+
+        Returns
+        -------
+        list[str]
+            The labels of the deleted runs
+        """
+        deleted = []
+        now = time.time()
+        for run_label in self.list_runs():
+            if run_label == self.run_label:
+                continue
+            started = run_label[len(RUN_LABEL_PREFIX):].split("_")[0]
+            try:
+                started = time.mktime(time.strptime(started, _RUN_TIME_FORMAT))
+            except ValueError:
+                continue
+            if now - started < max_age_hours * 3600:
+                continue
+            self.delete_run(run_label=run_label, batch_size=batch_size)
+            deleted.append(run_label)
+        query = """
         MATCH (n)
-        WHERE n.doc_id = "{doc_id}"
-        RETURN n
+        WHERE none(label IN labels(n) WHERE label STARTS WITH $prefix)
+        CALL { WITH n DETACH DELETE n } IN TRANSACTIONS OF $batch_size ROWS
         """
-        result = self.query(query)
-        gathered_dict = []
-        for data in result:
-            gathered_dict.append(next(iter(data.data().values())))
-        with open(path, 'w') as f:
-            json.dump(gathered_dict, f, indent=2)
+        self.query(
+            query,
+            parameters={"prefix": RUN_LABEL_PREFIX, "batch_size": batch_size}
+        )
+        logger.info(f"Deleted old runs: {deleted}")
+        return deleted
+
+    def start_background_cleanup(
+        self,
+        max_age_hours: float = 24.0,
+        batch_size: int = 10000
+    ) -> threading.Thread:
+        """
+        Runs cleanup_runs in a daemon thread, so the startup doesn't wait
+        for the deletion
+
+        Parameters
+        ----------
+        max_age_hours : float
+            The age in hours after which a run is deleted
+        batch_size : int
+            The number of nodes deleted per transaction
+
+        Returns
+        -------
+        threading.Thread
+            The cleanup thread
+        """
+        thread = threading.Thread(
+            target=self.cleanup_runs,
+            kwargs={"max_age_hours": max_age_hours, "batch_size": batch_size},
+            name="neo4j-cleanup",
+            daemon=True
+        )
+        thread.start()
+        return thread
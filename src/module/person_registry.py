@@ -0,0 +1,284 @@
+import json
+import threading
+
+from .neo4j_conn import Neo4jConnection, as_list
+
+
+# Aliases shared by many persons of a judgment, they don't identify a
+# person and are not used to match persons
+_GENERIC_ALIASES = {"applicant", "the applicant", "applicants", "the applicants"}
+
+
+def _normalize(name: str) -> str:
+    """
+    Normalizes a name for the lookup indexes
+
+    Parameters
+    ----------
+    name : str
+        The name
+
+    Returns
+    -------
+    str
+        The lower-cased name with collapsed whitespace
+    """
+    return " ".join(name.split()).lower()
+
+
+class PersonRegistry:
+    """
+    In-memory registry of the persons (Entity_designation) of one
+    document. It is updated after every chunk of the static extraction,
+    serialized compactly for the prompts and written to Neo4j in bulk at
+    the end, so the chunks neither read the persons from the database
+    nor resend the verbose person dict.
+
+    Persons are matched by their full name and abbreviations and by
+    their non-generic aliases; the lookup goes through an index of the
+    normalized names, so merging a chunk is linear in its persons.
+
+    Parameters
+    ----------
+    doc_id : str
+        The ID of the document.
+    """
+    def __init__(self, doc_id: str):
+        self.doc_id = doc_id
+        self._lock = threading.Lock()
+        self._persons = {}
+        self._full_name_index = {}
+        self._abbreviation_index = {}
+        self._alias_index = {}
+
+    def __len__(self) -> int:
+        return len(self._persons)
+
+    def _index(self, person_id: str) -> None:
+        person = self._persons[person_id]
+        if person["full_name"]:
+            self._full_name_index.setdefault(
+                _normalize(person["full_name"]), person_id
+            )
+        for abbreviation in person["abbreviations"]:
+            self._abbreviation_index.setdefault(
+                _normalize(abbreviation), person_id
+            )
+        for alias in person["aliases"]:
+            if _normalize(alias) not in _GENERIC_ALIASES:
+                self._alias_index.setdefault(_normalize(alias), person_id)
+
+    def _find(self, names: list[str]) -> str | None:
+        """
+        Returns the ID of the first registered person known under one of
+        the names
+
+        Parameters
+        ----------
+        names : list[str]
+            The names of a person
+
+        Returns
+        -------
+        str | None
+            The ID of the person or None if the person is new
+        """
+        for index in (
+            self._full_name_index,
+            self._abbreviation_index,
+            self._alias_index
+        ):
+            for name in names:
+                person_id = index.get(_normalize(name))
+                if person_id is not None:
+                    return person_id
+        return None
+
+    def _free_id(self, person_id: str) -> str:
+        """
+        Returns the ID or, if a registered person already has it, the ID
+        with the first free numeric suffix
+
+        Parameters
+        ----------
+        person_id : str
+            The ID of a new person
+
+        Returns
+        -------
+        str
+            An ID no registered person has
+        """
+        candidate = person_id
+        suffix = 1
+        while candidate in self._persons:
+            suffix += 1
+            candidate = f"{person_id}_{suffix}"
+        return candidate
+
+    def find(self, name: str) -> str | None:
+        """
+        Returns the ID of the person known under the name
+
+        Parameters
+        ----------
+        name : str
+            A full name, abbreviation or alias
+
+        Returns
+        -------
+        str | None
+            The ID of the person or None if the name is unknown
+        """
+        with self._lock:
+            return self._find([name])
+
+    def merge(self, persons: dict[str, dict]) -> None:
+        """
+        Merges the persons found in a chunk. A person already registered
+        under one of its names gets the new names added, otherwise it is
+        registered under its ID, or a suffixed one if the ID is taken.
+
+        Parameters
+        ----------
+        persons : dict[str, dict]
+            The persons as returned by the conversation, keyed by ID with
+            the keys "full name" (or "full_name"), "abbreviations" and
+            "aliases"
+
+        Returns
+        -------
+        None
+        """
+        with self._lock:
+            for person_id, person in (persons or {}).items():
+                full_names = as_list(
+                    person.get("full name", person.get("full_name"))
+                )
+                abbreviations = as_list(person.get("abbreviations"))
+                aliases = as_list(person.get("aliases"))
+                if not (full_names or abbreviations or aliases):
+                    continue
+                # Like Neo4jConnection.catch_key_exception the last full
+                # name wins, the others are kept as aliases
+                full_name = full_names[-1] if full_names else None
+                aliases = full_names[:-1] + aliases
+
+                names = full_names + abbreviations + [
+                    alias for alias in aliases
+                    if _normalize(alias) not in _GENERIC_ALIASES
+                ]
+                existing_id = self._find(names)
+                if existing_id is None:
+                    # The chunks number their persons independently, a
+                    # new person may reuse the ID of another one
+                    person_id = self._free_id(person_id)
+                    self._persons[person_id] = {
+                        "full_name": full_name,
+                        "abbreviations": [],
+                        "aliases": []
+                    }
+                    existing_id = person_id
+                existing = self._persons[existing_id]
+                if existing["full_name"] is None:
+                    existing["full_name"] = full_name
+                elif full_name and _normalize(full_name) != _normalize(
+                    existing["full_name"]
+                ):
+                    aliases.append(full_name)
+                for key, values in (
+                    ("abbreviations", abbreviations),
+                    ("aliases", aliases)
+                ):
+                    known = {_normalize(value) for value in existing[key]}
+                    for value in values:
+                        if _normalize(value) not in known:
+                            known.add(_normalize(value))
+                            existing[key].append(value)
+                self._index(existing_id)
+
+    def replace(self, persons: dict[str, dict]) -> None:
+        """
+        Replaces all persons, e.g. with the condensed result of the
+        ResultCorrecter
+
+        Parameters
+        ----------
+        persons : dict[str, dict]
+            The persons, see merge
+
+        Returns
+        -------
+        None
+        """
+        with self._lock:
+            self._persons = {}
+            self._full_name_index = {}
+            self._abbreviation_index = {}
+            self._alias_index = {}
+        self.merge(persons)
+
+    def as_result(self) -> dict[str, dict]:
+        """
+        Returns the persons in the result format of the conversation,
+        as expected by Neo4jConnection.create_nodes_individual
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        dict[str, dict]
+            The persons keyed by ID
+        """
+        with self._lock:
+            return {
+                person_id: {
+                    "full name": person["full_name"],
+                    "abbreviations": list(person["abbreviations"]),
+                    "aliases": list(person["aliases"])
+                }
+                for person_id, person in self._persons.items()
+            }
+
+    def to_prompt(self) -> str:
+        """
+        Serializes the persons compactly for a prompt: no whitespace
+        between the JSON tokens and empty fields left out
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        str
+            The persons as a JSON string
+        """
+        compact = {}
+        for person_id, person in self.as_result().items():
+            compact[person_id] = {
+                key: value for key, value in person.items() if value
+            }
+        return json.dumps(compact, separators=(",", ":"), ensure_ascii=False)
+
+    def flush(self, conn: Neo4jConnection) -> None:
+        """
+        Replaces the Entity_designation nodes of the document in the
+        database with the registered persons, writing only the persons
+        that changed
+
+        Parameters
+        ----------
+        conn : Neo4jConnection
+            The connection to the Neo4j database
+
+        Returns
+        -------
+        None
+        """
+        conn.upsert_nodes_individual(
+            result=self.as_result(),
+            doc_id=self.doc_id
+        )
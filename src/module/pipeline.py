@@ -0,0 +1,124 @@
+import time
+import asyncio
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable
+from loguru import logger
+
+
+@dataclass
+class Stage:
+    """
+    A stage of a document pipeline.
+
+    Attributes
+    ----------
+    name : str
+        The unique name of the stage
+    func : Callable[[dict[str, object]], Awaitable[object]]
+        Coroutine function called with the results of the finished
+        stages (keyed by stage name), its return value is the result of
+        the stage
+    depends_on : list of str
+        The names of the stages that have to finish before this stage
+        starts
+    """
+    name: str
+    func: Callable[[dict[str, object]], Awaitable[object]]
+    depends_on: list[str] = field(default_factory=list)
+
+
+def _topological_order(stages: list[Stage]) -> list[Stage]:
+    """
+    Returns the stages ordered so every stage comes after its
+    dependencies
+
+    Parameters
+    ----------
+    stages : list[Stage]
+        The stages of the pipeline
+
+    Returns
+    -------
+    list[Stage]
+        The ordered stages
+
+    Raises
+    ------
+    ValueError
+        If a name is used twice, a dependency is unknown or the
+        dependencies contain a cycle
+    """
+    by_name = {}
+    for stage in stages:
+        if stage.name in by_name:
+            raise ValueError(f"Stage {stage.name!r} is defined twice")
+        by_name[stage.name] = stage
+    for stage in stages:
+        for dependency in stage.depends_on:
+            if dependency not in by_name:
+                raise ValueError(
+                    f"Stage {stage.name!r} depends on unknown stage "
+                    f"{dependency!r}"
+                )
+
+    ordered = []
+    state = {}  # name -> "visiting" | "done"
+
+    def visit(stage: Stage) -> None:
+        if state.get(stage.name) == "done":
+            return
+        if state.get(stage.name) == "visiting":
+            raise ValueError(f"Cycle in pipeline at stage {stage.name!r}")
+        state[stage.name] = "visiting"
+        for dependency in stage.depends_on:
+            visit(by_name[dependency])
+        state[stage.name] = "done"
+        ordered.append(stage)
+
+    for stage in stages:
+        visit(stage)
+    return ordered
+
+
+async def run_dag(stages: list[Stage]) -> dict[str, object]:
+    """
+    Runs the stages of a pipeline as a DAG. Every stage starts as soon
+    as all its dependencies have finished, independent stages run
+    concurrently. If a stage fails, the remaining stages are cancelled.
+
+    Parameters
+    ----------
+    stages : list[Stage]
+        The stages of the pipeline
+
+    Returns
+    -------
+    dict[str, object]
+        The results of the stages keyed by stage name
+
+    Raises
+    ------
+    ValueError
+        If the stages don't form a DAG
+    ExceptionGroup
+        If a stage fails
+    """
+    results = {}
+    tasks = {}
+
+    async def run_stage(stage: Stage) -> None:
+        for dependency in stage.depends_on:
+            await tasks[dependency]
+        logger.info(f"Start stage {stage.name}")
+        start = time.perf_counter()
+        results[stage.name] = await stage.func(results)
+        logger.info(
+            f"Finished stage {stage.name} in "
+            f"{time.perf_counter() - start:.1f}s"
+        )
+
+    async with asyncio.TaskGroup() as tg:
+        for stage in _topological_order(stages):
+            tasks[stage.name] = tg.create_task(run_stage(stage))
+
+    return results
@@ -0,0 +1,308 @@
+import os
+import json
+import time
+import threading
+from tqdm import tqdm
+
+from .token_usage import usage_tracker
+
+
+class ProgressReporter:
+    """
+    Central progress output of a run: one bar for the documents, one per
+    document and one per PII type, counted in chunks. The documents bar
+    shows the live throughput (chunks/min, LLM calls/s, tokens/s), tqdm
+    adds the ETA. Messages are written above the bars with tqdm.write, so
+    the output of the threads doesn't interleave with them. With a
+    metrics path, a snapshot (see snapshot) is written periodically by a
+    background thread.
+
+    Before start is called, the reporter only forwards messages to
+    stdout, so modules can report progress outside of a run.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._enabled = False
+        self._start = time.perf_counter()
+        self._documents_bar = None
+        self._document_bars = {}
+        self._pii_bars = {}
+        self._documents_total = 0
+        self._documents_done = 0
+        self._chunks_total = 0
+        self._chunks_done = 0
+        self._pii_counts = {}
+        self._metrics_path = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(
+        self,
+        total_documents: int,
+        metrics_path: str = None,
+        snapshot_interval: float = 30.0,
+        enabled: bool = True
+    ) -> None:
+        """
+        Starts the reporting of a run
+
+        Parameters
+        ----------
+        total_documents : int
+            The number of documents of the run
+        metrics_path : str
+            The path of the metrics snapshots (JSON), None disables them
+        snapshot_interval : float
+            The seconds between two snapshots
+        enabled : bool
+            If False, no bars are shown
+
+        Returns
+        -------
+        None
+        """
+        with self._lock:
+            self._enabled = enabled
+            self._start = time.perf_counter()
+            self._documents_total = total_documents
+            if enabled:
+                self._documents_bar = tqdm(
+                    total=total_documents, desc="Documents", unit="doc",
+                    position=0, dynamic_ncols=True
+                )
+        self._metrics_path = metrics_path
+        if metrics_path is not None:
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self._write_snapshots,
+                args=(snapshot_interval,),
+                name="metrics-snapshots",
+                daemon=True
+            )
+            self._thread.start()
+
+    def _bar(self, bars: dict, key: str, desc: str) -> tqdm | None:
+        if not self._enabled:
+            return None
+        if key not in bars:
+            bars[key] = tqdm(
+                total=0, desc=desc, unit="chunk", leave=False,
+                position=1 + len(self._pii_bars) + len(self._document_bars),
+                dynamic_ncols=True
+            )
+        return bars[key]
+
+    def add_work(self, doc_id: str, pii_name: str, chunks: int) -> None:
+        """
+        Adds the chunks a PII is extracted from in a document
+
+        Parameters
+        ----------
+        doc_id : str
+            The ID of the document.
+        pii_name : str
+            The name of the PII
+        chunks : int
+            The number of chunks
+
+        Returns
+        -------
+        None
+        """
+        with self._lock:
+            self._chunks_total += chunks
+            counts = self._pii_counts.setdefault(pii_name, [0, 0])
+            counts[1] += chunks
+            for bars, key in (
+                (self._document_bars, doc_id), (self._pii_bars, pii_name)
+            ):
+                bar = self._bar(bars, key, key)
+                if bar is not None:
+                    bar.total += chunks
+                    bar.refresh()
+
+    def advance(self, doc_id: str, pii_name: str, chunks: int = 1) -> None:
+        """
+        Counts processed (or skipped) chunks of a PII in a document
+
+        Parameters
+        ----------
+        doc_id : str
+            The ID of the document.
+        pii_name : str
+            The name of the PII
+        chunks : int
+            The number of chunks
+
+        Returns
+        -------
+        None
+        """
+        with self._lock:
+            self._chunks_done += chunks
+            self._pii_counts.setdefault(pii_name, [0, 0])[0] += chunks
+            for bars, key in (
+                (self._document_bars, doc_id), (self._pii_bars, pii_name)
+            ):
+                bar = self._bar(bars, key, key)
+                if bar is not None:
+                    bar.update(chunks)
+            if self._documents_bar is not None:
+                self._documents_bar.set_postfix_str(
+                    self._throughput_text(), refresh=False
+                )
+
+    def document_finished(self, doc_id: str) -> None:
+        """
+        Closes the bar of a finished document
+
+        Parameters
+        ----------
+        doc_id : str
+            The ID of the document.
+
+        Returns
+        -------
+        None
+        """
+        with self._lock:
+            self._documents_done += 1
+            bar = self._document_bars.pop(doc_id, None)
+            if bar is not None:
+                bar.close()
+            if self._documents_bar is not None:
+                self._documents_bar.update(1)
+
+    def message(self, text: str) -> None:
+        """
+        Writes a message above the bars
+
+        Parameters
+        ----------
+        text : str
+            The message
+
+        Returns
+        -------
+        None
+        """
+        if self._enabled:
+            tqdm.write(text)
+        else:
+            print(text)
+
+    def _throughput(self) -> dict[str, float]:
+        elapsed = max(time.perf_counter() - self._start, 1e-9)
+        tokens = usage_tracker.prompt_tokens + usage_tracker.completion_tokens
+        return {
+            "elapsed": elapsed,
+            "chunks_per_min": self._chunks_done * 60 / elapsed,
+            "llm_calls_per_s": usage_tracker.requests / elapsed,
+            "tokens_per_s": tokens / elapsed
+        }
+
+    def _throughput_text(self) -> str:
+        throughput = self._throughput()
+        return (
+            f"{throughput['chunks_per_min']:.1f} chunks/min, "
+            f"{throughput['llm_calls_per_s']:.2f} calls/s, "
+            f"{throughput['tokens_per_s']:.0f} tok/s"
+        )
+
+    def snapshot(self) -> dict:
+        """
+        Returns the current metrics of the run. The ETA extrapolates the
+        chunk throughput to the chunks registered so far, documents not
+        started yet are extrapolated with the mean chunks per document.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        dict
+            The metrics
+        """
+        with self._lock:
+            throughput = self._throughput()
+            started = len(self._document_bars) + self._documents_done
+            remaining = self._chunks_total - self._chunks_done
+            if started and self._documents_total > started:
+                remaining += (
+                    (self._documents_total - started)
+                    * self._chunks_total / started
+                )
+            rate = throughput["chunks_per_min"] / 60
+            return {
+                "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                **throughput,
+                "documents_done": self._documents_done,
+                "documents_total": self._documents_total,
+                "chunks_done": self._chunks_done,
+                "chunks_total": self._chunks_total,
+                "eta_s": remaining / rate if rate else None,
+                "llm_requests": usage_tracker.requests,
+                "prompt_tokens": usage_tracker.prompt_tokens,
+                "completion_tokens": usage_tracker.completion_tokens,
+                "pii": {
+                    pii_name: {"done": done, "total": total}
+                    for pii_name, (done, total) in self._pii_counts.items()
+                }
+            }
+
+    def write_snapshot(self) -> None:
+        """
+        Writes the current metrics to the metrics path, atomically
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        """
+        if self._metrics_path is None:
+            return
+        directory = os.path.dirname(os.path.abspath(self._metrics_path))
+        os.makedirs(directory, exist_ok=True)
+        temp_path = f"{self._metrics_path}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump(self.snapshot(), f, indent=4)
+        os.replace(temp_path, self._metrics_path)
+
+    def _write_snapshots(self, interval: float) -> None:
+        while not self._stop.wait(interval):
+            self.write_snapshot()
+
+    def close(self) -> None:
+        """
+        Writes the last snapshot and closes the bars
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        """
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        self.write_snapshot()
+        with self._lock:
+            for bar in list(self._document_bars.values()) \
+                    + list(self._pii_bars.values()):
+                bar.close()
+            self._document_bars.clear()
+            self._pii_bars.clear()
+            if self._documents_bar is not None:
+                self._documents_bar.close()
+                self._documents_bar = None
+            self._enabled = False
+
+
+progress = ProgressReporter()
@@ -0,0 +1,89 @@
+import re
+
+
+_TRAILING_WHITESPACE_RE = re.compile(r"[ \t]+$", re.MULTILINE)
+
+
+def normalize_prefix(text: str) -> str:
+    """
+    Byte-normalizes a static prompt part, so the same prompt always
+    results in the same bytes regardless of how it was built (line
+    endings, trailing whitespace, surrounding blank lines, indentation
+    left over from f-strings). Provider-side prefix caching only hits
+    on byte identical prefixes.
+
+    Parameters
+    ----------
+    text : str
+        The static prompt part
+
+    Returns
+    -------
+    str
+        The normalized prompt part
+    """
+    text = text.replace("\r\n", "\n").replace("\r", "\n")
+    text = _TRAILING_WHITESPACE_RE.sub("", text)
+    lines = text.strip("\n").split("\n")
+    indents = [
+        len(line) - len(line.lstrip(" "))
+        for line in lines if line.strip()
+    ]
+    if indents and min(indents) > 0:
+        cut = min(indents)
+        lines = [line[cut:] for line in lines]
+    return "\n".join(lines)
+
+
+def _tag(name: str, content: str) -> str:
+    """
+    Wraps the content in a XML tag
+
+    Parameters
+    ----------
+    name : str
+        The name of the tag
+    content : str
+        The content
+
+    Returns
+    -------
+    str
+        The tagged content
+    """
+    return f"<{name}>{content}</{name}>"
+
+
+def assemble_user_prompt(
+    prefix: list[tuple[str, str]],
+    suffix: list[tuple[str, str]],
+    text: str | None = None
+) -> str:
+    """
+    Assembles a user prompt as stable prefix followed by a variable
+    suffix. The prefix holds the static parts that are shared between
+    requests (PII name and description) and is byte-normalized, the
+    suffix holds the parts that differ between requests (e.g. the
+    solution to verify) and is left as is. The chunk text of a
+    verification fan-out is shared as well and goes between them, but
+    unchanged, since the positions are located in it.
+
+    Parameters
+    ----------
+    prefix : list[tuple[str, str]]
+        Tag names and contents of the stable parts, in order
+    suffix : list[tuple[str, str]]
+        Tag names and contents of the variable parts, in order
+    text : str | None
+        The chunk text, tagged as text, or None
+
+    Returns
+    -------
+    str
+        The user prompt
+    """
+    parts = [_tag(name, normalize_prefix(content)) for name, content in prefix]
+    if text is not None:
+        parts.append(_tag("text", text))
+    parts.extend(_tag(name, content) for name, content in suffix)
+    return "\n".join(parts)
@@ -0,0 +1,306 @@
+import os
+import json
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+from loguru import logger
+
+from . import llm_agents
+from . import utils
+from .progress import progress
+
+
+PROMPT_TYPES = ["extracting", "verifying", "issue"]
+LATEST_FILE = "LATEST"
+MANIFEST_FILE = "manifest.json"
+
+
+def resolve_version(versions_folder: str, version: str) -> str | None:
+    """
+    Resolves a prompt version name, "latest" is the version prepared last
+
+    Parameters
+    ----------
+    versions_folder : str
+        The folder holding the prompt versions
+    version : str
+        The name of the version or "latest"
+
+    Returns
+    -------
+    str | None
+        The name of the version or None if there is no latest version
+    """
+    if version != "latest":
+        return version
+    try:
+        with open(os.path.join(versions_folder, LATEST_FILE), "r") as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+# Stand-ins for the responses the meta expert reacts to in a document
+# conversation: a proposed solution after the extraction and a rejected
+# verdict after the verification
+_STEP_RESPONSES = {
+    "extracting": json.dumps([{"0": {
+        "identifier": "<identifier>", "context": "<context>"
+    }}]),
+    "verification": json.dumps({"0": {
+        "reasoning": "<reasoning>", "bool": False
+    }})
+}
+
+
+def _job_description(instructions: dict) -> str:
+    """
+    Returns the job description of meta expert instructions, see
+    MetaExpertConversation.add_next_step_meta_to_conversation
+
+    Parameters
+    ----------
+    instructions : dict
+        The instructions of the meta expert
+
+    Returns
+    -------
+    str
+        The job description
+    """
+    if "job description" in instructions:
+        return instructions["job description"]
+    return instructions["Instructions"]["job description"]
+
+
+def meta_expert_instructions(
+    pii_name: str,
+    agent: llm_agents.MetaPrompterIndependent
+) -> dict[str, dict]:
+    """
+    Collects the instructions of the meta expert for the extracting,
+    verifying and issue solving expert of a PII. The conversation of a
+    document is replayed without a document: after the opening
+    (extraction) instructions, the meta expert is told that the expert
+    proposed a solution and answers with the verification instructions,
+    then that the verifier rejected it and answers with the issue
+    solving instructions.
+
+    Parameters
+    ----------
+    pii_name : str
+        The name of the PII
+    agent : MetaPrompterIndependent
+        The meta expert
+
+    Returns
+    -------
+    dict[str, dict]
+        The instructions per prompt type
+    """
+    instructions, user_prompt = agent.start_meta_expert(pii_name=pii_name)
+    next_instruction_prompt = agent.prompts["meta_prompting"]["general"][
+        "next_instruction_meta"
+    ]
+    conversation_list = [{"role": "user", "content": user_prompt}]
+    collected = {"extracting": instructions}
+    for previous_step, prompt_type in (
+        ("extracting", "verifying"), ("verification", "issue")
+    ):
+        conversation_list.append({
+            "role": "assistant", "content": json.dumps(instructions)
+        })
+        conversation_list.append({
+            "role": "user",
+            "content": next_instruction_prompt
+            .replace("{{expert}}", _job_description(instructions))
+            .replace("{{previous_step}}", previous_step)
+            .replace("{{response}}", _STEP_RESPONSES[previous_step])
+        })
+        response = agent.send_prompt(
+            developer_prompt=agent.meta_expert_prompt,
+            conversation_list=conversation_list
+        )
+        try:
+            instructions = agent._extract_json_from_response(response)
+        except IndexError:
+            instructions = utils.extract_instruction(response)
+        collected[prompt_type] = instructions
+    return collected
+
+
+def prepare_pii_prompts(
+    pii_name: str,
+    prompt_creater: llm_agents.PromptCreater,
+    agent: llm_agents.MetaPrompterIndependent,
+    guidelines_paths: dict[str, str]
+) -> dict[str, str]:
+    """
+    Generates the extracting, verifying and issue prompts of a PII, each
+    from the instructions the meta expert gives its expert (see
+    meta_expert_instructions), and saves them with the prompt creator
+
+    Parameters
+    ----------
+    pii_name : str
+        The name of the PII
+    prompt_creater : PromptCreater
+        The prompt creator, saving to the folder of the version
+    agent : MetaPrompterIndependent
+        The meta expert
+    guidelines_paths : dict[str, str]
+        The guidelines per prompt type
+
+    Returns
+    -------
+    dict[str, str]
+        The prompts per type
+    """
+    instructions = meta_expert_instructions(pii_name=pii_name, agent=agent)
+    prompts = {}
+    for prompt_type in PROMPT_TYPES:
+        prompt = prompt_creater.create_prompt_with_examples(
+            instructions=instructions[prompt_type],
+            pii_name=pii_name,
+            guidelines_path=guidelines_paths[prompt_type],
+            type_prompt=prompt_type
+        )
+        prompts[prompt_type] = prompt_creater.process_feedback_loop(prompt)
+        prompt_creater.save_prompt_to_file(
+            prompt=prompts[prompt_type],
+            pii_name=pii_name,
+            type=prompt_type
+        )
+    return prompts
+
+
+def prepare_prompts(
+    versions_folder: str,
+    version: str,
+    pii_names: list[str],
+    prompt_handcrafted_folder: str,
+    property_yml_file_path: str,
+    prompt_config_yml_path: str,
+    guidelines_paths: dict[str, str],
+    base_url: str,
+    model_name_prompt_creater: str,
+    model_name_meta_expert: str,
+    api_key: str,
+    temperature: float,
+    refine_prompts: bool = False,
+    max_workers: int = 8
+) -> str:
+    """
+    Generates all prompts of all PIIs in parallel ahead of the document
+    processing and publishes them as a new version. The prompts are
+    written to a temporary folder which is renamed once all PIIs are
+    done, so a version is either complete or absent. Conversations read
+    a version with MetaExpertConversation.load_generated_prompts and
+    never write to it.
+
+    The layout of a version matches the per-document prompt folders:
+
+    <versions_folder>/<version>/independent/<pii_name>/<pii_name>_<type>.md
+
+    Parameters
+    ----------
+    versions_folder : str
+        The folder holding the prompt versions
+    version : str
+        The name of the new version
+    pii_names : list[str]
+        The PIIs to generate the prompts for
+    prompt_handcrafted_folder : str
+        The folder where the handcrafted prompts are stored
+    property_yml_file_path : str
+        The path to the property YAML file
+    prompt_config_yml_path : str
+        The path to the prompt config YAML file
+    guidelines_paths : dict[str, str]
+        The guidelines per prompt type
+    base_url : str
+        The base URL of the API
+    model_name_prompt_creater : str
+        The name of the model to use for the prompt creator
+    model_name_meta_expert : str
+        The name of the model to use for the meta expert
+    api_key : str
+        The API key
+    temperature : float
+        The temperature to use for the models
+    refine_prompts : bool
+        If True, the prompts are refined with the feedback loop
+    max_workers : int
+        The number of PIIs prepared concurrently
+
+    Returns
+    -------
+    str
+        The folder of the version
+    """
+    version_folder = os.path.join(versions_folder, version)
+    if os.path.exists(version_folder):
+        raise FileExistsError(f"Prompt version '{version}' already exists")
+    temp_folder = f"{version_folder}.tmp"
+    shutil.rmtree(temp_folder, ignore_errors=True)
+    start = time.perf_counter()
+
+    def prepare(pii_name: str) -> dict[str, str]:
+        prompt_creater = llm_agents.PromptCreater(
+            doc_id=version,
+            prompt_handcrafted_folder=prompt_handcrafted_folder,
+            prompt_folder_to_save=temp_folder,
+            api_key=api_key,
+            base_url=base_url,
+            model_name=model_name_prompt_creater,
+            category="independent",
+            property_yml_file=property_yml_file_path,
+            prompt_config_yml=prompt_config_yml_path,
+            refine_prompts=refine_prompts,
+            temperature=temperature
+        )
+        agent = llm_agents.MetaPrompterIndependent(
+            prompt_folder=prompt_handcrafted_folder,
+            doc_id=version,
+            model_name=model_name_meta_expert,
+            api_key=api_key,
+            base_url=base_url,
+            category="independent",
+            yml_file=property_yml_file_path,
+            prompt_creater=prompt_creater,
+            prompt_config_yml=prompt_config_yml_path,
+            temperature=temperature
+        )
+        prompts = prepare_pii_prompts(
+            pii_name=pii_name,
+            prompt_creater=prompt_creater,
+            agent=agent,
+            guidelines_paths=guidelines_paths
+        )
+        progress.message(f"Prepared prompts for {pii_name}")
+        return prompts
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(prepare, pii_names))
+
+    manifest = {
+        "version": version,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "model_prompt_creater": model_name_prompt_creater,
+        "model_meta_expert": model_name_meta_expert,
+        "temperature": temperature,
+        "refine_prompts": refine_prompts,
+        "pii_names": list(pii_names),
+        "prompt_types": PROMPT_TYPES
+    }
+    with open(os.path.join(temp_folder, MANIFEST_FILE), "w") as f:
+        json.dump(manifest, f, indent=4)
+    os.replace(temp_folder, version_folder)
+    with open(os.path.join(versions_folder, LATEST_FILE), "w") as f:
+        f.write(version)
+
+    logger.info(
+        f"Prepared prompt version '{version}' for {len(pii_names)} PIIs in "
+        f"{time.perf_counter() - start:.1f}s"
+    )
+    return version_folder
@@ -0,0 +1,170 @@
+import os
+import copy
+import threading
+import yaml
+
+
+class _FrozenDict(dict):
+    """
+    A dict that can't be changed after creation. It stays a dict, so it
+    can be dumped as JSON and prints like a dict in prompts.
+    """
+    def _immutable(self, *args, **kwargs):
+        raise TypeError(
+            "Objects handed out by the registry are shared and read-only"
+        )
+
+    __setitem__ = __delitem__ = _immutable
+    clear = pop = popitem = setdefault = update = _immutable
+    __ior__ = _immutable
+
+    def __deepcopy__(self, memo):
+        return {
+            key: copy.deepcopy(value, memo) for key, value in self.items()
+        }
+
+
+class _FrozenList(list):
+    """
+    A list that can't be changed after creation. It stays a list, so it
+    can be dumped as JSON and prints like a list in prompts.
+    """
+    def _immutable(self, *args, **kwargs):
+        raise TypeError(
+            "Objects handed out by the registry are shared and read-only"
+        )
+
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _immutable
+    append = extend = insert = pop = remove = _immutable
+    clear = reverse = sort = _immutable
+
+    def __deepcopy__(self, memo):
+        return [copy.deepcopy(value, memo) for value in self]
+
+
+def _freeze(obj: object) -> object:
+    """
+    Recursively converts dicts and lists into their read-only version
+
+    Parameters
+    ----------
+    obj : object
+        The object to freeze
+
+    Returns
+    -------
+    object
+        The frozen object
+    """
+    if isinstance(obj, dict):
+        return _FrozenDict((key, _freeze(value)) for key, value in obj.items())
+    if isinstance(obj, list):
+        return _FrozenList(_freeze(value) for value in obj)
+    return obj
+
+
+class FileRegistry:
+    """
+    Process-wide cache of parsed YAML files and prompt templates. Every
+    file is read and parsed once and handed out as a shared, read-only
+    reference. The modification time and size of a file are checked on
+    every access, so edited files are loaded again.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def _get(self, path: str, loader) -> object:
+        """
+        Returns the cached content of the file or loads it if it is not
+        cached or changed on disk
+
+        Parameters
+        ----------
+        path : str
+            The path to the file
+        loader : Callable[[str], object]
+            Reads and parses the file
+
+        Returns
+        -------
+        object
+            The content of the file
+
+        Raises
+        ------
+        FileNotFoundError
+            If the file doesn't exist
+        """
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        key = (loader, path)
+        signature = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == signature:
+                return entry[1]
+        content = loader(path)
+        with self._lock:
+            self._entries[key] = (signature, content)
+        return content
+
+    @staticmethod
+    def _load_text(path: str) -> str:
+        with open(path, "r") as file:
+            return file.read()
+
+    @staticmethod
+    def _load_yaml(path: str) -> object:
+        with open(path, "r") as file:
+            return _freeze(yaml.safe_load(file))
+
+    def read_text(self, path: str) -> str:
+        """
+        Returns the content of a text file, e.g. a prompt template
+
+        Parameters
+        ----------
+        path : str
+            The path to the file
+
+        Returns
+        -------
+        str
+            The content of the file
+        """
+        return self._get(path, self._load_text)
+
+    def read_yaml(self, path: str) -> dict:
+        """
+        Returns the read-only content of a YAML file
+
+        Parameters
+        ----------
+        path : str
+            The path to the YAML file
+
+        Returns
+        -------
+        dict
+            The content of the YAML file
+        """
+        return self._get(path, self._load_yaml)
+
+    def clear(self) -> None:
+        """
+        Drops all cached files
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        """
+        with self._lock:
+            self._entries.clear()
+
+
+registry = FileRegistry()
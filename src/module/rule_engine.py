@@ -0,0 +1,384 @@
+import re
+import json
+import bisect
+import time
+import uuid
+from dataclasses import dataclass
+from loguru import logger
+
+from .neo4j_conn import Neo4jConnection
+from . import prompt_layout
+from . import schemas
+
+
+_MONTH = (
+    r"(?:January|February|March|April|May|June|July|August|September|"
+    r"October|November|December)"
+)
+_NUMBER_WORD = (
+    r"(?:(?:twenty|thirty|forty|fifty|sixty|seventy|eighty|ninety)"
+    r"(?:-(?:one|two|three|four|five|six|seven|eight|nine))?|"
+    r"one|two|three|four|five|six|seven|eight|nine|ten|eleven|twelve|"
+    r"thirteen|fourteen|fifteen|sixteen|seventeen|eighteen|nineteen|"
+    r"hundred|thousand)"
+)
+_NUMBER = rf"(?:\d+(?:[.,]\d+)*|{_NUMBER_WORD})"
+_TIME_UNIT = r"(?:seconds?|minutes?|hours?|days?|weeks?|months?|years?)"
+_CURRENCY = (
+    r"(?:euros?|EUR|SEK|DKK|NOK|GBP|CHF|USD|TRL|pounds?(?: sterling)?|"
+    r"francs?|dollars?|lira|marks?|roubles?|kroner|kronor)"
+)
+_UNIT = (
+    r"(?:grams?|kilograms?|kg|tonnes?|km|kilometres?|metres?|meters?|"
+    r"square metres|hectares?|litres?|per cent|%)"
+)
+
+
+@dataclass
+class Rule:
+    """
+    A pattern of the rule engine. The whole match is the identifier,
+    surrounding conditions are expressed with lookarounds.
+
+    Attributes
+    ----------
+    pii_name : str
+        The PII the matches belong to (key in properties.yml)
+    name : str
+        The name of the rule, used in logs
+    pattern : str
+        The regex, matched case-insensitively unless it sets flags itself.
+        Matches have to start at the start of a word
+    borderline : bool
+        If True, matches are only kept after confirmation by the LLM
+    """
+    pii_name: str
+    name: str
+    pattern: str
+    borderline: bool = False
+
+
+@dataclass
+class RuleMatch:
+    """
+    A match of the rule engine
+
+    Attributes
+    ----------
+    pii_name : str
+        The PII of the match
+    rule : str
+        The name of the rule
+    identifier : str
+        The matched text
+    context : str
+        The sentence around the match
+    start : int
+        The start of the match in the text
+    end : int
+        The end of the match in the text
+    borderline : bool
+        If True, the match needs a confirmation
+    """
+    pii_name: str
+    rule: str
+    identifier: str
+    context: str
+    start: int
+    end: int
+    borderline: bool
+
+
+# Rules in order of priority: at a position the first matching rule wins,
+# e.g. "23 years old" is an age and not a duration
+DEFAULT_RULES = [
+    Rule("date", "day_month_year",
+         rf"\b\d{{1,2}}(?:\s+and\s+\d{{1,2}})?\s+{_MONTH}(?:\s+\d{{4}})?\b"),
+    Rule("date", "month_year", rf"\b{_MONTH}\s+\d{{4}}\b"),
+    Rule("date", "season_year",
+         r"\b(?:spring|summer|autumn|winter)\s+(?:of\s+)?\d{4}\b"),
+    Rule("date", "numeric", r"\b\d{1,2}[./]\d{1,2}[./](?:\d{4}|\d{2})\b"),
+    Rule("date", "decade", r"\b(?:1[89]|20)\d0s\b"),
+    Rule("date", "year_after_preposition",
+         r"(?<=\bin )(?:1[89]|20)\d{2}\b(?!\s*/)"),
+    Rule("date", "bare_year", r"\b(?:1[89]|20)\d{2}\b(?!\s*/)",
+         borderline=True),
+    Rule("age_number", "years_old",
+         rf"\b{_NUMBER}[\s-]years?(?=[\s-]old\b)"),
+    Rule("age_number", "aged", r"(?<=\baged )\d{1,3}\b"),
+    Rule("age_number", "age_of", rf"(?<=\bage of ){_NUMBER}\b"),
+    Rule("duration", "time_span",
+         rf"\b(?:{_NUMBER}|a|an)(?:\s+and\s+a\s+half)?[\s-]+{_TIME_UNIT}"
+         rf"(?:\s+and\s+{_NUMBER}\s+{_TIME_UNIT})?\b"),
+    Rule("code", "application_number", r"\b\d{2,6}/\d{2,4}\b"),
+    Rule("code", "numbered", r"(?<=\bno\. )(?-i:[A-Z0-9][\w./-]*\d)\b",
+         borderline=True),
+    Rule("code", "alphanumeric", r"\b(?-i:[A-Z]{1,4}-?\d{4,})\b",
+         borderline=True),
+    Rule("quantity", "currency_after",
+         rf"\b{_NUMBER}(?:\s+(?:million|billion))?\s+{_CURRENCY}\b"),
+    Rule("quantity", "currency_before",
+         rf"(?:\b{_CURRENCY}|[£€$])\s?\d+(?:[.,]\d+)*(?:\s+(?:million|billion))?"),
+    Rule("quantity", "measure", rf"\b{_NUMBER}\s+{_UNIT}(?!\w)"),
+    Rule("quantity", "counted_noun",
+         rf"\b{_NUMBER}\s+(?!{_TIME_UNIT}\b)[a-z]+s\b", borderline=True),
+]
+
+
+_SENTENCE_END_RE = re.compile(r"(?<=[.;!?])\s+(?=[A-Z(“\"])|\n")
+
+
+def _sentence_spans(text: str) -> list[tuple[int, int]]:
+    """
+    Splits the text into sentences
+
+    Parameters
+    ----------
+    text : str
+        The text
+
+    Returns
+    -------
+    list[tuple[int, int]]
+        The start and end of the sentences
+    """
+    spans = []
+    start = 0
+    for boundary in _SENTENCE_END_RE.finditer(text):
+        spans.append((start, boundary.start()))
+        start = boundary.end()
+    spans.append((start, len(text)))
+    return spans
+
+
+class RuleEngine:
+    """
+    Compiled rule-based extractor for the structured PII types. All rules
+    are compiled into one alternation, so a text is scanned once for all
+    types and overlapping candidates are resolved by rule priority.
+    Further rules can be plugged in with register.
+
+    Parameters
+    ----------
+    rules : list[Rule]
+        The rules in order of priority, defaults to DEFAULT_RULES
+    """
+    def __init__(self, rules: list[Rule] = None):
+        self._rules = list(DEFAULT_RULES if rules is None else rules)
+        self._compiled = None
+
+    @property
+    def pii_names(self) -> list[str]:
+        """
+        The PIIs handled by the rules
+        """
+        return list(dict.fromkeys(rule.pii_name for rule in self._rules))
+
+    def register(self, rule: Rule, before: str = None) -> None:
+        """
+        Adds a rule, by default with the lowest priority
+
+        Parameters
+        ----------
+        rule : Rule
+            The rule to add
+        before : str
+            The name of the rule the new rule gets priority over
+
+        Returns
+        -------
+        None
+        """
+        names = [existing.name for existing in self._rules]
+        index = names.index(before) if before in names else len(names)
+        self._rules.insert(index, rule)
+        self._compiled = None
+
+    def _compile(self) -> re.Pattern:
+        if self._compiled is None:
+            # All rules start at the start of a word, the common guard
+            # skips the positions inside words before the alternation
+            self._compiled = re.compile(
+                r"(?<!\w)(?:" + "|".join(
+                    f"(?P<r{i}>{rule.pattern})"
+                    for i, rule in enumerate(self._rules)
+                ) + ")",
+                re.IGNORECASE
+            )
+        return self._compiled
+
+    def extract(self, text: str) -> list[RuleMatch]:
+        """
+        Returns the non-overlapping matches of all rules in the text
+
+        Parameters
+        ----------
+        text : str
+            The text
+
+        Returns
+        -------
+        list[RuleMatch]
+            The matches in text order
+        """
+        matches = []
+        sentences = _sentence_spans(text)
+        starts = [start for start, _ in sentences]
+        for m in self._compile().finditer(text):
+            rule = self._rules[int(m.lastgroup[1:])]
+            first = bisect.bisect_right(starts, m.start()) - 1
+            last = max(first, bisect.bisect_left(starts, m.end()) - 1)
+            context = text[starts[first]:sentences[last][1]].strip()
+            matches.append(RuleMatch(
+                pii_name=rule.pii_name,
+                rule=rule.name,
+                identifier=m.group(),
+                context=context,
+                start=m.start(),
+                end=m.end(),
+                borderline=rule.borderline
+            ))
+        return matches
+
+
+def confirm_borderline(
+    agent,
+    confirm_prompt: str,
+    pii_name: str,
+    pii_description: str,
+    matches: list[RuleMatch]
+) -> list[RuleMatch]:
+    """
+    Lets the LLM confirm the borderline matches of a PII in one request
+
+    Parameters
+    ----------
+    agent : LLMAgent
+        The LLM agent
+    confirm_prompt : str
+        The developer prompt for the confirmation
+    pii_name : str
+        The name of the PII
+    pii_description : str
+        The description of the PII from properties.yml
+    matches : list[RuleMatch]
+        The borderline matches of the PII
+
+    Returns
+    -------
+    list[RuleMatch]
+        The confirmed matches
+    """
+    if not matches:
+        return []
+    candidates = {
+        str(i): {"identifier": match.identifier, "context": match.context}
+        for i, match in enumerate(matches)
+    }
+    user_prompt = prompt_layout.assemble_user_prompt(
+        prefix=[("pii", pii_name), ("pii_description", pii_description)],
+        suffix=[("candidates", json.dumps(candidates, ensure_ascii=False))]
+    )
+    response = agent.send_prompt(
+        developer_prompt=confirm_prompt,
+        conversation_list=[{"role": "user", "content": user_prompt}],
+        response_schema=schemas.VERIFICATION_SCHEMA
+    )
+    verdicts = agent._extract_json_from_response(response)
+    if not isinstance(verdicts, dict):
+        logger.warning(f"No verdicts for the borderline {pii_name} matches")
+        return []
+    return [
+        match for i, match in enumerate(matches)
+        if isinstance(verdicts.get(str(i)), dict)
+        and verdicts[str(i)].get("bool") is True
+    ]
+
+
+def extract_pii_rules(
+    engine: RuleEngine,
+    texts: list[str],
+    doc_id: str,
+    conn: Neo4jConnection,
+    property_dict: dict,
+    agent=None,
+    confirm_prompt: str = None,
+    pii_names: list[str] = None
+) -> dict[str, int]:
+    """
+    Extracts the structured PIIs with the rule engine and creates their
+    nodes in the same shape as the meta-prompting loop
+    (Neo4jConnection.create_nodes_pii_independent). Borderline matches
+    are sent to the LLM for confirmation if an agent is given and are
+    dropped otherwise.
+
+    Parameters
+    ----------
+    engine : RuleEngine
+        The rule engine
+    texts : list[str]
+        The chunks of the document (see utils.split_text)
+    doc_id : str
+        The ID of the document.
+    conn : Neo4jConnection
+        The connection to the Neo4j database
+    property_dict : dict
+        The content of properties.yml
+    agent : LLMAgent
+        The agent confirming the borderline matches
+    confirm_prompt : str
+        The developer prompt for the confirmation
+    pii_names : list[str]
+        The PIIs to extract, defaults to all PIIs of the engine
+
+    Returns
+    -------
+    dict[str, int]
+        The number of nodes created per PII
+    """
+    pii_names = pii_names or engine.pii_names
+    start = time.perf_counter()
+    matches = {pii_name: [] for pii_name in pii_names}
+    for text in texts:
+        for match in engine.extract(text):
+            if match.pii_name in matches:
+                matches[match.pii_name].append(match)
+    logger.info(
+        f"Rule engine scanned {doc_id} in "
+        f"{(time.perf_counter() - start) * 1000:.1f}ms"
+    )
+
+    conn.drop_node_categories(
+        categories=[pii_name.title() for pii_name in pii_names],
+        doc_id=doc_id
+    )
+    created = {}
+    for pii_name in pii_names:
+        certain = [m for m in matches[pii_name] if not m.borderline]
+        borderline = [m for m in matches[pii_name] if m.borderline]
+        if agent is not None and confirm_prompt is not None:
+            certain += confirm_borderline(
+                agent=agent,
+                confirm_prompt=confirm_prompt,
+                pii_name=pii_name,
+                pii_description=property_dict[pii_name]["description"],
+                matches=borderline
+            )
+        if certain:
+            conn.create_nodes_pii_independent(
+                pii=pii_name,
+                result=[
+                    {str(uuid.uuid4())[:16]: {
+                        "identifier": match.identifier,
+                        "context": match.context
+                    }}
+                    for match in certain
+                ],
+                doc_id=doc_id
+            )
+        created[pii_name] = len(certain)
+        logger.info(
+            f"Doc ({doc_id}) {pii_name}: {len(certain)} rule matches "
+            f"({len(borderline)} borderline)"
+        )
+    return created
@@ -0,0 +1,86 @@
+# JSON schemas for the structured output mode of the LLMAgent. They are
+# passed as `response_format` and mirror the answer templates of the
+# prompts, so the legacy parser can still read the constrained answers.
+# The verification verdicts are keyed by the UUID of the solution, which
+# can't be expressed in strict mode, hence strict is disabled throughout.
+
+_SOLUTION = {
+    "type": "object",
+    "properties": {
+        "reasoning": {"type": "string"},
+        "context": {"type": "string"},
+        "identifier": {"type": "string"}
+    },
+    "required": ["reasoning", "context", "identifier"]
+}
+
+_STRING_LIST = {"type": "array", "items": {"type": "string"}}
+
+EXTRACTION_SCHEMA = {
+    "name": "extraction",
+    "strict": False,
+    "schema": {
+        "type": "object",
+        "properties": {
+            "extracted_information": {
+                "type": "array",
+                "items": _SOLUTION
+            }
+        },
+        "required": ["extracted_information"]
+    }
+}
+
+VERIFICATION_SCHEMA = {
+    "name": "verification",
+    "strict": False,
+    "schema": {
+        "type": "object",
+        "additionalProperties": {
+            "type": "object",
+            "properties": {
+                "reasoning": {"type": "string"},
+                "bool": {"type": "boolean"}
+            },
+            "required": ["reasoning", "bool"]
+        }
+    }
+}
+
+NEXT_STEP_SCHEMA = {
+    "name": "next_step",
+    "strict": False,
+    "schema": {
+        "type": "object",
+        "properties": {
+            "Next": {
+                "type": "string",
+                "enum": ["extracting", "verification", "issues_solving", "end"]
+            }
+        },
+        "required": ["Next"]
+    }
+}
+
+PERSONS_SCHEMA = {
+    "name": "persons",
+    "strict": False,
+    "schema": {
+        "type": "object",
+        "properties": {
+            "Persons": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "full name": _STRING_LIST,
+                        "abbreviations": _STRING_LIST,
+                        "aliases": _STRING_LIST
+                    },
+                    "required": ["full name", "abbreviations", "aliases"]
+                }
+            }
+        },
+        "required": ["Persons"]
+    }
+}
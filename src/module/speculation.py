@@ -0,0 +1,105 @@
+import threading
+
+
+class SpeculationMetrics:
+    """
+    Measures the speculative mode of the conversation (see
+    MetaExpertConversation.speculative_loop) over the whole run. A
+    committed chunk skips the meta expert rounds after the extraction and
+    after the verification, the saved critical-path latency is estimated
+    with the mean duration of the meta expert rounds actually taken.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.chunks = 0
+        self.committed = 0
+        self.fallbacks = 0
+        self.meta_rounds = 0
+        self.meta_seconds = 0.0
+        self.skipped_rounds = 0
+
+    def record_meta_round(self, seconds: float) -> None:
+        """
+        Adds the duration of a meta expert round (next step decision and
+        instructions)
+
+        Parameters
+        ----------
+        seconds : float
+            The duration of the round
+
+        Returns
+        -------
+        None
+        """
+        with self._lock:
+            self.meta_rounds += 1
+            self.meta_seconds += seconds
+
+    def record_chunk(self, committed: bool, skipped_rounds: int) -> None:
+        """
+        Counts a chunk processed in speculative mode
+
+        Parameters
+        ----------
+        committed : bool
+            If True, all verdicts passed and the chunk was committed
+            without the issue solving loop
+        skipped_rounds : int
+            The number of meta expert rounds skipped for the chunk
+
+        Returns
+        -------
+        None
+        """
+        with self._lock:
+            self.chunks += 1
+            if committed:
+                self.committed += 1
+            else:
+                self.fallbacks += 1
+            self.skipped_rounds += skipped_rounds
+
+    def saved_seconds(self) -> float:
+        """
+        Returns the estimated critical-path latency saved over the run
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        float
+            The saved seconds
+        """
+        with self._lock:
+            if not self.meta_rounds:
+                return 0.0
+            return self.skipped_rounds * self.meta_seconds / self.meta_rounds
+
+    def summary(self) -> str:
+        """
+        Returns the committed and fallback chunks and the saved latency
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        str
+            The summary
+        """
+        saved = self.saved_seconds()
+        with self._lock:
+            per_chunk = saved / self.chunks if self.chunks else 0.0
+            return (
+                f"{self.chunks} chunks, {self.committed} committed early, "
+                f"{self.fallbacks} fell back to the full loop, "
+                f"{self.skipped_rounds} meta expert rounds skipped "
+                f"(~{saved:.1f}s saved, {per_chunk:.2f}s per chunk)"
+            )
+
+
+speculation_metrics = SpeculationMetrics()
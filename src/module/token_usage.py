@@ -0,0 +1,91 @@
+import threading
+
+
+class TokenUsageTracker:
+    """
+    Collects the token usage reported by the LLM API over the whole run,
+    including the prompt tokens served from the provider-side prompt
+    cache. Requests are sent from many threads, so updates are locked.
+
+    Attributes
+    ----------
+    requests : int
+        The number of requests with usage data
+    prompt_tokens : int
+        The number of prompt tokens
+    cached_tokens : int
+        The number of prompt tokens served from the prompt cache
+    completion_tokens : int
+        The number of completion tokens
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.completion_tokens = 0
+
+    def record(self, usage) -> None:
+        """
+        Adds the usage of a chat completion. Backends that don't report
+        cached tokens count as cache misses.
+
+        Parameters
+        ----------
+        usage : openai.types.CompletionUsage
+            The usage of the response, may be None
+
+        Returns
+        -------
+        None
+        """
+        if usage is None:
+            return
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached = getattr(details, "cached_tokens", None) or 0
+        with self._lock:
+            self.requests += 1
+            self.prompt_tokens += usage.prompt_tokens or 0
+            self.cached_tokens += cached
+            self.completion_tokens += usage.completion_tokens or 0
+
+    def hit_rate(self) -> float:
+        """
+        Returns the share of prompt tokens served from the prompt cache
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        float
+            The cached-token hit rate
+        """
+        with self._lock:
+            if not self.prompt_tokens:
+                return 0.0
+            return self.cached_tokens / self.prompt_tokens
+
+    def summary(self) -> str:
+        """
+        Returns a one line summary of the usage
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        str
+            The summary
+        """
+        return (
+            f"Requests: {self.requests}, prompt tokens: {self.prompt_tokens}, "
+            f"cached tokens: {self.cached_tokens} "
+            f"({self.hit_rate():.1%} hit rate), "
+            f"completion tokens: {self.completion_tokens}"
+        )
+
+
+usage_tracker = TokenUsageTracker()
@@ -5,10 +5,18 @@ import re
 import json
 import pprint
 from typing import Union
+from concurrent.futures import ThreadPoolExecutor
 import yaml
 from loguru import logger
-from .llm import LLMAgent
 from .neo4j_conn import Neo4jConnection
+from .registry import registry
+from .person_registry import PersonRegistry
+from . import candidate_filter as candidate_filter_module
+from .candidate_filter import CandidateFilter, filter_metrics
+from .gazetteer import Gazetteer
+from .identifier_memory import IdentifierMemory
+from . import agent_factory
+from .progress import progress
 from . import llm_agents_static
 from . import llm_agents
 
@@ -113,10 +121,7 @@ def read_prompt(
         prompt_file_name
     )
 
-    with open(prompt_path, "r") as file:
-        prompt = file.read()
-
-    return prompt
+    return registry.read_text(prompt_path)
 
 
 def set_prompts_argument(
@@ -319,12 +324,22 @@ def extract_pii_static(
     api_key: str,
     base_url: str,
     conn: Neo4jConnection,
+    structured_output: bool = False,
+    parallel_chunks: bool = False,
+    max_workers: int = 8,
 ) -> None:
     """
     Extracts PIIs from the text and creates nodes in the database
     by starting the conversation loop. This function handles
     manually crafted prompts and not dynamically generated ones.
 
+    In the serial mode every chunk sees the persons found in the
+    previous chunks. In the parallel mode all chunks are extracted
+    concurrently without that context, their persons are merged locally
+    in chunk order (overlapping full names, abbreviations and aliases
+    are the same person, see PersonRegistry.merge) and the single
+    ResultCorrecter pass condenses the rest.
+
     Parameters
     ----------
     pii_name : str
@@ -345,24 +360,33 @@ def extract_pii_static(
         The API key to use
     conn : Neo4jConnection
         The connection to the Neo4j database
+    structured_output : bool
+        If True, JSON schema constrained output is requested
+    parallel_chunks : bool
+        If True, the chunks are extracted concurrently
+    max_workers : int
+        The maximal number of concurrently extracted chunks in the
+        parallel mode
+
     Returns
     -------
     None
     """
     text_splitted = split_text(text)
-    agent = LLMAgent(
-        local=False,
+    agent = agent_factory.get_agent(
         model_name=model_name,
-        api_key=api_key,
         base_url=base_url,
-        prompt_folder=None,
-        temperature=temperature
+        temperature=temperature,
+        api_key=api_key,
+        structured_output=structured_output
     )
+    persons = PersonRegistry(doc_id=doc_id)
     correcter = llm_agents_static.ResultCorrecter(
         agent=agent,
         prompt_folder=prompt_folder,
         conn=conn,
-        doc_id=doc_id
+        doc_id=doc_id,
+        person_registry=persons
     )
 
     if drop_category:
@@ -371,22 +395,45 @@ def extract_pii_static(
             doc_id=doc_id
         )
 
-    for i, text in enumerate(text_splitted):
-        print(f"Processing text {i + 1}/{len(text_splitted)}")
-        logger.info(f"\n\nProcessing text: {text}")
-        conv = llm_agents_static.MetaExpertConversation(
-            agent=agent,
-            text=text,
-            prompt_folder=prompt_folder,
-            conn=conn,
-            doc_id=doc_id
-        )
-        result = conv.conversation_loop()
-        if result:
-            conn.create_nodes_individual(
-                result=result,
-                doc_id=doc_id
+    progress.add_work(doc_id, pii_name, len(text_splitted))
+    if parallel_chunks:
+        def extract_chunk(chunk: str) -> dict:
+            logger.info(f"\n\nProcessing text: {chunk}")
+            conv = llm_agents_static.MetaExpertConversation(
+                agent=agent,
+                text=chunk,
+                prompt_folder=prompt_folder,
+                conn=conn,
+                doc_id=doc_id,
+                person_registry=PersonRegistry(doc_id=doc_id)
             )
+            result = conv.conversation_loop()
+            progress.advance(doc_id, pii_name)
+            return result
+
+        logger.info(f"Processing {len(text_splitted)} texts in parallel")
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # map keeps the chunk order, so the merge is deterministic
+            results = list(executor.map(extract_chunk, text_splitted))
+        for result in results:
+            if result:
+                persons.merge(result)
+    else:
+        for i, text in enumerate(text_splitted):
+            logger.info(f"Processing text {i + 1}/{len(text_splitted)}")
+            logger.info(f"\n\nProcessing text: {text}")
+            conv = llm_agents_static.MetaExpertConversation(
+                agent=agent,
+                text=text,
+                prompt_folder=prompt_folder,
+                conn=conn,
+                doc_id=doc_id,
+                person_registry=persons
+            )
+            result = conv.conversation_loop()
+            progress.advance(doc_id, pii_name)
+            if result:
+                persons.merge(result)
 
     correcter.correct_result()
 
@@ -411,12 +458,30 @@ def extract_pii_dynamic(
     guidelines_path_verify: str,
     conn: Neo4jConnection,
     refine_prompts=False,
+    refine_candidates: int = 1,
+    refine_time_budget: float = None,
     generate_new_prompt: bool = False,
     temperature: float = 0.5,
-) -> None:
+    structured_output: bool = False,
+    candidate_filter: CandidateFilter = None,
+    gazetteer: Gazetteer = None,
+    identifier_memory: IdentifierMemory = None,
+    speculative: bool = False,
+    prepared_prompt_folder: str = None,
+    masked_identifiers: list[str] = None
+) -> list[str]:
     """
     Extracts PIIs from the text and creates nodes in the database by starting
     the conversation loop. This function handles dynamically generated prompts.
+    With a candidate filter, chunks without evidence for the PII are skipped
+    or extracted with a single call. With a gazetteer, the known names of
+    the PII found in a chunk are passed to the extraction as hints, and
+    chunks in which the gazetteer knows every capitalized word are resolved
+    from it without the LLM. With an identifier memory, the identifiers of
+    previous documents are added to the hints, the masked identifiers
+    the memory confirmed often enough are not sent to the verifier.
+    In speculative mode, chunks whose first solutions all pass the
+    verification are committed without the meta expert rounds.
 
     Parameters
     ----------
@@ -458,14 +523,36 @@ def extract_pii_dynamic(
         The connection to the Neo4j database
     refine_prompts : bool
         If True, the prompts will be refined
+    refine_candidates : int
+        The number of revisions refined in parallel per feedback round
+    refine_time_budget : float
+        The wall-clock budget of the parallel feedback loop in seconds
     generate_new_prompt: bool
         IF True, a new prompt will be generated at every step
     temperature : float
         The temperature to use for the model
+    structured_output : bool
+        If True, JSON schema constrained output is requested
+    candidate_filter : CandidateFilter
+        The local pre-filter deciding per chunk how the PII is extracted,
+        if None every chunk runs the full conversation
+    gazetteer : Gazetteer
+        The gazetteer tagging candidate spans of the PII in every chunk
+    identifier_memory : IdentifierMemory
+        The identifiers confirmed in previous documents
+    speculative : bool
+        If True, the speculative loop of the conversation is used
+    prepared_prompt_folder : str
+        The folder of a prompt version prepared ahead of the processing,
+        see prompt_preparation.prepare_prompts
+    masked_identifiers : list[str]
+        The identifiers of the PII masked by the identifier memory
 
     Returns
     -------
-    None
+    list[str]
+        The identifiers whose verdict passed in a verified conversation,
+        see MetaExpertConversation.verified_identifiers
     """
     if drop_category:
         conn.drop_node_category(
@@ -484,6 +571,8 @@ def extract_pii_dynamic(
         property_yml_file=property_yml_file_path,
         prompt_config_yml=prompt_config_yml_path,
         refine_prompts=refine_prompts,
+        refine_candidates=refine_candidates,
+        refine_time_budget=refine_time_budget,
         temperature=temperature
     )
     agent_independent = llm_agents.MetaPrompterIndependent(
@@ -497,11 +586,42 @@ def extract_pii_dynamic(
         yml_file=property_yml_file_path,
         prompt_creater=prompt_creater,
         prompt_config_yml=prompt_config_yml_path,
-        temperature=temperature
+        temperature=temperature,
+        structured_output=structured_output
     )
+    progress.add_work(doc_id, pii_name, len(text_splitted))
+    verified = []
     for i, text in enumerate(text_splitted):
-        print(f"Doc ({doc_id}) {pii_name}: Processing text {i+1}/{len(text_splitted)}")
+        decision = candidate_filter_module.FULL
+        if candidate_filter is not None:
+            decision = candidate_filter.decide(text, pii_name)
+            filter_metrics.record_decision(pii_name, decision)
+            if decision == candidate_filter_module.SKIP \
+                    and not candidate_filter.audit:
+                logger.info(f"Doc ({doc_id}) {pii_name}: Skipping text {i+1}/{len(text_splitted)}")
+                progress.advance(doc_id, pii_name)
+                continue
+        logger.info(f"Doc ({doc_id}) {pii_name}: Processing text {i+1}/{len(text_splitted)}")
         logger.info(f"\n\nProcessing text for {pii_name}: {text}")
+        if gazetteer is not None and pii_name in gazetteer.labels:
+            # Chunks whose capitalized words are all known names need no
+            # LLM call, the names of the PII are the result
+            resolved = gazetteer.resolve(text, pii_name)
+            if resolved is not None:
+                logger.info(f"Doc ({doc_id}) {pii_name}: Text {i+1}/{len(text_splitted)} resolved by the gazetteer")
+                conn.create_nodes_pii_independent(
+                    pii=pii_name,
+                    result=resolved,
+                    doc_id=doc_id
+                )
+                progress.advance(doc_id, pii_name)
+                continue
+        hints = gazetteer.tag(text, pii_name) if gazetteer else []
+        if identifier_memory is not None:
+            hints += [
+                hint for hint in identifier_memory.find(text, pii_name)
+                if hint not in hints
+            ]
         conv = llm_agents.MetaExpertConversationIndependet(
             agent=agent_independent,
             prompt_generator=prompt_creater,
@@ -512,11 +632,35 @@ def extract_pii_dynamic(
             guidelines_path_extracting=guidelines_path_extracting,
             guidelines_path_issue=guidelines_path_issue,
             guidelines_path_verify=guidelines_path_verify,
-            refine_prompts=refine_prompts
+            refine_prompts=refine_prompts,
+            hints=hints or None,
+            prepared_prompt_folder=prepared_prompt_folder,
+            masked_identifiers=masked_identifiers
         )
-        result = conv.conversation_loop()
+        result = None
+        if decision == candidate_filter_module.SINGLE_CALL \
+                and not candidate_filter.audit:
+            result = conv.single_call()
+        if result is None:
+            if speculative:
+                result = conv.speculative_loop()
+            else:
+                result = conv.conversation_loop()
+            verified += conv.verified_identifiers(result)
+            if decision == candidate_filter_module.FULL \
+                    and candidate_filter is not None:
+                filter_metrics.record_full_conversation(
+                    pii_name, len(conv.step_queue)
+                )
+        if candidate_filter is not None and candidate_filter.audit \
+                and decision != candidate_filter_module.FULL:
+            filter_metrics.record_audit(
+                pii_name, sum(len(solution) for solution in result)
+            )
         conn.create_nodes_pii_independent(
             pii=pii_name,
             result=result,
             doc_id=doc_id
-        )
\ No newline at end of file
+        )
+        progress.advance(doc_id, pii_name)
+    return verified
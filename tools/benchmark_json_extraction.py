@@ -0,0 +1,185 @@
+"""
+Microbenchmark of the single pass JSON extractor against the former
+regex/json.loads cascade of LLMAgent._extract_json_from_response.
+
+Recorded responses can be passed as a JSON file holding a list of
+strings or as a JSONL file with a "response" key per line:
+
+    poetry run python -m tools.benchmark_json_extraction --responses responses.jsonl
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import timeit
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from src.module.json_extraction import extract_json
+
+
+SAMPLE_RESPONSES = [
+    # Extraction with a fenced block and prose around it
+    """Here is the result of the extraction.
+
+```json
+{
+  "extracted_information": [
+    {"reasoning": "The text names a date.", "context": "On 16 October 1996 a daughter was born", "identifier": "16 October 1996"},
+    {"reasoning": "Year of birth.", "context": "The applicant was born in 1952", "identifier": "1952"}
+  ]
+}
+```
+Let me know if anything else is needed.""",
+    # Bare verification verdict
+    '{"3f2a9c1e-77b0-4c": {"reasoning": "The identifier is a date.", "bool": true}}',
+    # Verification verdict with single quotes and a trailing comma
+    "```json\n{'3f2a9c1e-77b0-4c': {'reasoning': 'It isn\\'t a code.', 'bool': False,},}\n```",
+    # Meta expert instructions without a language tag
+    """**Instructions**
+```
+{"job description": "Expert Legal Analyst", "instructions": ["Read the text", "Extract all codes"]}
+```""",
+    # Long verifier reasoning with bracketed references before bare JSON
+    "The applicant's complaint {under Article 6} is addressed in [1] and [2]. " * 40
+    + '{"extracted_information": ['
+    + ", ".join(
+        '{"reasoning": "Date of a hearing.", "context": "hearing on %d May 1999", "identifier": "%d May 1999"}' % (i, i)
+        for i in range(1, 25)
+    )
+    + "]}",
+    # Persons without backticks, prefixed by prose containing brackets
+    """I found the following persons [see below]:
+{"Persons": [{"full name": ["Gunnar Bodén"], "abbreviations": ["G.B."], "aliases": ["the applicant"]}]}""",
+    # Pathological prose: thousands of openings without a balanced end,
+    # quadratic if every opening walks to the end of the text again
+    '["x" ' * 2000,
+]
+
+
+def legacy_extract_json_erroneous(response: str) -> dict:
+    m = re.search(r'{\s*"extracted_information"\s*:\s*\[', response)
+    if m:
+        start = m.start()
+        depth = 0
+        in_str = False
+        escape = False
+        end = None
+        for i, ch in enumerate(response[start:], start=start):
+            if in_str:
+                if escape:
+                    escape = False
+                elif ch == '\\':
+                    escape = True
+                elif ch == '"':
+                    in_str = False
+            else:
+                if ch == '"':
+                    in_str = True
+                elif ch == '{':
+                    depth += 1
+                elif ch == '}':
+                    depth -= 1
+                    if depth == 0:
+                        end = i + 1
+                        break
+        if end is not None:
+            return json.loads(response[start:end].strip())
+
+
+def legacy_extract_json(response: str) -> dict:
+    errors = (AttributeError, json.JSONDecodeError, IndexError)
+    try:
+        return json.loads(
+            re.search(r"```json\s([\s\S]*?)```", response).group(1)
+        )
+    except errors:
+        pass
+    try:
+        return json.loads(
+            re.search(r"(?s)`\s*(\{.*?\})\s*`", response).group(1)
+        )
+    except errors:
+        pass
+    try:
+        return json.loads(response)
+    except errors:
+        pass
+    try:
+        match = re.findall(r"```json\s*\n([\s\S]*?)\n```", response)[0]
+        return match.replace("```json", "")
+    except errors:
+        pass
+    try:
+        return json.loads(
+            re.search(r"```(.*?)```", response, re.DOTALL).group(1)
+        )
+    except errors:
+        pass
+    try:
+        return legacy_extract_json_erroneous(response)
+    except errors:
+        return None
+
+
+def load_responses(path: str) -> list[str]:
+    """
+    Loads recorded responses from a JSON or JSONL file
+
+    Parameters
+    ----------
+    path : str
+        The path to the file
+
+    Returns
+    -------
+    list[str]
+        The recorded responses
+    """
+    with open(path, "r") as f:
+        content = f.read()
+    try:
+        data = json.loads(content)
+        return [d["response"] if isinstance(d, dict) else d for d in data]
+    except json.JSONDecodeError:
+        return [
+            json.loads(line)["response"]
+            for line in content.splitlines() if line.strip()
+        ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--responses", type=str, default=None)
+    parser.add_argument("--number", type=int, default=2000)
+    args = parser.parse_args()
+
+    responses = (
+        load_responses(args.responses) if args.responses
+        else SAMPLE_RESPONSES
+    )
+
+    print(f"{'#':>3} {'legacy µs':>10} {'scanner µs':>11} {'speedup':>8}  path / agreement")
+    total_legacy = total_new = 0.0
+    for i, response in enumerate(responses):
+        legacy = timeit.timeit(
+            lambda: legacy_extract_json(response), number=args.number
+        ) / args.number * 1e6
+        new = timeit.timeit(
+            lambda: extract_json(response), number=args.number
+        ) / args.number * 1e6
+        total_legacy += legacy
+        total_new += new
+        value, path = extract_json(response)
+        legacy_value = legacy_extract_json(response)
+        if legacy_value is None and value is not None:
+            agreement = "recovered"
+        else:
+            agreement = "same" if legacy_value == value else "differs"
+        print(f"{i:>3} {legacy:>10.1f} {new:>11.1f} {legacy / new:>7.1f}x  {path} / {agreement}")
+
+    print(f"total {total_legacy:>8.1f} {total_new:>11.1f} {total_legacy / total_new:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
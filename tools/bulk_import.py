@@ -0,0 +1,187 @@
+"""
+Loads the per-document results of the pipeline (<doc_id>.json in the
+output folder, see Neo4jConnection.save_nodes_as_json) into Neo4j in
+bulk, for analyses over many documents.
+
+With --csv-dir the nodes are written as one CSV per label for the
+offline importer, which builds a new database without transactions:
+
+    poetry run python -m tools.bulk_import output --csv-dir import
+    neo4j-admin database import full --multiline-fields=true \
+        --array-delimiter=U+001F --nodes=import/Facility.csv ... neo4j
+
+Without it, the nodes are written to the running database with batched
+UNWIND queries (Neo4jConnection.bulk_create_nodes) under the label
+Run_import, or Run_<RUN_ID> if RUN_ID is set. The run ID has to be one
+that isn't a timestamp, otherwise the cleanup of the pipeline deletes
+the imported nodes after RUN_RETENTION_HOURS. Both paths report the
+throughput in nodes/s.
+
+    poetry run python -m tools.bulk_import output --batch-size 20000
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from dotenv import load_dotenv
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from src.module.neo4j_conn import Neo4jConnection
+
+
+# Separator of the array values in the CSVs: the unit separator, which
+# doesn't occur in the documents and is removed from the values anyway
+ARRAY_DELIMITER = "\x1f"
+ARRAY_DELIMITER_OPTION = "U+001F"
+
+# Imports are written under a fixed run ID. Run IDs which don't start
+# with a timestamp are never deleted by Neo4jConnection.cleanup_runs
+IMPORT_RUN_ID = "import"
+
+
+def node_labels(node: dict) -> list[str]:
+    """
+    Returns the labels of an exported node. Exports written before the
+    labels were included only tell the persons apart.
+    """
+    if node.get("labels"):
+        return list(node["labels"])
+    if "abbreviations" in node:
+        return ["Entity_designation"]
+    return []
+
+
+def read_results(results_dir: str) -> dict[str, list[dict]]:
+    """
+    Reads the result files of a run and groups their nodes by label.
+    Every node gets an import_id from its document, label and uuid (or
+    name), unique within the run.
+    """
+    nodes_by_label = {}
+    skipped = 0
+    for file_name in sorted(os.listdir(results_dir)):
+        if not file_name.endswith(".json") \
+                or file_name.endswith("_positions.json") \
+                or file_name == "final.json":
+            continue
+        with open(os.path.join(results_dir, file_name), "r") as f:
+            nodes = json.load(f)
+        doc_id = file_name[:-len(".json")]
+        for number, node in enumerate(nodes):
+            labels = node_labels(node)
+            if not labels:
+                skipped += 1
+                continue
+            properties = {
+                key: value for key, value in node.items() if key != "labels"
+            }
+            properties.setdefault("doc_id", doc_id)
+            key = properties.get("uuid") or properties.get("name") or number
+            nodes_by_label.setdefault(labels[0], []).append({
+                "import_id": f"{doc_id}:{labels[0]}:{key}",
+                "properties": properties
+            })
+    if skipped:
+        print(f"Skipped {skipped} nodes without labels")
+    return nodes_by_label
+
+
+def write_admin_csvs(
+    nodes_by_label: dict[str, list[dict]],
+    csv_dir: str
+) -> list[str]:
+    """
+    Writes one CSV per label with the header format of neo4j-admin
+    database import: the import_id as :ID, the label as :LABEL and the
+    list properties as string[]. Returns the paths of the CSVs.
+    """
+    os.makedirs(csv_dir, exist_ok=True)
+    paths = []
+    for label, nodes in nodes_by_label.items():
+        keys = sorted({
+            key for node in nodes for key in node["properties"]
+        })
+        arrays = {
+            key for node in nodes for key, value in node["properties"].items()
+            if isinstance(value, list)
+        }
+        path = os.path.join(csv_dir, f"{label}.csv")
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(
+                ["import_id:ID", ":LABEL"]
+                + [f"{key}:string[]" if key in arrays else key for key in keys]
+            )
+            for node in nodes:
+                row = [node["import_id"], label]
+                for key in keys:
+                    value = node["properties"].get(key)
+                    if value is None:
+                        row.append("")
+                    elif key in arrays:
+                        items = value if isinstance(value, list) else [value]
+                        row.append(ARRAY_DELIMITER.join(
+                            str(item).replace(ARRAY_DELIMITER, " ")
+                            for item in items if item is not None
+                        ))
+                    else:
+                        row.append(value)
+                writer.writerow(row)
+        paths.append(path)
+    return paths
+
+
+def report(action: str, count: int, elapsed: float) -> None:
+    """Prints the number of nodes and the throughput of a step."""
+    print(
+        f"{action} {count} nodes in {elapsed:.2f}s "
+        f"({count / max(elapsed, 1e-9):.0f} nodes/s)"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("results_dir", type=str)
+    parser.add_argument("--csv-dir", type=str, default=None)
+    parser.add_argument("--batch-size", type=int, default=10000)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    nodes_by_label = read_results(args.results_dir)
+    count = sum(len(nodes) for nodes in nodes_by_label.values())
+    report("Read", count, time.perf_counter() - start)
+
+    if args.csv_dir is not None:
+        start = time.perf_counter()
+        paths = write_admin_csvs(nodes_by_label, args.csv_dir)
+        report("Wrote", count, time.perf_counter() - start)
+        # The contexts are quoted over several lines
+        print(
+            "neo4j-admin database import full --multiline-fields=true "
+            f"--array-delimiter={ARRAY_DELIMITER_OPTION} "
+            + " ".join(f"--nodes={path}" for path in paths)
+            + " <database>"
+        )
+        return
+
+    load_dotenv()
+    conn = Neo4jConnection(
+        uri=os.getenv("NEO4J_URI", "bolt://neo4j:7687"),
+        user=os.getenv("NEO4J_USER", "neo4j"),
+        pwd=os.getenv("NEO4J_PASSWORD", "neo4jneo4j"),
+        run_id=os.getenv("RUN_ID", IMPORT_RUN_ID)
+    )
+    start = time.perf_counter()
+    for label, nodes in nodes_by_label.items():
+        label_start = time.perf_counter()
+        conn.bulk_create_nodes(label, nodes, batch_size=args.batch_size)
+        report(f"  {label}:", len(nodes), time.perf_counter() - label_start)
+    report(f"Imported into {conn.run_label}:", count,
+           time.perf_counter() - start)
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+Compares the serial and the parallel chunk mode of the static person
+extraction (utils.extract_pii_static) on one text: wall-clock time of
+both modes and the entity-level recall of the parallel mode against the
+serial one. A serial person counts as found if one of its names (full
+name, abbreviations, non-generic aliases) belongs to a parallel person.
+
+Needs the same .env as the CLI and a running Neo4j:
+
+    poetry run python -m tools.compare_static_modes --text path/to/document.txt
+"""
+import argparse
+import os
+import sys
+import time
+from dotenv import load_dotenv
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from src.module import utils
+from src.module import agent_factory
+from src.module.neo4j_conn import Neo4jConnection, as_list
+from src.module.person_registry import _GENERIC_ALIASES, _normalize
+
+
+def person_names(node: dict) -> set[str]:
+    """Returns the normalized names a person node is known under."""
+    names = as_list(node.get("full_name"))
+    names += as_list(node.get("abbreviations"))
+    names += as_list(node.get("aliases"))
+    return {
+        _normalize(name) for name in names
+        if _normalize(name) not in _GENERIC_ALIASES
+    }
+
+
+def run_mode(
+    conn: Neo4jConnection,
+    text: str,
+    doc_id: str,
+    parallel_chunks: bool
+) -> tuple[float, list[dict]]:
+    """Runs the static extraction and returns time and person nodes."""
+    start = time.perf_counter()
+    utils.extract_pii_static(
+        pii_name="Entity_designation",
+        text=text,
+        doc_id=doc_id,
+        drop_category=True,
+        prompt_folder=os.path.abspath(os.path.join(
+            os.path.dirname(__file__), "../prompts/recognize"
+        )),
+        model_name=os.getenv("MODEL_PROMPT_CREATER"),
+        temperature=float(os.getenv("TEMPERATURE")),
+        api_key=os.getenv("API_KEY"),
+        base_url=os.getenv("BASE_URL"),
+        conn=conn,
+        structured_output=bool(int(os.getenv("STRUCTURED_OUTPUT", "0"))),
+        parallel_chunks=parallel_chunks
+    )
+    elapsed = time.perf_counter() - start
+    nodes = conn.read_nodes(doc_id=doc_id, labels=["Entity_designation"])
+    conn.drop_node_category(category="Entity_designation", doc_id=doc_id)
+    return elapsed, nodes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--text", type=str, required=True)
+    parser.add_argument("--runs", type=int, default=1)
+    args = parser.parse_args()
+
+    load_dotenv()
+    conn = Neo4jConnection(
+        uri=os.getenv("NEO4J_URI", "bolt://neo4j:7687"),
+        user=os.getenv("NEO4J_USER", "neo4j"),
+        pwd=os.getenv("NEO4J_PASSWORD", "neo4jneo4j")
+    )
+    with open(args.text, "r", encoding="utf-8") as f:
+        text = f.read()
+    doc_id = os.path.splitext(os.path.basename(args.text))[0]
+
+    for run in range(args.runs):
+        serial_time, serial_nodes = run_mode(
+            conn, text, f"{doc_id}_serial", parallel_chunks=False
+        )
+        parallel_time, parallel_nodes = run_mode(
+            conn, text, f"{doc_id}_parallel", parallel_chunks=True
+        )
+
+        parallel_names = set()
+        for node in parallel_nodes:
+            parallel_names |= person_names(node)
+        serial_persons = [
+            names for names in map(person_names, serial_nodes) if names
+        ]
+        found = sum(1 for names in serial_persons if names & parallel_names)
+        recall = found / len(serial_persons) if serial_persons else 1.0
+
+        print(f"Run {run + 1}/{args.runs}")
+        print(f"  serial:   {serial_time:8.1f}s  {len(serial_nodes)} persons")
+        print(
+            f"  parallel: {parallel_time:8.1f}s  {len(parallel_nodes)} persons"
+            f"  ({serial_time / parallel_time:.2f}x)"
+        )
+        print(
+            f"  entity recall vs. serial: {recall:.1%} "
+            f"({found}/{len(serial_persons)})"
+        )
+
+    agent_factory.close()
+    conn.delete_run()
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()